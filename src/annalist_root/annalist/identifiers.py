@@ -131,6 +131,7 @@ ANNAL = makeNamespace("annal", "http://purl.org/annalist/2014/#",
     # Properties in internal entities
     , "id", "type_id", "type"
     , "url", "uri", "record_type"
+    , "migration_version"
     # Types, Views, lists and field groups
     , "default_type", "default_view"
     , "supertype_uri"
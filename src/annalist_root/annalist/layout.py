@@ -68,11 +68,16 @@ SITE_COLL_VIEW          = "c/%(id)s/"
 SITE_COLL_PATH          = "c/%(id)s"
 SITE_COLL_META_REF      = "c/%(id)s/_annalist_collection/"          # Used for testing
 SITE_CONTEXT_FILE       = "site_context.jsonld"                     # Unused?
+SITE_STORE_FILE         = "entity_store.sqlite3"                    # SQLite entity storage
+SITE_COLLECTIONS_STAMP_FILE = "site_collections_stamp.json"         # collections directory stamp
 
 COLL_TYPEID             = "_coll"
 COLL_META_DIR           = "_annalist_collection"
 COLL_META_FILE          = "coll_meta.jsonld"
 COLL_PROV_FILE          = "coll_prov.jsonld"
+COLL_GENERATION_FILE    = "coll_generation.json"                    # configuration generation stamp
+COLL_MIGRATE_FILE       = "coll_migrate.json"                       # data migration in progress
+COLL_SEARCH_INDEX_FILE  = "coll_search.sqlite3"                     # search index for entity data
 COLL_META_REF           = COLL_META_DIR + "/" + COLL_META_FILE
 COLL_PROV_REF           = COLL_META_DIR + "/" + COLL_PROV_FILE
 COLL_BASE_REF           = "d/"
@@ -85,6 +90,7 @@ SITEDATA_META_DIR       = SITEDATA_DIR + "/" + COLL_META_DIR        # used in te
 SITEDATA_META_FILE      = COLL_META_FILE                            # used in views
 SITEDATA_PROV_FILE      = COLL_PROV_FILE                            # used in views
 SITEDATA_CONTEXT_PATH   = "./"                                      # used in models
+SITEDATA_STAMP_FILE     = "site_data_stamp.json"                    # site data version stamp
 
 # -------------------------
 # Entities of various types
@@ -189,6 +195,11 @@ COLL_ENUM_PATH          = COLL_META_DIR + "/" + ENUM_DIR + "/%(type_id)s/%(id)s"
 TYPEDATA_TYPEID         = "_entitytypedata"                 # typedata id
 TYPEDATA_META_FILE      = "type_data_meta.jsonld"           # type data metadata file name
 TYPEDATA_PROV_FILE      = "type_data_prov.jsonld"           # type data provenance file name
+TYPEDATA_MANIFEST_FILE  = "%(id)s.manifest.json"           # type data entity manifest, alongside type data dir
+ENTITY_ID_COUNTER_FILE  = "%(id)s.idcounter.json"          # entity id counters, alongside entity dir
+TYPEDATA_RENAME_FILE    = "%(id)s.rename.json"             # type data rename in progress, alongside type data dir
+ENTITY_TOMBSTONE_MARK   = ".removed."                       # marks name of directory tree being removed
+ENTITY_TOMBSTONE_DIR    = "%(id)s"+ENTITY_TOMBSTONE_MARK+"%(stamp)s"
 COLL_BASE_TYPEDATA_REF  = "%(id)s"                          # ref type data relative to collection base URL
 TYPEDATA_COLL_BASE_REF  = "../"                             # ref collection base from record type data
 TYPEDATA_CONTEXT_FILE   = TYPEDATA_COLL_BASE_REF + COLL_CONTEXT_FILE  # ref collection context file
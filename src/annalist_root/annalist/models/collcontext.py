@@ -0,0 +1,213 @@
+"""
+Incremental generation of collection JSON-LD contexts.
+
+The JSON-LD context for a collection is assembled from vocabulary namespace
+prefixes, and from property URIs used by fields that appear in views and field
+groups defined by the collection or inherited from its alternative parents.
+Assembling the context from scratch means loading every vocabulary, view and
+group, and every field that they reference.
+
+This module records, for each collection, the contribution of each vocabulary,
+view and group to the context (a namespace URI, or a list of field references),
+and a table of the property URI and context description of each distinct field
+referenced, which is built by retrieving the field descriptions together.  When
+one of these entities is changed, just its contribution (or, for a field, its
+description) is recomputed, and the context is reassembled from the recorded
+contributions.  The assembled context is held in memory until a contributing
+entity is changed.
+
+Recorded contributions are keyed on the configuration generation stamps of the
+collection and its alternative parents (see `configcache`), so that updates made
+by other processes cause the context to be built again from scratch.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import threading
+from collections    import OrderedDict
+
+import logging
+log = logging.getLogger(__name__)
+
+from annalist                       import layout
+from annalist.models.entitystorage  import get_entity_storage, register_fork_reset
+from annalist.models.entitycache    import copy_values
+from annalist.models.configcache    import generation_path
+
+#   Type ids of entities whose contributions are recorded, in the order that
+#   contributions are assembled
+CONTEXT_TYPEIDS = [layout.VOCAB_TYPEID, layout.VIEW_TYPEID, layout.GROUP_TYPEID]
+
+_context_lock   = threading.RLock()
+_context_states = {}    # (collection dir, alt dirs) -> CollContextState
+
+def _reset_after_fork():
+    global _context_lock, _context_states
+    _context_lock   = threading.RLock()
+    _context_states = {}
+    return
+
+register_fork_reset(_reset_after_fork)
+
+class CollContextState(object):
+    """
+    Recorded contributions to the JSON-LD context of a collection.
+    """
+
+    def __init__(self, stamps):
+        self.stamps   = stamps
+        self.restamp  = False   # Stamps to be updated following local changes
+        self.contribs = dict.fromkeys(CONTEXT_TYPEIDS)
+                                # type id -> OrderedDict of entity id -> contribution
+        self.pending  = { t: set() for t in CONTEXT_TYPEIDS }
+                                # type id -> ids of entities to be recomputed
+        self.fields   = {}      # field id -> (property URI, field context)
+        self.context  = None    # (base context, assembled context), or None
+        self.written  = None    # Context last written to context files, or None
+        return
+
+def _get_state(coll):
+    """
+    Returns the context state for a collection, creating a new state if there
+    is no valid state recorded.
+    """
+    alt_dirs = coll._alt_child_dirs(altscope="all")
+    key      = (coll._entitydir, tuple(d for (p, d) in alt_dirs))
+    storage  = get_entity_storage()
+    stamps   = tuple(storage.stat_key(generation_path(p)) for (p, d) in alt_dirs)
+    state    = _context_states.get(key, None)
+    if state and state.restamp:
+        # Accept the collection's own updated stamp; parent stamps are compared as usual
+        state.stamps  = stamps[:1] + state.stamps[1:]
+        state.restamp = False
+    if state is None or state.stamps != stamps:
+        state = CollContextState(stamps)
+        _context_states[key] = state
+    return state
+
+def _contribs(coll, state, type_id):
+    """
+    Returns the recorded contributions of vocabularies, views or groups, loading
+    or recomputing them as required.
+    """
+    contribs = state.contribs[type_id]
+    pending  = state.pending[type_id]
+    if contribs is None or pending:
+        # Identifiers are listed again, in case entities have been added or removed
+        entity_ids = list(coll.context_entity_ids(type_id))
+        load_ids   = (
+            [ i for i in entity_ids
+                if contribs is None or i not in contribs or i in pending
+            ])
+        loaded     = dict(zip(load_ids, coll.get_context_contributions(type_id, load_ids)))
+        new_contribs = OrderedDict()
+        for entity_id in entity_ids:
+            c = loaded[entity_id] if entity_id in loaded else contribs[entity_id]
+            if c is not None:
+                new_contribs[entity_id] = c
+        contribs = new_contribs
+        state.contribs[type_id] = contribs
+        pending.clear()
+    return contribs
+
+def _field_table(coll, state, field_ids):
+    """
+    Returns the field table, which maps field ids to the field property URI and
+    context description, after adding entries for any of the supplied field ids
+    not already present.  The missing field descriptions are retrieved together.
+    """
+    missing = [ fid for fid in field_ids if fid not in state.fields ]
+    if missing:
+        state.fields.update(
+            coll.get_field_uri_jsonld_contexts(missing, coll.get_field_jsonld_context)
+            )
+    return state.fields
+
+def _assemble(coll, state, context):
+    """
+    Add recorded contributions to the supplied context dictionary.
+    """
+    for vid, vuri in _contribs(coll, state, layout.VOCAB_TYPEID).items():
+        if vid != "_initial_values":
+            context[vid] = vuri
+    field_refs = (
+        [ (idkey, eid, puri, fid)
+          for type_id, idkey in ((layout.VIEW_TYPEID, 'vid'), (layout.GROUP_TYPEID, 'gid'))
+          for eid, frefs in _contribs(coll, state, type_id).items()
+          for (puri, fid) in frefs
+        ])
+    fields = _field_table(coll, state, [ fid for (idkey, eid, puri, fid) in field_refs ])
+    for (idkey, eid, puri, fid) in field_refs:
+        furi, fcontext = fields[fid]
+        if fcontext is not None:
+            fcontext = dict(fcontext, fid=fid)
+            fcontext[idkey] = eid
+        coll.set_field_uri_jsonld_context(puri or furi, fid, fcontext, context)
+    return context
+
+def get_context(coll, base_context):
+    """
+    Returns the JSON-LD context for a collection.
+
+    coll            is the collection whose context is returned.
+    base_context    is a dictionary containing context entries that are not
+                    contributed by vocabularies, views or groups.  (These may
+                    depend on the URL used to access the collection.)
+    """
+    with _context_lock:
+        state = _get_state(coll)
+        if state.context is None or state.context[0] != base_context:
+            context = _assemble(coll, state, copy_context(base_context))
+            state.context = (base_context, context)
+        return copy_context(state.context[1])
+
+def context_written(coll, context):
+    """
+    Records a context to be written to the collection context files, and returns
+    False if it is the same as the context last written by this process.
+    """
+    with _context_lock:
+        state = _get_state(coll)
+        if state.written == context:
+            return False
+        state.written = copy_context(context)
+        return True
+
+def context_entity_changed(coll, type_id, entity_id):
+    """
+    Called when a vocabulary, view, group or field is created, updated or removed,
+    to note that its contribution to the collection context is to be recomputed.
+    This must be called before `config_changed` updates the configuration generation
+    stamp for the collection.
+
+    coll        is the collection containing the changed entity.
+    type_id     is the type id of the changed entity.
+    entity_id   is the id of the changed entity.
+    """
+    with _context_lock:
+        state = _get_state(coll)
+        state.restamp = True
+        state.context = None
+        if type_id == layout.FIELD_TYPEID:
+            state.fields.pop(entity_id, None)
+        elif type_id in CONTEXT_TYPEIDS:
+            state.pending[type_id].add(entity_id)
+    return
+
+def discard_contexts():
+    """
+    Discard all recorded contexts (e.g. when a collection is removed).
+    """
+    with _context_lock:
+        _context_states.clear()
+    return
+
+def copy_context(context):
+    """
+    Returns a copy of a context dictionary, preserving its ordering.
+    """
+    return OrderedDict((k, copy_values(v)) for k, v in context.items())
+
+# End.
@@ -33,7 +33,11 @@ from annalist.exceptions            import Annalist_Error
 from annalist.identifiers           import RDF, RDFS, ANNAL
 from annalist.util                  import valid_id, extract_entity_id, make_type_entity_id
 
-from annalist.models.entity         import Entity
+from annalist.models.entity         import Entity, alt_parents_changed
+from annalist.models.entitystorage  import get_entity_storage, batch_updates, current_batch
+from annalist.models.configcache    import get_config_entity, get_config_entities, config_changed
+from annalist.models.sitecollections import collections_changed
+from annalist.models.collcontext    import get_context, context_written, discard_contexts
 from annalist.models.annalistuser   import AnnalistUser
 from annalist.models.recordtype     import RecordType
 from annalist.models.recordview     import RecordView
@@ -61,6 +65,13 @@ class Collection(Entity):
     _baseref        = layout.META_COLL_BASE_REF
     _contextref     = layout.COLL_CONTEXT_FILE
 
+    # Classes of entities that contribute to the collection JSON-LD context
+    _context_entity_classes = (
+        { layout.VOCAB_TYPEID:  RecordVocab
+        , layout.VIEW_TYPEID:   RecordView
+        , layout.GROUP_TYPEID:  RecordGroup
+        })
+
     def __init__(self, parentsite, coll_id, altparent=None):
         """
         Initialize a new Collection object.
@@ -105,6 +116,31 @@ class Collection(Entity):
             collmetadata[ANNAL.CURIE.type_id] = self._entitytypeid
         return collmetadata
 
+    def _post_update_processing(self, entitydata, post_update_flags):
+        """
+        Post-update processing.
+
+        Collection metadata determines the collection's inheritance, so any memoized
+        alternative parent lists and cached configuration entities are discarded.
+        The site's cached collections directory is also discarded.
+        """
+        alt_parents_changed(self)
+        config_changed(self)
+        collections_changed(self._parent)
+        return entitydata
+
+    def _remove(self, type_uri):
+        """
+        Remove collection, and discard any memoized alternative parent lists,
+        cached configuration entities and cached collections directory.
+        """
+        super(Collection, self)._remove(type_uri)
+        alt_parents_changed(self)
+        config_changed()
+        collections_changed(self._parent)
+        discard_contexts()
+        return
+
     # Site
 
     def get_site(self):
@@ -198,6 +234,18 @@ class Collection(Entity):
             cls._set_alt_parent_coll(parent, coll)
         return coll
 
+    @classmethod
+    def load_many(cls, parent, coll_ids, altscope=None):
+        """
+        Overload Entity.load_many with logic to set alternative parent details for
+        collection configuration inheritance (see `load`).
+        """
+        colls = super(Collection, cls).load_many(parent, coll_ids, altscope=altscope)
+        for coll in colls:
+            if coll is not None:
+                cls._set_alt_parent_coll(parent, coll)
+        return colls
+
     @classmethod
     def _set_alt_parent_coll(cls, parent, coll):
         """
@@ -298,7 +346,7 @@ class Collection(Entity):
             self._types_by_id  = {}
             self._types_by_uri = {}
             for type_id in self._children(RecordType, altscope="all"):
-                t = RecordType.load(self, type_id, altscope="all")
+                t = get_config_entity(RecordType, self, type_id)
                 self._update_type_cache(t)
         return
 
@@ -342,7 +390,7 @@ class Collection(Entity):
         # Was it created but not cached?
         if not t and RecordType.exists(self, type_id, altscope="all"):
             log.info("___ Collection.get_type: "+type_id)
-            t = RecordType.load(self, type_id, altscope="all")
+            t = get_config_entity(RecordType, self, type_id)
             self._update_type_cache(t)
         return t
 
@@ -400,7 +448,7 @@ class Collection(Entity):
 
         returns a RecordView object for the identified view, or None.
         """
-        v = RecordView.load(self, view_id, altscope="all")
+        v = get_config_entity(RecordView, self, view_id)
         return v
 
     def remove_view(self, view_id):
@@ -448,7 +496,7 @@ class Collection(Entity):
 
         returns a RecordList object for the identified list, or None.
         """
-        l = RecordList.load(self, list_id, altscope="all")
+        l = get_config_entity(RecordList, self, list_id)
         return l
 
     def remove_list(self, list_id):
@@ -462,6 +510,53 @@ class Collection(Entity):
         s = RecordList.remove(self, list_id)
         return s
 
+    # Record fields, groups and vocabularies
+
+    def get_field_config(self, field_id):
+        """
+        Retrieve identified field description.  (Cf. `EntityRoot.get_field`,
+        which returns an entity value.)
+
+        field_id    local identifier for the field to retrieve.
+
+        returns a RecordField object for the identified field, or None.
+        """
+        f = get_config_entity(RecordField, self, field_id)
+        return f
+
+    def get_fields(self, field_ids):
+        """
+        Retrieve several field descriptions
+
+        field_ids   list of local identifiers for the fields to retrieve.
+
+        returns a list of RecordField objects or None values, in the same order
+        as the supplied identifiers.
+        """
+        return get_config_entities(RecordField, self, field_ids)
+
+    def get_group(self, group_id):
+        """
+        Retrieve identified field group description
+
+        group_id    local identifier for the group to retrieve.
+
+        returns a RecordGroup object for the identified group, or None.
+        """
+        g = get_config_entity(RecordGroup, self, group_id)
+        return g
+
+    def get_vocab(self, vocab_id):
+        """
+        Retrieve identified vocabulary namespace description
+
+        vocab_id    local identifier for the vocabulary to retrieve.
+
+        returns a RecordVocab object for the identified vocabulary, or None.
+        """
+        v = get_config_entity(RecordVocab, self, vocab_id)
+        return v
+
     def set_default_list(self, list_id):
         """
         Set and save the default list to be displayed for the current collection.
@@ -507,18 +602,48 @@ class Collection(Entity):
         log.info("Collection.get_default_view: %s/%s/%s"%(view_id, type_id, entity_id))
         return (view_id, type_id, entity_id) 
 
+    # Batched updates
+
+    def batch_updates(self):
+        """
+        Returns a context manager for a batch of updates to the current collection.
+        Entities saved within the batch are written immediately, but synchronization
+        to storage and post-update processing (e.g. regenerating the collection
+        JSON-LD context) are performed just once when the batch is completed.  E.g.
+
+            with coll.batch_updates():
+                // create, update or rename entities
+            // context regenerated here
+        """
+        return batch_updates()
+
     # JSON-LD context data
 
     def generate_coll_jsonld_context(self, flags=None):
         """
         (Re)generate JSON-LD context description for the current collection.
+
+        Within a batch of updates (see `batch_updates`), this is deferred until
+        the batch is completed.
         """
         if flags and ("nocontext" in flags):
             # Skip processing if "nocontext" flag provided
             return
-        log.info("Generating context for collection %s"%(self.get_id()))
+        batch = current_batch()
+        if batch:
+            batch.defer(
+                ("generate_coll_jsonld_context", self._entitydir),
+                self.generate_coll_jsonld_context
+                )
+            return
         # Build context data
         context      = self.get_coll_jsonld_context()
+        storage      = get_entity_storage()
+        if ( (not context_written(self, context)) and
+             all(storage.isfile(p) for p in self._context_file_paths()) ):
+            # Skip writing if context is unchanged since last written
+            return
+        log.info("Generating context for collection %s"%(self.get_id()))
         datetime_now = datetime.datetime.today().replace(microsecond=0)
         datetime_str = datetime_now.isoformat(' ')
         # Assemble and write out context description
@@ -546,9 +671,22 @@ class Collection(Entity):
                 )
         return
 
+    def _context_file_paths(self):
+        """
+        Returns paths of the context files generated for the collection.
+        """
+        (meta_dir, meta_file) = self._dir_path()
+        return (
+            [ os.path.join(meta_dir, layout.META_COLL_BASE_REF, layout.COLL_CONTEXT_FILE)
+            , os.path.join(meta_dir, layout.SITEDATA_CONTEXT_PATH, layout.COLL_CONTEXT_FILE)
+            ])
+
     def get_coll_jsonld_context(self):
         """
         Return dictionary containing context structure for collection.
+
+        Contributions from vocabularies, views and groups are recorded in memory
+        and updated as these entities are changed (see `collcontext`).
         """
         # Use OrderedDict to allow some control over ordering of context file contents:
         # this is for humane purposes only, and is not technically important.
@@ -580,32 +718,44 @@ class Collection(Entity):
               , "@type": "@id"
               }
             })
-        # Scan vocabs, generate prefix data
-        for v in self.child_entities(RecordVocab, altscope="all"):
-            vid = v.get_id()
-            if vid != "_initial_values":
-                context[v.get_id()] = v[ANNAL.CURIE.uri]
-        # Scan view fields and generate context data for property URIs used
-        for v in self.child_entities(RecordView, altscope="all"):
-            for fref in v[ANNAL.CURIE.view_fields]:
-                fid  = extract_entity_id(fref[ANNAL.CURIE.field_id])
-                vuri = fref.get(ANNAL.CURIE.property_uri, None)
-                furi, fcontext = self.get_field_uri_jsonld_context(fid, self.get_field_jsonld_context)
-                if fcontext is not None:
-                    fcontext['vid'] = v.get_id()
-                    fcontext['fid'] = fid
-                self.set_field_uri_jsonld_context(vuri or furi, fid, fcontext, context)
-        # Scan group fields and generate context data for property URIs used
-        for g in self.child_entities(RecordGroup, altscope="all"):
-            for gref in g[ANNAL.CURIE.group_fields]:
-                fid  = extract_entity_id(gref[ANNAL.CURIE.field_id])
-                guri = gref.get(ANNAL.CURIE.property_uri, None)
-                furi, fcontext = self.get_field_uri_jsonld_context(fid, self.get_field_jsonld_context)
-                if fcontext is not None:
-                    fcontext['gid'] = g.get_id()
-                    fcontext['fid'] = fid
-                self.set_field_uri_jsonld_context(guri or furi, fid, fcontext, context)
-        return context
+        return get_context(self, context)
+
+    def context_entity_ids(self, type_id):
+        """
+        Iterates over identifiers of vocabularies, views or groups that contribute
+        to the collection JSON-LD context.
+
+        type_id     is the type id of the entities to be listed.
+        """
+        return self._children(self._context_entity_classes[type_id], altscope="all")
+
+    def get_context_contributions(self, type_id, entity_ids):
+        """
+        Returns a list of contributions of vocabularies, views or groups to the
+        collection JSON-LD context, in the same order as the supplied entity ids.
+        Each contribution is a namespace URI for a vocabulary, or a list of
+        (property URI, field id) pairs for the fields of a view or group, or None
+        if the entity does not exist.
+
+        type_id     is the type id of the contributing entities.
+        entity_ids  is a list of ids of the contributing entities.
+        """
+        entities = get_config_entities(self._context_entity_classes[type_id], self, entity_ids)
+        if type_id == layout.VOCAB_TYPEID:
+            return [ None if v is None else v[ANNAL.CURIE.uri] for v in entities ]
+        if type_id == layout.VIEW_TYPEID:
+            fields_key = ANNAL.CURIE.view_fields
+        else:
+            fields_key = ANNAL.CURIE.group_fields
+        return (
+            [ None if e is None else
+              [ ( fref.get(ANNAL.CURIE.property_uri, None)
+                , extract_entity_id(fref[ANNAL.CURIE.field_id])
+                )
+                for fref in e[fields_key]
+              ]
+              for e in entities
+            ])
 
     def get_field_uri_jsonld_context(self, fid, get_field_context):
         """
@@ -616,14 +766,23 @@ class Collection(Entity):
 
         If no context should be generated for the field URI, returns (uri, None)
         """
-        f = RecordField.load(self, fid, altscope="all")
-        if f is None:
-            return (None, None)
-        # @@debugging@@
-        # if fid in ["Entity_id", "List_id"]:
-        #     print "@@ %s field   %r"%(fid, f)
-        #     print "@@ %s context %r"%(fid, get_field_context(f))
-        return (f[ANNAL.CURIE.property_uri], get_field_context(f))
+        return self.get_field_uri_jsonld_contexts([fid], get_field_context)[fid]
+
+    def get_field_uri_jsonld_contexts(self, fids, get_field_context):
+        """
+        Returns a dictionary that maps each of the supplied field ids to a pair
+        containing the field property URI and property description for JSON-LD
+        context, as returned by `get_field_uri_jsonld_context`.  The field
+        descriptions are retrieved together, once for each distinct field id.
+        """
+        fids   = list(OrderedDict.fromkeys(fids))
+        result = {}
+        for fid, f in zip(fids, self.get_fields(fids)):
+            if f is None:
+                result[fid] = (None, None)
+            else:
+                result[fid] = (f[ANNAL.CURIE.property_uri], get_field_context(f))
+        return result
 
     def set_field_uri_jsonld_context(self, puri, field_id, fcontext, property_contexts):
         """
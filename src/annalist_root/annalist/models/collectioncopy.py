@@ -0,0 +1,245 @@
+"""
+Copying of collection data using a pool of worker processes.
+
+Copying a collection means saving a copy of each of its entities in the target
+collection, and copying any attached resources (e.g. images or audio clips
+uploaded or imported for `RefImage` or `RefAudio` fields).  For collections with
+many entities or large attachments, doing this one entity at a time is slow,
+and creates a second copy of every attachment.
+
+Entities of types defined by Annalist (i.e. type ids starting with "_", which
+include type, view and field definitions used when copying other entities) are
+copied first, by the calling process.  Entities of other types are then divided
+into chunks, which are copied by a pool of worker processes (see the
+ANNALIST_COPY_PROCESSES setting).
+
+Attached resources are not updated in place by Annalist (a new upload replaces
+the file), so they are linked into the target collection rather than copied:  a
+copy-on-write clone (reflink) is tried first, then a hard link, and finally a copy
+of the file data (see `FileEntityStorage.link_file`).  A file with more than one
+link is replaced by a copy of itself before it is opened for writing, so updating
+a file in one collection does not affect the other.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os
+import time
+import itertools
+import multiprocessing
+
+import logging
+log = logging.getLogger(__name__)
+
+from django.conf import settings
+
+from annalist                       import message
+from annalist.models.entity         import alt_parents_changed
+from annalist.models.entityfinder   import EntityFinder
+from annalist.models.entitytypeinfo import EntityTypeInfo
+from annalist.models.entitystorage  import get_entity_storage, reset_after_fork
+from annalist.models.entitycache    import get_entity_cache
+from annalist.models.configcache    import config_changed
+
+#   Number of entities copied by each task given to a worker process
+COPY_CHUNK      = 50
+
+#   Source and target collections, set before worker processes are created
+_copy_colls     = None
+
+class CopyStats(object):
+    """
+    Counts of entities and files copied, used to report copy throughput.
+    """
+
+    def __init__(self):
+        self.entities = 0       # Entities copied
+        self.files    = 0       # Attached files copied or linked
+        self.reflink  = 0       # Files created as copy-on-write clones
+        self.hardlink = 0       # Files created as hard links
+        self.copy     = 0       # Files created by copying data
+        self.bytes    = 0       # Total size of files copied or linked
+        self.seconds  = 0.0     # Elapsed time
+        return
+
+    def add(self, counts):
+        """
+        Add counts returned by a copy task.
+        """
+        for k, v in counts.items():
+            setattr(self, k, getattr(self, k) + v)
+        return
+
+    def throughput(self):
+        """
+        Returns the copy throughput in megabytes per second.
+        """
+        if self.seconds <= 0:
+            return 0.0
+        return self.bytes/(1024.0*1024.0)/self.seconds
+
+    def summary(self):
+        """
+        Returns a summary of the copy statistics for display.
+        """
+        return (
+            "Copied %d entities and %d files (%d reflinked, %d hardlinked, %d copied), "
+            "%.1f MB in %.1f seconds (%.1f MB/s)"%
+            ( self.entities, self.files, self.reflink, self.hardlink, self.copy
+            , self.bytes/(1024.0*1024.0), self.seconds, self.throughput()
+            ))
+
+def _link_entity_files(src_entity, tgt_entity, counts):
+    """
+    Link or copy attached files from `src_entity` to `tgt_entity`.  Files that
+    already exist for the target entity (including its body) are not copied.
+
+    returns     list of error messages; an empty list indicates success.
+    """
+    storage = get_entity_storage()
+    msgs    = []
+    for p, f in src_entity._entity_files():
+        if tgt_entity._exists_file(f):
+            continue
+        try:
+            how = storage.link_file(p, os.path.join(tgt_entity._entitydir, f))
+            counts[how]      += 1
+            counts["files"]  += 1
+            counts["bytes"]  += storage.getsize(p)
+        except (IOError, OSError), e:
+            msg_vals = (
+                { 'id':     tgt_entity.get_id()
+                , 'src_id': src_entity.get_id()
+                , 'file':   f
+                })
+            log.warning("collectioncopy: error copying file %s (%s)"%(p, e))
+            msgs.append(message.ENTITY_COPY_FILE_ERROR%msg_vals)
+    return msgs
+
+def _copy_entities(task):
+    """
+    Copy the indicated entities of a type from the source collection to the
+    target collection.  This is used as a task by worker processes.
+
+    task        is a pair (type_id, entity_ids).
+
+    returns     a pair (msgs, counts), where msgs is a list of error messages and
+                counts is a dictionary of values to be added to `CopyStats`.
+    """
+    (type_id, entity_ids) = task
+    (src_coll, tgt_coll)  = _copy_colls
+    msgs     = []
+    counts   = dict.fromkeys(["entities", "files", "reflink", "hardlink", "copy", "bytes"], 0)
+    src_info = EntityTypeInfo(src_coll, type_id)
+    tgt_info = EntityTypeInfo(tgt_coll, type_id)
+    with tgt_coll.batch_updates():
+        for entity_id, e in zip(entity_ids, src_info.get_entities(entity_ids)):
+            if e is None:
+                continue
+            if src_info.recordtype:
+                e = src_info.get_entity_implied_values(e)
+            new_entity = tgt_info.create_entity(entity_id, e.get_values())
+            if not tgt_info.entity_exists(entity_id):
+                msg = (
+                    "Collection.copy_coll_data: Failed to create entity %s/%s"%
+                        (type_id, entity_id)
+                    )
+                log.warning(msg)
+                msgs.append(msg)
+                continue
+            counts["entities"] += 1
+            msgs += _link_entity_files(e, new_entity, counts)
+    return (msgs, counts)
+
+def _init_copy_process():
+    """
+    Initialize a worker process, which does not share the storage connections,
+    locks, caches or threads of the process that created it.
+    """
+    reset_after_fork()
+    return
+
+def _copy_tasks(src_coll, type_ids):
+    """
+    Iterate over copy tasks for entities of the indicated types.
+    """
+    for type_id in type_ids:
+        entity_ids = (
+            i for i in EntityTypeInfo(src_coll, type_id).enum_entity_ids(altscope=None)
+              if i != "_initial_values"
+            )
+        while True:
+            chunk = list(itertools.islice(entity_ids, COPY_CHUNK))
+            if not chunk:
+                break
+            yield (type_id, chunk)
+    return
+
+def copy_collection(src_coll, tgt_coll, stats=None, processes=None):
+    """
+    Copy entities and attached files from the source collection to the target
+    collection.
+
+    src_coll    is the collection to be copied.
+    tgt_coll    is the collection to which entities are copied.
+    stats       if supplied, is a `CopyStats` object to which counts of entities
+                and files copied are added.
+    processes   is the number of worker processes to use.  If not supplied, the
+                ANNALIST_COPY_PROCESSES setting is used.  With fewer than two
+                processes, all entities are copied by the calling process.
+
+    returns     list of error messages; an empty list indicates success.
+    """
+    global _copy_colls
+    if stats is None:
+        stats = CopyStats()
+    if processes is None:
+        processes = getattr(settings, "ANNALIST_COPY_PROCESSES", 1)
+    if os.name != "posix":
+        processes = 1       # Worker processes must be created by fork
+    log.info("Copying collection '%s' to '%s'"%(src_coll.get_id(), tgt_coll.get_id()))
+    start    = time.time()
+    type_ids = list(EntityFinder(src_coll).get_collection_type_ids(altscope="all"))
+    sys_ids  = [ t for t in type_ids if t.startswith("_") ]
+    data_ids = [ t for t in type_ids if not t.startswith("_") ]
+    msgs     = []
+    _copy_colls = (src_coll, tgt_coll)
+    try:
+        for task in _copy_tasks(src_coll, sys_ids):
+            task_msgs, counts = _copy_entities(task)
+            msgs += task_msgs
+            stats.add(counts)
+        for type_id in data_ids:
+            EntityTypeInfo(tgt_coll, type_id, create_typedata=True)
+        if processes < 2:
+            results = itertools.imap(_copy_entities, _copy_tasks(src_coll, data_ids))
+            for task_msgs, counts in results:
+                msgs += task_msgs
+                stats.add(counts)
+        else:
+            pool = multiprocessing.Pool(processes, initializer=_init_copy_process)
+            try:
+                results = pool.imap_unordered(_copy_entities, _copy_tasks(src_coll, data_ids))
+                for task_msgs, counts in results:
+                    msgs += task_msgs
+                    stats.add(counts)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+    finally:
+        _copy_colls = None
+    # Discard values cached before entities were created by other processes
+    get_entity_cache().invalidate_dir(tgt_coll._entitydir)
+    config_changed(tgt_coll)
+    alt_parents_changed(tgt_coll)
+    tgt_coll.generate_coll_jsonld_context()
+    stats.seconds += time.time() - start
+    log.info("Copied collection '%s': %s"%(tgt_coll.get_id(), stats.summary()))
+    return msgs
+
+# End.
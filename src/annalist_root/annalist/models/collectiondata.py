@@ -24,8 +24,10 @@ from annalist                       import message
 from annalist.util                  import replacetree, updatetree
 
 from annalist.models.site           import Site
-from annalist.models.entityfinder   import EntityFinder
-from annalist.models.entitytypeinfo import EntityTypeInfo
+from annalist.models.configcache    import config_changed
+from annalist.models.typedatarename import resume_type_data_renames
+from annalist.models.collectioncopy import copy_collection
+from annalist.models.collectionmigrate import migrate_collection
 
 def initialize_coll_data(src_data_dir, tgt_coll):
     """
@@ -62,30 +64,19 @@ def initialize_coll_data(src_data_dir, tgt_coll):
     tgt_coll.generate_coll_jsonld_context()
     return []
 
-def copy_coll_data(src_coll, tgt_coll):
+def copy_coll_data(src_coll, tgt_coll, stats=None):
     """
     Copy collection data from specified source to target collection.
 
+    Entities are copied by a pool of worker processes, and attached files are
+    linked rather than copied where possible (see `collectioncopy`).
+
+    stats       if supplied, is a `CopyStats` object that is updated with counts
+                of entities and files copied, and the time taken.
+
     returns     list of error messages; an empty list indicates success.
     """
-    log.info("Copying collection '%s' to '%s'"%(src_coll.get_id(), tgt_coll.get_id()))
-    msgs = []
-    entityfinder = EntityFinder(src_coll)
-    for e in entityfinder.get_entities():
-        entity_id  = e.get_id()
-        typeinfo   = EntityTypeInfo(
-            tgt_coll, e.get_type_id(), create_typedata=True
-            )
-        new_entity = typeinfo.create_entity(entity_id, e.get_values())
-        if not typeinfo.entity_exists(entity_id):
-            msg = (
-                "Collection.copy_coll_data: Failed to create entity %s/%s"%
-                    (typeinfo.type_id, entity_id)
-                )
-            log.warning(msg)
-            msgs.append(msg)
-        msgs += new_entity._copy_entity_files(e)
-    return msgs
+    return copy_collection(src_coll, tgt_coll, stats=stats)
 
 def migrate_coll_config_dir(coll, prev_dir, curr_dir):
     """
@@ -129,22 +120,31 @@ def migrate_coll_config_dirs(coll):
         e = migrate_coll_config_dir(coll, prev_dir, curr_dir)
         if e:
             errs.extend(e)
+    config_changed(coll)
     return errs
 
-def migrate_coll_data(coll):
+def migrate_coll_data(coll, processes=1):
     """
     Migrate collection data for specified collection
 
+    The collection metadata and every entity in the collection are loaded and saved,
+    so that each saved entity body is stamped with the current entity migration version.
+
+    processes   is the number of worker processes used to migrate entities (see
+                `collectionmigrate`).  The default migrates all entities in the 
+                calling process (e.g. when handling a web request).  If None, the
+                ANNALIST_MIGRATE_PROCESSES setting is used.
+
     returns     list of error messages; an empty list indicates success.
     """
     log.info("Migrate Annalist collection data for %s"%(coll.get_id()))
     errs = migrate_coll_config_dirs(coll)
     if errs:
         return errs
-    entityfinder = EntityFinder(coll)
-    for e in entityfinder.get_entities():
-        e._save(post_update_flags={"nocontext"})
-    coll.generate_coll_jsonld_context()    
+    resume_type_data_renames(coll)
+    coll._save(post_update_flags={"nocontext"})
+    migrate_collection(coll, processes=processes)
+    coll.generate_coll_jsonld_context()
     return []
 
 # End.
@@ -0,0 +1,199 @@
+"""
+Migration of collection data using a pool of worker processes.
+
+Migrating a collection means loading and saving every entity in the collection,
+so that any data format migrations are applied and saved, and every entity body
+is stamped with the current data format version.  For large collections, doing
+this one entity at a time uses a single processor for a long time.
+
+The entity identifiers for each type data directory are read (without loading
+the entities) and divided into chunks, which are migrated by a pool of worker
+processes (see the ANNALIST_MIGRATE_PROCESSES setting).  The collection JSON-LD
+context is generated just once, when all entities have been migrated.
+
+A migration marker file, stored with the collection metadata, records the
+identifiers of entities that have been migrated.  It is written periodically while
+the migration proceeds, and removed when the migration is complete.  If a migration
+is interrupted, running it again skips the entities recorded as migrated.  (Entities
+created between the interrupted migration and its resumption are not recorded, so
+they are migrated.)
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os
+import os.path
+import json
+import itertools
+import multiprocessing
+
+import logging
+log = logging.getLogger(__name__)
+
+from django.conf import settings
+
+from annalist                       import layout
+from annalist.models.entityroot     import ENTITY_MIGRATION_VERSION
+from annalist.models.entity         import alt_parents_changed
+from annalist.models.entityfinder   import EntityFinder
+from annalist.models.entitytypeinfo import EntityTypeInfo
+from annalist.models.entitystorage  import get_entity_storage, reset_after_fork
+from annalist.models.entitycache    import get_entity_cache
+from annalist.models.configcache    import config_changed
+
+#   Number of entities migrated by each task given to a worker process
+MIGRATE_CHUNK       = 50
+
+#   Number of completed tasks between updates of the migration marker
+MIGRATE_CHECKPOINT  = 10
+
+#   Collection being migrated, set before worker processes are created
+_migrate_coll       = None
+
+def _marker_path(coll):
+    (meta_dir, meta_file) = coll._dir_path()
+    return os.path.join(meta_dir, layout.COLL_MIGRATE_FILE)
+
+def _read_marker(coll):
+    """
+    Returns the identifiers of migrated entities, keyed by type id, recorded for an
+    interrupted migration of the collection to the current data format version, or
+    an empty dictionary.
+    """
+    storage = get_entity_storage()
+    path    = _marker_path(coll)
+    if not storage.isfile(path):
+        return {}
+    try:
+        marker = json.loads(storage.read_file(path))
+    except (IOError, ValueError), e:
+        log.error("collectionmigrate: error loading %s"%(path))
+        log.error(e)
+        return {}
+    if marker.get("migration_version") != ENTITY_MIGRATION_VERSION:
+        return {}
+    return marker.get("migrated_ids", {})
+
+def _write_marker(coll, migrated):
+    get_entity_storage().write_file(
+        _marker_path(coll),
+        json.dumps(
+            { "migration_version": ENTITY_MIGRATION_VERSION, "migrated_ids": migrated },
+            indent=2, separators=(',', ': '), sort_keys=True
+            )
+        )
+    return
+
+def _migrate_entities(task):
+    """
+    Load and save the indicated entities of a type, with values implied by the
+    type (e.g. field aliases) instantiated.  This is used as a task by worker
+    processes.
+
+    task        is a pair (type_id, entity_ids).
+
+    returns     a triple (type_id, entity_ids, count), where count is the number
+                of entities migrated.
+    """
+    (type_id, entity_ids) = task
+    coll     = _migrate_coll
+    typeinfo = EntityTypeInfo(coll, type_id)
+    count    = 0
+    with coll.batch_updates():
+        for e in typeinfo.get_entities(entity_ids):
+            if e is not None:
+                if typeinfo.recordtype:
+                    e = typeinfo.get_entity_implied_values(e)
+                e._save(post_update_flags={"nocontext"})
+                count += 1
+    return (type_id, entity_ids, count)
+
+def _init_migrate_process():
+    """
+    Initialize a worker process, which does not share the storage connections,
+    locks, caches or threads of the process that created it.
+    """
+    reset_after_fork()
+    return
+
+def _migrate_tasks(coll, type_ids, migrated):
+    """
+    Iterate over migration tasks for entities of the indicated types, omitting
+    entities recorded as already migrated.  Entity identifiers are read for one
+    type at a time, and the entities are not loaded.
+    """
+    for type_id in type_ids:
+        skip_ids   = set(migrated.get(type_id, []))
+        entity_ids = (
+            i for i in sorted(EntityTypeInfo(coll, type_id).enum_entity_ids(altscope=None))
+              if i != "_initial_values" and i not in skip_ids
+            )
+        while True:
+            chunk = list(itertools.islice(entity_ids, MIGRATE_CHUNK))
+            if not chunk:
+                break
+            yield (type_id, chunk)
+    return
+
+def migrate_collection(coll, processes=None):
+    """
+    Migrate all entities in the indicated collection.
+
+    coll        is the collection to be migrated.
+    processes   is the number of worker processes to use.  If not supplied, the
+                ANNALIST_MIGRATE_PROCESSES setting is used.  With fewer than two
+                processes, all entities are migrated by the calling process.
+
+    returns     the number of entities migrated.
+    """
+    global _migrate_coll
+    if processes is None:
+        processes = getattr(settings, "ANNALIST_MIGRATE_PROCESSES", 1)
+    if os.name != "posix":
+        processes = 1       # Worker processes must be created by fork
+    migrated = _read_marker(coll)
+    if migrated:
+        log.info("Resuming migration of collection '%s'"%(coll.get_id()))
+    type_ids = list(EntityFinder(coll).get_collection_type_ids(altscope="all"))
+    # Tasks may be generated by another thread while completed entities are recorded
+    skipped  = { t: list(r) for t, r in migrated.items() }
+    tasks    = _migrate_tasks(coll, type_ids, skipped)
+    total    = 0
+    _migrate_coll = coll
+    pool     = None
+    try:
+        if processes < 2:
+            results = itertools.imap(_migrate_entities, tasks)
+        else:
+            pool    = multiprocessing.Pool(processes, initializer=_init_migrate_process)
+            results = pool.imap_unordered(_migrate_entities, tasks)
+        for n, (type_id, entity_ids, count) in enumerate(results, 1):
+            migrated.setdefault(type_id, []).extend(entity_ids)
+            total += count
+            if n%MIGRATE_CHECKPOINT == 0:
+                _write_marker(coll, migrated)
+        if pool:
+            pool.close()
+    except:
+        if pool:
+            pool.terminate()
+        if migrated:
+            _write_marker(coll, migrated)
+        raise
+    finally:
+        if pool:
+            pool.join()
+        _migrate_coll = None
+    # Discard values cached before entities were saved by other processes
+    get_entity_cache().invalidate_dir(coll._entitydir)
+    config_changed(coll)
+    alt_parents_changed(coll)
+    storage = get_entity_storage()
+    if storage.isfile(_marker_path(coll)):
+        storage.remove_file(_marker_path(coll))
+    log.info("Migrated %d entities in collection '%s'"%(total, coll.get_id()))
+    return total
+
+# End.
@@ -0,0 +1,210 @@
+"""
+Process-wide cache of collection configuration entities.
+
+Rendering a form or list requires the type, view, list, field, group and vocabulary
+definitions that apply to a collection, and the same definitions are used by many
+requests.  Loading a definition means locating it among the collection and its
+alternative parents (collections from which it inherits definitions, and the site
+data), reading and parsing its body, and applying any data format migrations.
+
+This cache records, for each collection and configuration entity, where the entity
+was found and its (migrated) values, so subsequent requests can construct the entity
+without repeating this work.
+
+Each collection has a generation stamp file, stored alongside the collection
+metadata, which is rewritten with an incremented generation number whenever a
+configuration entity in the collection is created, updated or removed (see
+`config_changed`).  Cached entries are keyed on the stamps of the collection and
+its alternative parents, so that updates made by other processes are detected.
+The stamps are checked once for each collection object (which normally lasts for
+the handling of a single request), and the cache is discarded entirely when a
+configuration change is made by the current process.
+
+Values derived from the configuration of a collection (e.g. the type hierarchy,
+see `annalist.models.typegraph`) are cached in the same way, and discarded when
+configuration entities are discarded (see `get_config_derived`).
+
+Configuration data that is changed without using Annalist (e.g. by editing files
+directly) is not detected until a generation stamp is updated.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os.path
+import json
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+from annalist                       import layout
+from annalist                       import util
+from annalist.models.entitystorage  import get_entity_storage, current_batch, register_fork_reset
+from annalist.models.entitycache    import copy_values
+
+_config_lock       = threading.Lock()
+_config_cache      = {}     # (cls, entity_id, alt dirs) -> (stamps, index, view URL, values)
+_config_derived    = {}     # (name, alt dirs) -> (stamps, value)
+_config_generation = 0      # Incremented when the cache is discarded
+
+def _reset_after_fork():
+    global _config_lock, _config_cache, _config_derived
+    _config_lock    = threading.Lock()
+    _config_cache   = {}
+    _config_derived = {}
+    return
+
+register_fork_reset(_reset_after_fork)
+
+def generation_path(coll):
+    """
+    Returns the path of the generation stamp file for the indicated collection.
+    """
+    (meta_dir, meta_file) = coll._dir_path()
+    return os.path.join(meta_dir, layout.COLL_GENERATION_FILE)
+
+def get_generation(coll):
+    """
+    Returns the current configuration generation number for the indicated collection.
+    """
+    try:
+        return json.loads(get_entity_storage().read_file(generation_path(coll)))["generation"]
+    except (IOError, ValueError, KeyError, TypeError):
+        return 0
+
+def config_changed(coll=None):
+    """
+    Called when configuration entities are created, updated or removed, to discard
+    cached configuration entities.
+
+    coll        if supplied, is the collection whose configuration has changed:
+                its generation stamp is updated so that other processes discard
+                cached entities.  (Within a batch of updates, the stamp is updated
+                once when the batch is completed.)
+    """
+    global _config_generation
+    if coll is not None:
+        batch = current_batch()
+        if batch:
+            batch.defer(("update_generation", generation_path(coll)), lambda: _update_generation(coll))
+        else:
+            _update_generation(coll)
+    with _config_lock:
+        _config_cache.clear()
+        _config_derived.clear()
+        _config_generation += 1
+    return
+
+def _update_generation(coll):
+    """
+    Increment the generation number in the generation stamp file for a collection.
+    """
+    storage  = get_entity_storage()
+    path     = generation_path(coll)
+    if storage.isdir(os.path.dirname(path)):
+        with storage.lock(os.path.dirname(path)):
+            stamp = { "generation": get_generation(coll) + 1 }
+            storage.write_file(path, json.dumps(stamp))
+    return
+
+def _alt_stamps(coll, alt_dirs):
+    """
+    Returns the generation stamps of a collection and its alternative parents,
+    which are read once for each collection object unless the configuration is
+    changed by the current process.
+    """
+    memo = getattr(coll, "_config_stamps", None)
+    if memo and memo[0] == _config_generation:
+        return memo[1]
+    generation = _config_generation
+    storage    = get_entity_storage()
+    stamps     = tuple(storage.stat_key(generation_path(p)) for (p, d) in alt_dirs)
+    coll._config_stamps = (generation, stamps)
+    return stamps
+
+def get_config_entity(cls, coll, entity_id):
+    """
+    Returns a configuration entity that applies for a collection (i.e. defined
+    by the collection or any of its alternative parents), or None.  This has
+    the same effect as `cls.load(coll, entity_id, altscope="all")`.
+
+    cls         is the class of configuration entity to be loaded.
+    coll        is the collection for which the entity is loaded.
+    entity_id   is the local identifier (slug) for the entity.
+    """
+    return get_config_entities(cls, coll, [entity_id])[0]
+
+def get_config_entities(cls, coll, entity_ids):
+    """
+    Returns a list of configuration entities that apply for a collection, in the
+    same order as the supplied entity ids, where each element is an entity or None.
+    Entities not found in the cache are loaded together (see `Entity.load_many`).
+
+    cls         is the class of configuration entities to be loaded.
+    coll        is the collection for which the entities are loaded.
+    entity_ids  is a list of local identifiers (slugs) for the entities.
+    """
+    alt_dirs = coll._alt_child_dirs(altscope="all")
+    stamps   = _alt_stamps(coll, alt_dirs)
+    alt_key  = tuple(d for (p, d) in alt_dirs)
+    entities = []
+    missing  = []
+    for entity_id in entity_ids:
+        e = None
+        if util.valid_id(entity_id):
+            entry = _config_cache.get((cls, entity_id, alt_key), None)
+            if entry and entry[0] == stamps:
+                (_, index, viewurl, values) = entry
+                e = cls._child_init(alt_dirs[index][0], entity_id, entityviewurl=viewurl)
+                e.set_values(copy_values(values))
+            else:
+                missing.append((len(entities), entity_id))
+        entities.append(e)
+    if not missing:
+        return entities
+    generation = _config_generation
+    if len(missing) == 1:
+        loaded = [ cls.load(coll, missing[0][1], altscope="all") ]
+    else:
+        loaded = cls.load_many(coll, [ i for (n, i) in missing ], altscope="all")
+    for (n, entity_id), e in zip(missing, loaded):
+        entities[n] = e
+        if e is None or "@error" in e:
+            continue
+        for index, (p, d) in enumerate(alt_dirs):
+            if e._parent is p:
+                with _config_lock:
+                    if generation == _config_generation:
+                        _config_cache[(cls, entity_id, alt_key)] = (
+                            stamps, index, e._entityviewurl, copy_values(e.get_values())
+                            )
+                break
+    return entities
+
+def get_config_derived(coll, name, compute):
+    """
+    Returns a value derived from the configuration entities that apply for a
+    collection, which is computed when first requested and then cached until
+    the configuration is changed.
+
+    coll        is the collection for which the value is required.
+    name        is a name that distinguishes the derived value from others.
+    compute     is a function called with the collection to compute the value,
+                which is treated as read-only by callers.
+    """
+    alt_dirs = coll._alt_child_dirs(altscope="all")
+    stamps   = _alt_stamps(coll, alt_dirs)
+    key      = (name, tuple(d for (p, d) in alt_dirs))
+    entry    = _config_derived.get(key, None)
+    if entry and entry[0] == stamps:
+        return entry[1]
+    generation = _config_generation
+    value      = compute(coll)
+    with _config_lock:
+        if generation == _config_generation:
+            _config_derived[key] = (stamps, value)
+    return value
+
+# End.
@@ -15,11 +15,15 @@ __license__     = "MIT (http://opensource.org/licenses/MIT)"
 
 import os
 import os.path
+import re
 import urlparse
 import itertools
 import json
 import errno
 import traceback
+import threading
+from multiprocessing.pool       import ThreadPool
+
 import logging
 log = logging.getLogger(__name__)
 
@@ -32,6 +36,10 @@ from annalist.exceptions        import Annalist_Error
 from annalist.identifiers       import ANNAL
 
 from annalist.models.entityroot import EntityRoot
+from annalist.models.sitesnapshot   import snapshot_storage
+from annalist.models.entitymissing  import entity_dir_missing
+from annalist.models.entitystorage  import register_fork_reset
+from annalist.models.entityidcounter import EntityIdCounter, SEQUENCE_KEY
 
 #   -------------------------------------------------------------------------------------------
 #
@@ -51,6 +59,119 @@ def test_is_true(v):
     """
     return bool(v)
 
+#   Thread pool used for loading multiple entities (see `Entity.load_many`)
+
+_load_pool      = None
+_load_pool_lock = threading.Lock()
+_load_local     = threading.local()
+
+def _get_load_pool():
+    """
+    Returns thread pool used for loading entities, or None if entities are
+    to be loaded in the calling thread.
+    """
+    global _load_pool
+    if getattr(_load_local, "in_pool", False):
+        # Don't wait for pool threads from a pool thread (may deadlock)
+        return None
+    pool_size = getattr(settings, "ANNALIST_LOAD_THREADS", 0)
+    if pool_size <= 1:
+        return None
+    with _load_pool_lock:
+        if _load_pool is None:
+            _load_pool = ThreadPool(pool_size, initializer=_init_load_thread)
+    return _load_pool
+
+def _init_load_thread():
+    _load_local.in_pool = True
+    return
+
+def discard_load_pool():
+    """
+    Discard the thread pool used for loading entities without waiting for its
+    threads (e.g. in a new process created by `fork`, which does not have them).
+    """
+    global _load_pool, _load_pool_lock
+    _load_pool      = None
+    _load_pool_lock = threading.Lock()
+    return
+
+register_fork_reset(discard_load_pool)
+
+#   Alternative parent lists are memoized for all entity objects with the same entity
+#   directory.  Each memoized list records a tag describing the inheritance of the
+#   entity object for which it was found (see `Entity._alt_memo_tag`), which must
+#   match that of an entity object using it, and the generation numbers of the
+#   directories of entities on which it depends:  it is discarded when any of these
+#   is changed (see `alt_parents_changed`).
+
+_alt_memo_lock          = threading.Lock()
+_alt_memo               = {}    # key -> (tag, directory generations, value)
+_alt_dir_generations    = {}    # directory -> generation
+_alt_changes            = 0     # Incremented by each call of `alt_parents_changed`
+
+def _reset_alt_memo():
+    global _alt_memo_lock, _alt_memo
+    _alt_memo_lock  = threading.Lock()
+    _alt_memo       = {}
+    return
+
+register_fork_reset(_reset_alt_memo)
+
+def alt_parents_changed(coll=None):
+    """
+    Called when changes are made that may affect the alternative parents of any
+    entity (e.g. a collection's inheritance is updated, or type data is added or
+    removed), to discard memoized alternative parent lists.
+
+    coll        if supplied, is the collection (or other entity) whose inheritance
+                or type data has changed:  only memoized lists that depend on it
+                are discarded.  Otherwise, all memoized lists are discarded.
+    """
+    global _alt_changes
+    with _alt_memo_lock:
+        _alt_changes += 1
+        if coll is None:
+            _alt_memo.clear()
+        else:
+            d = coll._entitydir
+            _alt_dir_generations[d] = _alt_dir_generations.get(d, 0) + 1
+    return
+
+def _alt_memo_get(key, tag):
+    """
+    Returns a memoized value for the supplied key and tag, or None if no value is
+    memoized, the memoized value has a different tag, or it has been discarded.
+    """
+    with _alt_memo_lock:
+        memo = _alt_memo.get(key)
+        if memo is None or memo[0] != tag:
+            return None
+        for (d, g) in memo[1]:
+            if _alt_dir_generations.get(d, 0) != g:
+                del _alt_memo[key]
+                return None
+        return memo[2]
+
+def _alt_memo_start():
+    """
+    Called before computing a value to be memoized:  returns a value to be passed to
+    `_alt_memo_put`, so that the value is not memoized if any change is made while
+    it is being computed.
+    """
+    return _alt_changes
+
+def _alt_memo_put(key, tag, start, scope_dirs, value):
+    """
+    Memoize a value that depends on entities in the supplied directories, replacing
+    any value memoized for the same key.
+    """
+    with _alt_memo_lock:
+        if _alt_changes == start:
+            generations  = tuple( (d, _alt_dir_generations.get(d, 0)) for d in set(scope_dirs) )
+            _alt_memo[key] = (tag, generations, value)
+    return
+
 #   -------------------------------------------------------------------------------------------
 #
 #   Entity
@@ -68,7 +189,6 @@ class Entity(EntityRoot):
     _entityview     = "%(id)s/"     # Placeholder for testing
     _entitypath     = None          # Relative path from parent to entity (template)
     _entityfile     = None          # Relative reference to body file from entity
-    _last_id        = None          # Last ID allocated
 
     def __init__(self, parent, entityid, altparent=None):
         """
@@ -274,13 +394,70 @@ class Entity(EntityRoot):
                 log.error("".join(traceback.format_stack()))
                 raise ValueError("altscope must be string (%r supplied)"%(altscope))
         # log.debug("Entity.get_alt_entities: %s/%s"%(self.get_type_id(), self.get_id()))
-        alt_parents = [self] + self._find_alt_parents(altscope=altscope)
+        # (The current entity object is not memoized, as the memoized list is shared
+        # by other objects for the same entity)
+        scope_dirs = self._alt_scope_dirs(altscope)
+        key        = (self._entitydir, altscope)
+        tag        = self._alt_memo_tag(scope_dirs)
+        memo       = _alt_memo_get(key, tag)
+        if memo is None:
+            start = _alt_memo_start()
+            memo  = self._find_alt_parents(altscope=altscope)
+            _alt_memo_put(
+                key, tag, start, scope_dirs + [ p._entitydir for p in memo ], memo
+                )
+        alt_parents = [self] + memo
         # log.info(
         #     "@@ Entity.get_alt_entities: %s/%s -> %r"%
         #     (self.get_type_id(), self.get_id(), [ p.get_id() for p in alt_parents ])
         #     )
         return alt_parents
 
+    def _alt_memo_tag(self, scope_dirs):
+        """
+        Returns a value that describes the inheritance of the current entity object,
+        which must match for memoized alternative parents to be used by it (e.g. a
+        collection object that has not been loaded has only site data as its
+        alternative parent).
+
+        scope_dirs  is the list of directories returned by `_alt_scope_dirs`.
+        """
+        altparent = self._altparent and (self._altparent.__class__, self._altparent._entitydir)
+        return (self.__class__, self._entityurl, altparent, tuple(scope_dirs))
+
+    def _alt_scope_dirs(self, altscope):
+        """
+        Returns a list of directories of entities, other than the alternative parents
+        found, whose changes (see `alt_parents_changed`) may affect the alternative
+        parents of the current entity.
+        """
+        return [self._entitydir]
+
+    def _alt_child_dirs(self, altscope=None):
+        """
+        Returns a list of pairs (parent, dir), for the current entity and its alternatives, 
+        where 'dir' is the directory containing descendents of 'parent'.  The value is 
+        memoized with the alternative parents list.
+
+        altscope    if supplied, indicates a scope other than the current entity to
+                    search for children.  See method `_find_alt_parents` for more details.
+        """
+        scope_dirs = self._alt_scope_dirs(altscope)
+        key        = ("dirs", self._entitydir, altscope)
+        tag        = self._alt_memo_tag(scope_dirs)
+        memo       = _alt_memo_get(key, tag)
+        if memo is None:
+            start   = _alt_memo_start()
+            parents = []
+            for p in self.get_alt_entities(altscope=altscope)[1:]:
+                if p not in parents:
+                    parents.append(p)
+            memo    = [ (p, p._entitydir) for p in parents ]
+            _alt_memo_put(
+                key, tag, start, scope_dirs + [ p._entitydir for p in parents ], memo
+                )
+        return [(self, self._entitydir)] + memo
+
     def try_alt_entities(self, func, test=test_is_true, altscope=None):
         """
         Try applying the supplied function to the current entity and then any alternatives
@@ -312,6 +489,47 @@ class Entity(EntityRoot):
                 return v
         return v
 
+    @classmethod
+    def _probe_alt_parentage(cls, parent, entityid, altscope=None):
+        """
+        Look for the body of an entity descended from the supplied parent or any
+        alternative parents, by testing for existence of body files.  This avoids 
+        constructing an entity object for each alternative parent considered.
+        Parents for which the entity directory is known not to exist are skipped
+        without probing for body files (see `entitymissing`).
+
+        Returns a pair (e, p), where 'e' is an entity object descended from the supplied
+        parent, and 'p' is the first parent (or alternative) for which the entity body 
+        exists, or False if the entity is not found.  'p' is None if a body file that 
+        requires migration is found, in which case the caller should fall back to 
+        `try_alt_parentage`.
+        """
+        e        = cls._child_init(parent, entityid)
+        relpath  = cls.relpath(entityid)
+        oldfiles = e._migrate_filenames() or []
+        def child_dirs():
+            # Alternatives are determined only if the entity is not found in the parent
+            yield (parent, parent._entitydir)
+            if isinstance(parent, Entity):
+                alt_dirs = parent._alt_child_dirs(altscope=altscope)
+            else:
+                alt_dirs = [ (p, p._entitydir) for p in parent.get_alt_entities(altscope=altscope) ]
+            for p, d in alt_dirs:
+                if p is not parent:
+                    yield (p, d)
+            return
+        for p, d in child_dirs():
+            entitydir = os.path.normpath(os.path.join(d, relpath))
+            storage   = snapshot_storage(entitydir)
+            if entity_dir_missing(storage, entitydir):
+                continue
+            if storage.isfile(os.path.join(entitydir, cls._entityfile)):
+                return (e, p)
+            for f in oldfiles:
+                if storage.isfile(os.path.join(entitydir, f)):
+                    return (e, None)
+        return (e, False)
+
     @classmethod
     def try_alt_parentage(cls, parent, entityid, func, test=test_is_true, altscope=None):
         """
@@ -362,20 +580,25 @@ class Entity(EntityRoot):
 
         If "base_id" is specified, it is used as part of the new Id allocated 
         (used when copying an entity).
+
+        Sequence numbers are allocated using a persistent counter (see module
+        `entityidcounter`), so normally just one existence test is needed.
         """
         if base_id and util.valid_id(base_id):
-            last_id     = 0
+            key         = base_id
             name_format = base_id+"_%02d"
+            id_pattern  = re.compile("^"+re.escape(base_id)+r"_(\d{2,})$")
         else:
-            last_id     = cls._last_id or 0
+            key         = SEQUENCE_KEY
             name_format = "%08d"
+            id_pattern  = re.compile(r"^(\d{8,})$")
+        parent_dir = os.path.dirname(os.path.join(parent._entitydir, cls._entitypath or ""))
+        counter    = EntityIdCounter(parent_dir)
         while True:
-            last_id += 1
+            last_id  = counter.allocate(key, id_pattern, lambda: parent._base_children(cls))
             new_id   = name_format%last_id
             if not cls.exists(parent, new_id):
                 break
-        if not base_id:
-            cls._last_id = last_id
         # print "base_id %s, new_id %s, last_id %d"%(base_id, new_id, last_id)
         return new_id
 
@@ -500,7 +723,8 @@ class Entity(EntityRoot):
         log.debug("Entity.create: entityid %s"%(entityid))
         e = cls._child_init(parent, entityid)
         e.set_values(entitybody)
-        e._save()
+        with parent._updating_children(cls, [entityid]):
+            e._save()
         return e
 
     @classmethod
@@ -525,7 +749,8 @@ class Entity(EntityRoot):
                         , 'message':  e["@message"]
                         })
                     )
-            e._remove(cls._entitytype)
+            with parent._updating_children(cls, [entityid]):
+                e._remove(cls._entitytype)
         else:
             return Annalist_Error("Entity %s not found"%(entityid))
         return None
@@ -555,14 +780,23 @@ class Entity(EntityRoot):
         #         raise ValueError("altscope must be string (%r supplied)"%(altscope))
         entity = None
         if util.valid_id(entityid):
-            (e, v) = cls.try_alt_parentage(
-                parent, entityid, (lambda e: e._load_values()), 
-                altscope=altscope
-                )
+            (e, p) = cls._probe_alt_parentage(parent, entityid, altscope=altscope)
+            if p is False:
+                return None
+            v = None
+            if p is not None:
+                if p is not parent:
+                    e = cls._child_init(p, entityid, entityviewurl=e._entityviewurl)
+                v = e._load_values()
+            if not v:
+                (e, v) = cls.try_alt_parentage(
+                    parent, entityid, (lambda e: e._load_values()), 
+                    altscope=altscope
+                    )
             # log.info(" __ Entity.load: _load_values "+repr(v))
             # log.info("entity.load %r"%(v,))
             if v:
-                v = e._migrate_values(v)
+                v = e._migrated_values(v)
                 e.set_values(v)
                 entity = e
         else:
@@ -573,6 +807,49 @@ class Entity(EntityRoot):
         # log.warning("@@Entity.load v  %r"%(v))
         return entity
 
+    @classmethod
+    def load_many(cls, parent, entityids, altscope=None):
+        """
+        Return a list of entities with given identifiers belonging to some given parent.
+
+        This has the same effect as calling `load` for each identifier, except that
+        alternative parents are determined just once, and entity data is read using 
+        a pool of threads, so that storage access latencies are overlapped.
+
+        cls         is the class of the entities to be loaded
+        parent      is the parent from which the entities are descended.
+        entityids   is a list of local identifiers (slugs) for the entities.
+        altscope    if supplied, indicates a scope other than the current entity to
+                    search for children.  See `_find_alt_parents` for more details.
+
+        Returns a list, in the same order as `entityids`, where each element is an 
+        instance of the indicated class with data loaded from Annalist storage, or 
+        None if there is no such entity.
+        """
+        entityids   = list(entityids)
+        # NOTE: alt_parents[0] is `parent`, which is tried first
+        alt_parents = parent.get_alt_entities(altscope=altscope)
+        def load_entity(entityid):
+            if not util.valid_id(entityid):
+                log.debug("Entity.load_many: invalid id %s"%entityid)
+                return None
+            e  = cls._child_init(parent, entityid)
+            uv = e._entityviewurl
+            v  = e._load_values()
+            for altparent in alt_parents[1:]:
+                if v:
+                    break
+                e = cls._child_init(altparent, entityid, entityviewurl=uv)
+                v = e._load_values()
+            if not v:
+                return None
+            e.set_values(e._migrated_values(v))
+            return e
+        pool = _get_load_pool() if len(entityids) > 1 else None
+        if pool is None:
+            return [ load_entity(i) for i in entityids ]
+        return pool.map(load_entity, entityids)
+
     @classmethod
     def exists(cls, parent, entityid, altscope=None):
         """
@@ -595,6 +872,9 @@ class Entity(EntityRoot):
         #         log.error("altscope must be string (%r supplied)"%(altscope))
         #         log.error("".join(traceback.format_stack()))
         #         raise ValueError("altscope must be string (%r supplied)"%(altscope))
+        (e, p) = cls._probe_alt_parentage(parent, entityid, altscope=altscope)
+        if p is not None:
+            return bool(p)
         (e, v) = cls.try_alt_parentage(
             parent, entityid, (lambda e: e._exists()), 
             altscope=altscope
@@ -0,0 +1,254 @@
+"""
+Process-wide cache of entity values read from Annalist storage.
+
+Entity bodies are cached, as parsed from storage, in a least-recently-used table
+keyed by entity class and body path.  Each cache entry records a storage stat key
+(see `entitystorage`), and is used only while the stored data is unchanged, so
+updates made by other processes are picked up on the next access.
+
+Values handed out by the cache are copies, so callers are free to update them.
+
+Values for an entity body are discarded when the body is updated (`invalidate`).  When
+a directory is updated (`invalidate_dir`), its generation is recorded and cached values
+read from within it before then are discarded when next accessed, so that neither kind
+of update requires a scan of the whole cache.
+
+The total size of cached entity bodies is bounded by the ANNALIST_ENTITY_CACHE_SIZE
+setting (in bytes):  a value of 0 disables the cache.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import time
+import threading
+import collections
+
+import logging
+log = logging.getLogger(__name__)
+
+from django.conf import settings
+
+from annalist.models.entitystorage  import get_entity_storage, register_fork_reset
+
+#   Stored data modified less than this many seconds before it was read is not
+#   cached, because a further update within the file system timestamp resolution
+#   might not be detected.
+RACY_INTERVAL   = 2.0
+
+#   Number of invalidated directory generations that are recorded before the cache
+#   is swept for entries that they make stale.
+DIR_GENERATIONS_MAX = 1000
+
+def copy_values(v):
+    """
+    Returns a copy of a JSON value, sharing only immutable sub-values.
+
+    >>> v1 = {"a": [{"b": 1}, "c"], "d": "e"}
+    >>> v2 = copy_values(v1)
+    >>> v2 == v1
+    True
+    >>> v2["a"][0]["b"] = 2
+    >>> v1["a"][0]["b"]
+    1
+    """
+    if isinstance(v, dict):
+        return { k: copy_values(e) for k, e in v.iteritems() }
+    if isinstance(v, list):
+        return [ copy_values(e) for e in v ]
+    return v
+
+class EntityCache(object):
+    """
+    Least-recently-used cache of entity values, validated by storage stat keys.
+    """
+
+    def __init__(self, max_size):
+        """
+        Initialize entity cache.
+
+        max_size    is the maximum total size (in bytes of stored data) of entity
+                    values that are held in the cache.
+        """
+        self._max_size  = max_size
+        self._lock      = threading.Lock()
+        self._entries   = collections.OrderedDict()     # key -> (stat_key, size, values, gen)
+        self._paths     = {}                            # path -> set of keys
+        self._dir_gens  = {}                            # dirpath -> generation
+        self._gen       = 0
+        self._size      = 0
+        self._hits      = 0
+        self._misses    = 0
+        self._evictions = 0
+        return
+
+    def get_values(self, cls, path, load_values):
+        """
+        Returns a copy of the entity values stored at the indicated path, using
+        cached values if they are still valid, or None if the values cannot be read.
+
+        cls         is the class of entity whose values are read.
+        path        is the path of the entity body in Annalist storage.
+        load_values is a function that reads the stored data, returning a pair
+                    (size, values) where 'size' is the size of the stored data,
+                    or None if the data cannot be read.
+        """
+        if self._max_size <= 0:
+            r = load_values()
+            return r and r[1]
+        key     = (cls, path)
+        stat    = get_entity_storage().stat_key(path)
+        with self._lock:
+            gen   = self._gen
+            entry = self._remove(key)
+            if entry:
+                if entry[0] == stat and not self._stale(path, entry[3]):
+                    self._add(key, entry)
+                    self._hits += 1
+                    return copy_values(entry[2])
+            self._misses += 1
+        r = load_values()
+        if r is None:
+            return None
+        (size, values) = r
+        if ( stat and size <= self._max_size and
+             "@error" not in values and
+             stat[0] < time.time() - RACY_INTERVAL ):
+            with self._lock:
+                # Values are not cached if a directory was invalidated while reading
+                if gen == self._gen:
+                    self._put(key, (stat, size, values, gen))
+            values = copy_values(values)
+        return values
+
+    def _add(self, key, entry):
+        """
+        Add entry for key, which is not in the cache.
+        (Must be called with the cache lock held.)
+        """
+        self._entries[key] = entry
+        self._paths.setdefault(key[1], set()).add(key)
+        self._size += entry[1]
+        return
+
+    def _remove(self, key):
+        """
+        Remove and return entry for key, or None if there is no such entry.
+        (Must be called with the cache lock held.)
+        """
+        entry = self._entries.pop(key, None)
+        if entry:
+            keys = self._paths[key[1]]
+            keys.discard(key)
+            if not keys:
+                del self._paths[key[1]]
+            self._size -= entry[1]
+        return entry
+
+    def _put(self, key, entry):
+        """
+        Add entry to cache, evicting least recently used entries to make space.
+        (Must be called with the cache lock held.)
+        """
+        self._remove(key)
+        self._add(key, entry)
+        while self._size > self._max_size:
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+        return
+
+    def _stale(self, path, gen):
+        """
+        Returns True if a directory containing the indicated path has been invalidated
+        since generation 'gen'.  (Must be called with the cache lock held.)
+        """
+        if not self._dir_gens:
+            return False
+        d = path.rstrip("/")
+        while "/" in d:
+            d = d[:d.rindex("/")]
+            if self._dir_gens.get(d, 0) > gen:
+                return True
+        return False
+
+    def _sweep(self):
+        """
+        Discard entries made stale by invalidated directories, after which the
+        directory generations are no longer needed.  (Must be called with the 
+        cache lock held.)
+        """
+        for key in [ k for (k, e) in self._entries.iteritems() if self._stale(k[1], e[3]) ]:
+            self._remove(key)
+        self._dir_gens.clear()
+        return
+
+    def invalidate(self, path):
+        """
+        Discard any cached values for the entity body at the indicated path.
+        """
+        with self._lock:
+            for key in list(self._paths.get(path, ())):
+                self._remove(key)
+        return
+
+    def invalidate_dir(self, dirpath):
+        """
+        Discard any cached values for entity bodies in the indicated directory or 
+        its subdirectories.
+        """
+        with self._lock:
+            self._gen += 1
+            self._dir_gens[dirpath.rstrip("/")] = self._gen
+            if len(self._dir_gens) > DIR_GENERATIONS_MAX:
+                self._sweep()
+        return
+
+    def clear(self):
+        """
+        Discard all cached values and reset usage statistics.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._paths.clear()
+            self._dir_gens.clear()
+            self._size      = 0
+            self._hits      = 0
+            self._misses    = 0
+            self._evictions = 0
+        return
+
+    def stats(self):
+        """
+        Returns a dictionary of cache usage statistics.
+        """
+        with self._lock:
+            self._sweep()
+            return (
+                { 'hits':       self._hits
+                , 'misses':     self._misses
+                , 'evictions':  self._evictions
+                , 'entries':    len(self._entries)
+                , 'size':       self._size
+                , 'max_size':   self._max_size
+                })
+
+_entity_cache = None
+
+def get_entity_cache():
+    """
+    Returns the process-wide entity cache.
+    """
+    global _entity_cache
+    if _entity_cache is None:
+        _entity_cache = EntityCache(getattr(settings, "ANNALIST_ENTITY_CACHE_SIZE", 0))
+    return _entity_cache
+
+def _reset_after_fork():
+    global _entity_cache
+    _entity_cache = None
+    return
+
+register_fork_reset(_reset_after_fork)
+
+# End.
@@ -21,6 +21,7 @@ from annalist.exceptions        import Annalist_Error
 from annalist.identifiers       import ANNAL
 from annalist                   import util
 from annalist.models.entity     import Entity
+from annalist.models.searchindex import search_entity_changed, search_entity_removed
 
 class EntityData(Entity):
 
@@ -72,4 +73,19 @@ class EntityData(Entity):
         """
         return [layout.ENTITY_OLD_DATA_FILE]
 
+    def _post_update_processing(self, entitydata, post_update_flags):
+        """
+        Post-update processing: update the collection search index.
+        """
+        search_entity_changed(self, entitydata)
+        return entitydata
+
+    def _remove(self, type_uri):
+        """
+        Remove entity data, and its entry in the collection search index.
+        """
+        super(EntityData, self)._remove(type_uri)
+        search_entity_removed(self)
+        return
+
 # End.
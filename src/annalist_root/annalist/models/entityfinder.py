@@ -11,14 +11,28 @@ import logging
 log = logging.getLogger(__name__)
 
 import re
+import heapq
+import sqlite3
+import itertools
+import threading
+import functools
+import collections
 from pyparsing import Word, QuotedString, Literal, Group, Empty, StringEnd, ParseException
 from pyparsing import alphas, alphanums
 
-from annalist.util                  import extract_entity_id
+from django.conf import settings
+
+from annalist.identifiers           import ANNAL
+from annalist.util                  import extract_entity_id, split_type_entity_id
 
 from annalist.models.recordtype     import RecordType
 from annalist.models.recordtypedata import RecordTypeData
-from annalist.models.entitytypeinfo import EntityTypeInfo
+from annalist.models.entitytypeinfo import EntityTypeInfo, ENUM_ENTITIES_CHUNK
+from annalist.models.entitystorage  import register_fork_reset
+from annalist.models.searchindex    import (
+    get_search_index, indexed_properties, entity_index_values
+    )
+from annalist.models.typegraph      import get_type_graph
 
 #   -------------------------------------------------------------------
 #   Auxilliary functions
@@ -32,13 +46,49 @@ def order_entity_key(entity):
 
         sorted(entities, order_entity_key)
     """
-    type_id   = entity.get_type_id() 
-    entity_id = entity.get_id()
+    return order_entity_id_key(entity.get_type_id(), entity.get_id())
+
+def order_entity_id_key(type_id, entity_id):
+    """
+    Function returns sort key for ordering entities by type and entity id, using
+    just the identifiers (cf. `order_entity_key`), so that entities can be ordered
+    without being loaded.
+
+    >>> sorted([("t", "b"), ("_t", "a"), ("t", "_a"), ("t", "a")], key=lambda k: order_entity_id_key(*k))
+    [('_t', 'a'), ('t', '_a'), ('t', 'a'), ('t', 'b')]
+    """
     key = ( 0 if type_id.startswith('_')   else 1, type_id, 
             0 if entity_id.startswith('_') else 1, entity_id
           )
     return key
 
+def ordered_keys(keys, count=None):
+    """
+    Iterate over the supplied list of sort keys in ascending order.  The keys are
+    ordered as they are consumed, using a heap, so that taking the first few keys
+    does not require the whole list to be sorted.
+
+    count       if supplied, is the number of keys expected to be taken:  these are
+                selected using a heap of this size (see `heapq.nsmallest`), and any
+                further keys are ordered only if they are taken.
+
+    >>> list(ordered_keys([3, 1, 4, 5, 9, 2, 6]))
+    [1, 2, 3, 4, 5, 6, 9]
+    >>> list(ordered_keys([3, 1, 4, 5, 9, 2, 6], count=3))
+    [1, 2, 3, 4, 5, 6, 9]
+    """
+    if count is not None:
+        first = heapq.nsmallest(count, keys)
+        for k in first:
+            yield k
+        if len(first) < count:
+            return
+        keys = [ k for k in keys if k > first[-1] ]
+    heapq.heapify(keys)
+    while keys:
+        yield heapq.heappop(keys)
+    return
+
 #   -------------------------------------------------------------------
 #   EntityFinder
 #   -------------------------------------------------------------------
@@ -81,43 +131,61 @@ class EntityFinder(object):
             log.warning("EntityFinder.get_collection_uri_subtypes: no type_uri for %s"%(type_id,))
         return self.get_collection_uri_subtypes(supertypeuri, altscope)
 
+    def get_base_types(self, type_id=None):
+        """
+        Returns an iterator of `entitytypeinfo` objects for the types whose entities
+        are enumerated by `get_base_entities`.
+        """
+        if type_id:
+            return self.get_collection_subtypes(type_id, "all")
+        return (
+            EntityTypeInfo(self._coll, t) 
+              for t in self.get_collection_type_ids(altscope="all")
+            )
+
     def get_collection_uri_subtypes(self, type_uri, altscope=None):
         """
         Returns a iterator of `entitytypeinfo` objects for all subtypes
         of the supplied type in the current collection, including the 
         identified type itself.
+
+        Subtypes are found using the collection type graph, and include types
+        whose supertypes are declared indirectly (see `TypeGraph`).
         """
         # log.info(
         #     "@@ EntityFinder.get_collection_uri_subtypes: type_uri %s, altscope=%s"%
         #     (type_uri, altscope)
         #     )
         if type_uri is not None:
+            subtype_ids = get_type_graph(self._coll).subtype_ids(type_uri)
             for tid in self.get_collection_type_ids(altscope):
-                tinfo = EntityTypeInfo(self._coll, tid)
-                if tinfo and (type_uri in tinfo.get_all_type_uris()):
-                    yield tinfo
+                if tid in subtype_ids:
+                    yield EntityTypeInfo(self._coll, tid)
         return 
 
-    def get_type_entities(self, type_id, user_permissions, altscope):
+    def get_type_entities(self, type_id, user_permissions, altscope, id_filter=None):
         """
         Iterate over entities from collection matching the supplied type.
 
         'altscope' is used to determine the extent of data to be included in the listing:
         a value of 'all' means that site-wide entyities are icnluded in the listing.
         Otherwise only collection entities are included.        
+
+        'id_filter', if supplied, is used to skip entities without loading them
+        (see `EntityTypeInfo.enum_entities_with_implied_values`).
         """
         #@@
         # log.info("get_type_entities: type_id %s"%type_id)
         #@@
         entitytypeinfo = EntityTypeInfo(self._coll, type_id)
         for e in entitytypeinfo.enum_entities_with_implied_values(
-                user_permissions, altscope=altscope
+                user_permissions, altscope=altscope, id_filter=id_filter
                 ):
             if e.get_id() != "_initial_values":
                 yield e
         return
 
-    def get_subtype_entities(self, type_id, user_permissions, altscope):
+    def get_subtype_entities(self, type_id, user_permissions, altscope, id_filter=None):
         """
         Iterate over entities from collection that are of the indicated type
         or any of its subtypes.
@@ -129,22 +197,22 @@ class EntityFinder(object):
         # NOTE: consider types from all scopes, then entities from specifiecd scope
         for entitytypeinfo in self.get_collection_subtypes(type_id, "all"):
             for e in entitytypeinfo.enum_entities_with_implied_values(
-                    user_permissions, altscope=altscope
+                    user_permissions, altscope=altscope, id_filter=id_filter
                     ):
                 if e.get_id() != "_initial_values":
                     yield e
         return
 
-    def get_all_types_entities(self, types, user_permissions, altscope):
+    def get_all_types_entities(self, types, user_permissions, altscope, id_filter=None):
         """
         Iterate over all entities of all type ids from a supplied type iterator
         """
         for t in types:
-            for e in self.get_type_entities(t, user_permissions, altscope):
+            for e in self.get_type_entities(t, user_permissions, altscope, id_filter=id_filter):
                 yield e
         return
 
-    def get_base_entities(self, type_id=None, user_permissions=None, altscope=None):
+    def get_base_entities(self, type_id=None, user_permissions=None, altscope=None, id_filter=None):
         """
         Iterate over base entities from collection, matching the supplied type id if supplied.
 
@@ -154,53 +222,288 @@ class EntityFinder(object):
             #@@
             # log.info("get_base_entities: type_id %s"%type_id)
             #@@
-            return self.get_subtype_entities(type_id, user_permissions, altscope)
+            return self.get_subtype_entities(
+                type_id, user_permissions, altscope, id_filter=id_filter
+                )
             # return self.get_type_entities(type_id, user_permissions, scope)
         else:
             #@@
             # log.info("get_base_entities: all types")
             #@@
             return self.get_all_types_entities(
-                self.get_collection_type_ids(altscope="all"), user_permissions, altscope
+                self.get_collection_type_ids(altscope="all"), user_permissions, altscope,
+                id_filter=id_filter
                 )
         return
 
-    def search_entities(self, entities, search):
+    def search_entities(self, entities, search, matched=None):
         """
         Iterate over entities from supplied iterator containing supplied search term.
+
+        matched     if supplied, is a set of (type_id, entity_id) pairs for entities
+                    that are known to contain the search term without being checked.
         """
         for e in entities:
-            if self.entity_contains(e, search):
+            if matched and (e.get_type_id(), e.get_id()) in matched:
+                yield e
+            elif self.entity_contains(e, search):
                 yield e
         return
 
+    def search_index_lookup(self, search):
+        """
+        Look up a search term in the collection search index.  The index is used
+        only if it has already been built (see `build_search_index`).
+
+        Returns a pair (indexed, matched) of containers of (type_id, entity_id) pairs
+        for entities in the index, and those that may contain the search term, or 
+        None if the index is not used.
+        """
+        index = get_search_index(self._coll)
+        if index is None:
+            return None
+        try:
+            if not index.complete():
+                return None
+            return index.search(search)
+        except sqlite3.Error, e:
+            log.warning("EntityFinder.search_index_lookup: %s"%(e,))
+            index.remove()
+        return None
+
+    def build_search_index(self):
+        """
+        Build (or rebuild) the search index for the current collection, if a search
+        index is used.  This is done by `annalist-manager indexcollection`, so that
+        the index is not built by a list request.
+
+        Returns True if the index has been built, otherwise False.
+        """
+        index = get_search_index(self._coll)
+        if index is None:
+            return False
+        index.remove()
+        index.build(self._search_index_entities())
+        return True
+
+    def selector_index_filter(self, context, type_id=None):
+        """
+        Returns a function that is called with a type id and entity id, and returns
+        False for entities that cannot be selected by the current selector, using
+        indexed property values from the collection search index, or None if the
+        index is not used for the selector.
+
+        The index is used only if it has already been built (see `build_search_index`)
+        and records values of the property compared by the selector, and (if a type
+        id is supplied) only for types whose entities are stored in the collection
+        type data:  configuration entities are not indexed.
+
+        Entities of types that define a field alias for the selector property
+        are not filtered, as the index records stored values, not aliased values.
+        """
+        property_uri = self._selector.index_property()
+        if not property_uri:
+            return None
+        if property_uri not in indexed_properties():
+            return None
+        if type_id and not isinstance(
+                EntityTypeInfo(self._coll, type_id).entityparent, RecordTypeData
+                ):
+            return None
+        index = get_search_index(self._coll)
+        if index is None:
+            return None
+        try:
+            if not index.complete():
+                return None
+            sel_filter = self._selector.index_filter(index.lookup_property, context)
+        except sqlite3.Error, e:
+            log.warning("EntityFinder.selector_index_filter: %s"%(e,))
+            index.remove()
+            return None
+        if sel_filter is None:
+            return None
+        aliased      = {}
+        def id_filter(type_id, entity_id):
+            if type_id not in aliased:
+                aliased[type_id] = self._type_aliases_property(type_id, property_uri)
+            return aliased[type_id] or sel_filter(type_id, entity_id)
+        return id_filter
+
+    def _type_aliases_property(self, type_id, property_uri):
+        """
+        Returns True if the indicated type defines a field alias for a property.
+        """
+        recordtype = EntityTypeInfo(self._coll, type_id).recordtype
+        if not recordtype:
+            return False
+        for alias in recordtype.get(ANNAL.CURIE.field_aliases, []):
+            if alias.get(ANNAL.CURIE.alias_target, None) == property_uri:
+                return True
+        return False
+
+    def _search_index_entities(self):
+        """
+        Iterate over (type_id, entity_id, values) for all entities in the type data
+        of the current collection, for building a search index.  The stored entity
+        values are indexed, as when the index is updated for a saved entity (see
+        `entity_index_values`).
+        """
+        for type_id in self.get_collection_type_ids(altscope="all"):
+            typeinfo = EntityTypeInfo(self._coll, type_id)
+            if not isinstance(typeinfo.entityparent, RecordTypeData):
+                continue
+            if not RecordTypeData.exists(self._coll, type_id):
+                continue
+            for e in typeinfo.enum_entities(altscope=None):
+                yield (type_id, e.get_id(), entity_index_values(e, e.get_values()))
+        return
+
     def get_entities(self, 
         user_permissions=None, type_id=None, altscope=None, context=None, search=None
         ):
         """
         Iterates over entities of the specified type, matching search term and visible to 
         supplied user permissions.
+
+        When a search term is supplied, the collection search index (if used) selects
+        the entities to be loaded.  Unless the ANNALIST_SEARCH_VERIFY setting is False,
+        each entity selected is also checked for the search term.  Likewise, when the
+        selector compares an indexed property, the index selects the entities to be
+        loaded, and each entity selected is checked by the selector.
         """
+        (id_filter, matched) = self.get_index_filter(context, search, type_id=type_id)
         entities = self._selector.filter(
-            self.get_base_entities(type_id, user_permissions, altscope), context=context
+            self.get_base_entities(type_id, user_permissions, altscope, id_filter=id_filter),
+            context=context
             )
         if search:
-            entities = self.search_entities(entities, search)
+            entities = self.search_entities(entities, search, matched=matched)
         return entities
 
+    def get_index_filter(self, context, search, type_id=None):
+        """
+        Returns a pair (id_filter, matched), where `id_filter` is a function called
+        with a type id and entity id that returns False for entities that cannot be
+        selected by the current selector and search term, or None, and `matched` is
+        a set of (type_id, entity_id) pairs for entities known to contain the search
+        term without being checked, or None (see `get_entities`).
+
+        type_id, if supplied, is the type id of the entities to be selected.
+        """
+        id_filter = None
+        matched   = None
+        if search:
+            found = self.search_index_lookup(search)
+            if found:
+                (indexed, candidates) = found
+                def id_filter(type_id, entity_id):
+                    key = (type_id, entity_id)
+                    return (key in candidates) or (key not in indexed)
+                if not getattr(settings, "ANNALIST_SEARCH_VERIFY", True):
+                    matched = candidates
+        sel_filter = self.selector_index_filter(context, type_id=type_id)
+        if sel_filter:
+            if id_filter:
+                search_filter = id_filter
+                def id_filter(type_id, entity_id):
+                    return search_filter(type_id, entity_id) and sel_filter(type_id, entity_id)
+            else:
+                id_filter = sel_filter
+        return (id_filter, matched)
+
     def get_entities_sorted(self, 
-        user_permissions=None, type_id=None, altscope=None, context={}, search=None
+        user_permissions=None, type_id=None, altscope=None, context={}, search=None,
+        offset=0, limit=None, after=None
         ):
         """
         Get sorted list of entities of the specified type, matching search term and 
         visible to supplied user permissions.
+
+        offset      is a number of matching entities to be skipped.
+        limit       if supplied, is the maximum number of entities returned.
+        after       if supplied, is a composite "type_id/entity_id" identifier:
+                    only entities that are ordered after this are returned, so a
+                    list can be continued from the last entity of a previous page.
+
+        When any of these is supplied, entity identifiers are sorted before any
+        entity is loaded, and entities are loaded in order only until enough have
+        been selected.
         """
+        if offset or (limit is not None) or after:
+            return list(self._get_entities_page(
+                user_permissions, type_id, altscope, context, search,
+                offset, limit, after
+                ))
         entities = self.get_entities(
             user_permissions, type_id=type_id, altscope=altscope, 
             context=context, search=search
             )
         return sorted(entities, key=order_entity_key)
 
+    def _get_entities_page(self, 
+        user_permissions, type_id, altscope, context, search, offset, limit, after
+        ):
+        """
+        Iterate over a sorted page of entities (see `get_entities_sorted`).
+        """
+        (id_filter, matched) = self.get_index_filter(context, search, type_id=type_id)
+        after_key = None
+        if after:
+            after_key = order_entity_id_key(*split_type_entity_id(after, type_id or ""))
+        typeinfos = {}
+        keys      = []
+        for typeinfo in self.get_base_types(type_id):
+            if ( user_permissions and
+                 typeinfo.permissions_map['list'] not in 
+                    user_permissions[ANNAL.CURIE.user_permission] ):
+                continue
+            typeinfos[typeinfo.type_id] = typeinfo
+            for entity_id in typeinfo.enum_entity_ids(altscope=altscope):
+                if entity_id == "_initial_values":
+                    continue
+                if id_filter and not id_filter(typeinfo.type_id, entity_id):
+                    continue
+                key = order_entity_id_key(typeinfo.type_id, entity_id)
+                if after_key is None or key > after_key:
+                    keys.append(key)
+        # Without a selector or search term, every entity loaded is returned
+        needed   = None if limit is None else offset + limit
+        selected = bool(search) or not self._selector.selects_all()
+        ordered  = ordered_keys(keys, count=None if selected else needed)
+        count    = 0
+        while needed is None or count < needed:
+            size  = ENUM_ENTITIES_CHUNK if needed is None else min(ENUM_ENTITIES_CHUNK, needed-count)
+            chunk = list(itertools.islice(ordered, size))
+            if not chunk:
+                break
+            for e in self._load_keyed_entities(typeinfos, chunk):
+                if not self._selector.select_entity(e, context):
+                    continue
+                if search:
+                    if not (matched and (e.get_type_id(), e.get_id()) in matched):
+                        if not self.entity_contains(e, search):
+                            continue
+                count += 1
+                if count > offset:
+                    yield e
+        return
+
+    def _load_keyed_entities(self, typeinfos, keys):
+        """
+        Iterate over entities for a list of sort keys (see `order_entity_id_key`),
+        with implied values instantiated, omitting any that do not exist.
+        """
+        for type_id, type_keys in itertools.groupby(keys, key=lambda k: k[1]):
+            typeinfo = typeinfos[type_id]
+            for e in typeinfo.get_entities([ k[3] for k in type_keys ]):
+                if e is None:
+                    continue
+                if typeinfo.recordtype:
+                    e = typeinfo.get_entity_implied_values(e)
+                yield e
+        return
+
     @classmethod
     def entity_contains(cls, e, search):
         """
@@ -260,6 +563,33 @@ class EntityFinder(object):
 #   EntitySelector
 #   -------------------------------------------------------------------
 
+#   Selector grammar (see `EntitySelector.parse_selector`), built once when the
+#   module is loaded.
+_p_name     = Word(alphas+"_", alphanums+"_")
+_p_id       = Word(alphas+"_@", alphanums+"_-.~:/?#@!$&'()*+,;=)")
+_p_val      = ( Group( Literal("[") + _p_id + Literal("]") )
+              | Group( _p_name + Literal("[") + _p_id + Literal("]") )
+              | Group( QuotedString('"', "\\") )
+              | Group( QuotedString("'", "\\") )
+              | Group( _p_id )
+              )
+_p_comp     = ( Literal("==") | Literal("in") | _p_name )
+_p_selector = ( _p_val + _p_comp + _p_val + StringEnd() ).streamline()
+
+#   Maximum number of compiled selectors kept by `EntitySelector.compiled_selector`
+SELECTOR_CACHE_SIZE = 256
+
+_selector_lock  = threading.Lock()
+_selector_cache = collections.OrderedDict()     # selector -> (predicate, index term)
+
+def _reset_after_fork():
+    global _selector_lock, _selector_cache
+    _selector_lock  = threading.Lock()
+    _selector_cache = collections.OrderedDict()
+    return
+
+register_fork_reset(_reset_after_fork)
+
 class EntitySelector(object):
     """
     This class implements a selector filter.  It is initialized with a selector
@@ -307,8 +637,11 @@ class EntitySelector(object):
     """
     def __init__(self, selector, fieldcomp=None):
         self._fieldcomp = fieldcomp
+        (predicate, index_term) = self.compiled_selector(selector)
         # Returns None if no filter is applied, otherwise a predcicate function
-        self._selector  = self.compile_selector_filter(selector)
+        self._selector  = predicate and functools.partial(predicate, fieldcomp)
+        # Returns None if the selector cannot be answered from a property index
+        self._index_term = index_term
         return
 
     def filter(self, entities, context=None):
@@ -343,6 +676,156 @@ class EntitySelector(object):
             return self._selector(entity, context)
         return True
 
+    def selects_all(self):
+        """
+        Returns True if the selector selects all entities.
+        """
+        return self._selector is None
+
+    def index_property(self):
+        """
+        Returns the entity property compared by the selector, if the selector
+        may be answered from a property index, otherwise None.
+        """
+        return self._index_term and self._index_term['field_id']
+
+    def index_filter(self, lookup, context=None):
+        """
+        Returns a function that is called with a type id and entity id, and returns
+        False for entities that cannot be selected, using a property index, or None
+        if the index cannot be used for the selector and context.
+
+        lookup      is a function called with a property URI, a list of string
+                    values and a flag indicating whether entities with no value for
+                    the property are also matched, which returns a pair (indexed,
+                    matched) of containers of (type_id, entity_id) pairs, or None if
+                    the property is not indexed (cf. `SearchIndex.lookup_property`).
+        context     is a dictionary of context values that may be referenced by
+                    the selector.
+
+        The function returned may also return True for entities that are not
+        selected, so the selector must still be applied to entities loaded.
+
+        >>> def lookup(p, vals, missing):
+        ...     found = { 'a': [('t', '1')], 'b': [('t', '2')] }
+        ...     matched = set(k for v in vals for k in found.get(v, []))
+        ...     if missing:
+        ...         matched.add(('t', '3'))
+        ...     return (set([('t', '1'), ('t', '2'), ('t', '3')]), matched)
+        >>> c = { 'view': { 'v:a': 'a', 'v:b': ['a', 'b'] } }
+        >>> f = EntitySelector("[p:a] == 'a'").index_filter(lookup, c)
+        >>> [ f('t', i) for i in ('1', '2', '3', '4') ]
+        [True, False, False, True]
+        >>> f = EntitySelector("[p:a] in view[v:b]").index_filter(lookup, c)
+        >>> [ f('t', i) for i in ('1', '2', '3', '4') ]
+        [True, True, True, True]
+        >>> f = EntitySelector("[p:a] in view[v:a]").index_filter(lookup, c)
+        >>> [ f('t', i) for i in ('1', '2', '3', '4') ]
+        [True, False, True, True]
+        >>> f = EntitySelector("'b' in [p:a]").index_filter(lookup, c)
+        >>> [ f('t', i) for i in ('1', '2', '3', '4') ]
+        [False, True, False, True]
+        >>> EntitySelector("[p:a] == view[v:b]").index_filter(lookup, c) is None
+        True
+        >>> EntitySelector("[p:a] == [p:b]").index_filter(lookup, c) is None
+        True
+        """
+        term = self._index_term
+        if not term:
+            return None
+        value = self.selector_value(term['value'], context or {})
+        if term['comp'] == "==":
+            # Entity value equals value
+            if value is None:
+                found = lookup(term['field_id'], [], True)
+            elif isinstance(value, (str, unicode)):
+                found = lookup(term['field_id'], [value], False)
+            else:
+                return None
+        elif term['comp'] == "in":
+            # Entity value is empty, or is equal to or a member of value
+            if value is None:
+                found = lookup(term['field_id'], [], True)
+            elif isinstance(value, (str, unicode)):
+                found = lookup(term['field_id'], [value], True)
+            elif ( isinstance(value, list) and 
+                   all(isinstance(v, (str, unicode)) for v in value) ):
+                found = lookup(term['field_id'], value, True)
+            else:
+                return None
+        elif term['comp'] == "contains":
+            # Value is equal to or a member of entity value (an empty value matches all)
+            if value and isinstance(value, (str, unicode)):
+                found = lookup(term['field_id'], [value], False)
+            else:
+                return None
+        if not found:
+            return None
+        (indexed, matched) = found
+        def index_filter_f(type_id, entity_id):
+            key = (type_id, entity_id)
+            return (key in matched) or (key not in indexed)
+        return index_filter_f
+
+    @classmethod
+    def selector_index_term(cls, selector):
+        """
+        Returns a description of a selector that compares an entity property with a
+        literal or context value using `==` or `in`, or None.  The description is
+        a dictionary with the entity property (`field_id`), the comparison (`comp`,
+        which is "==", "in" or "contains" for a value in an entity list), and the
+        value compared (`value`, as returned by `parse_selector`).
+
+        >>> t = EntitySelector.selector_index_term("'foo:bar' in [@type]")
+        >>> (t['field_id'], t['comp'], t['value']['value'])
+        ('@type', 'contains', 'foo:bar')
+        >>> t = EntitySelector.selector_index_term("[p:a] in view[v:a]")
+        >>> (t['field_id'], t['comp'], t['value']['name'])
+        ('p:a', 'in', 'view')
+        >>> EntitySelector.selector_index_term("[p:a] == [p:b]") is None
+        True
+        >>> EntitySelector.selector_index_term("ALL") is None
+        True
+        """
+        if selector in {None, "", "ALL"}:
+            return None
+        sel = cls.parse_selector(selector)
+        if not sel:
+            return None
+        return cls._selector_index_term(sel)
+
+    @classmethod
+    def _selector_index_term(cls, sel):
+        """
+        Returns a selector index term description (see `selector_index_term`) for
+        a parsed selector, or None.
+        """
+        v1   = sel['val1']
+        v2   = sel['val2']
+        comp = sel['comp']
+        if v1['type'] == "entity" and v2['type'] in {"literal", "context"}:
+            if comp in {"==", "in"}:
+                return { 'field_id': v1['field_id'], 'comp': comp, 'value': v2 }
+        elif v2['type'] == "entity" and v1['type'] in {"literal", "context"}:
+            if comp == "==":
+                return { 'field_id': v2['field_id'], 'comp': comp, 'value': v1 }
+            if comp == "in":
+                return { 'field_id': v2['field_id'], 'comp': "contains", 'value': v1 }
+        return None
+
+    @classmethod
+    def selector_value(cls, selval, context):
+        """
+        Returns a literal or context value referenced by a selector (cf. `get_literal`
+        and `get_context` in `compile_selector_filter`).
+        """
+        if selval['type'] == "literal":
+            return selval['value']
+        name = selval['name']
+        if name in context and context[name]:
+            return context[name].get(selval['field_id'], None)
+        return None
+
     @classmethod  #@@ @staticmethod, no cls?
     def parse_selector(cls, selector):
         """
@@ -374,6 +857,7 @@ class EntitySelector(object):
                          / "*" / "+" / "," / ";" / "="
 
         Parser uses pyparsing combinators (cf. http://pyparsing.wikispaces.com).
+        The grammar is defined when this module is loaded (see `_p_selector`).
         """
         def get_value(val_list):
             if len(val_list) == 1:
@@ -384,18 +868,8 @@ class EntitySelector(object):
                 return { 'type': 'context', 'name': val_list[0], 'field_id': val_list[2], 'value': None }
             else:
                 return { 'type': 'unknown', 'name': None,        'field_id': None,        'value': None }
-        p_name     = Word(alphas+"_", alphanums+"_")
-        p_id       = Word(alphas+"_@", alphanums+"_-.~:/?#@!$&'()*+,;=)")
-        p_val      = ( Group( Literal("[") + p_id + Literal("]") )
-                     | Group( p_name + Literal("[") + p_id + Literal("]") )
-                     | Group( QuotedString('"', "\\") )
-                     | Group( QuotedString("'", "\\") )
-                     | Group( p_id )
-                     )
-        p_comp     = ( Literal("==") | Literal("in") | p_name )
-        p_selector = ( p_val + p_comp + p_val + StringEnd() )
         try:
-            resultlist = p_selector.parseString(selector).asList()
+            resultlist = _p_selector.parseString(selector).asList()
         except ParseException:
             return None
         resultdict = {}
@@ -415,6 +889,51 @@ class EntitySelector(object):
 
         This function returns a filter function compiled from the supplied selector.
         """
+        (predicate, _) = self.compiled_selector(selector)
+        return predicate and functools.partial(predicate, self._fieldcomp)
+
+    @classmethod
+    def compiled_selector(cls, selector):
+        """
+        Returns a pair (predicate, index_term) for a selector, where `predicate` is
+        a function called with a `FieldComparison` object, an entity and a context
+        dictionary, or None if no selection is performed, and `index_term` is as
+        returned by `selector_index_term`.
+
+        Compiled selectors are kept in a bounded cache keyed by the selector string,
+        from which the least recently used are discarded (see SELECTOR_CACHE_SIZE).
+
+        >>> c1 = EntitySelector.compiled_selector("[p:a] == 'x'")
+        >>> c1 is EntitySelector.compiled_selector("[p:a] == 'x'")
+        True
+        >>> c1[0](None, {'p:a': 'x'}, {})
+        True
+        >>> EntitySelector.compiled_selector("ALL")
+        (None, None)
+        """
+        if selector in {None, "", "ALL"}:
+            return (None, None)
+        with _selector_lock:
+            compiled = _selector_cache.pop(selector, None)
+            if compiled:
+                _selector_cache[selector] = compiled
+                return compiled
+        sel = cls.parse_selector(selector)
+        if not sel:
+            raise ValueError("Unrecognized selector syntax (%s)"%selector)
+        compiled = (cls._compile_selector(selector, sel), cls._selector_index_term(sel))
+        with _selector_lock:
+            _selector_cache[selector] = compiled
+            while len(_selector_cache) > SELECTOR_CACHE_SIZE:
+                _selector_cache.popitem(last=False)
+        return compiled
+
+    @classmethod
+    def _compile_selector(cls, selector, sel):
+        """
+        Returns a predicate function compiled from a parsed selector, which is
+        called with a `FieldComparison` object, an entity and a context dictionary.
+        """
         def get_entity(field_id):
             "Get field from entity tested by filter"
             def get_entity_f(e, c):
@@ -447,12 +966,12 @@ class EntitySelector(object):
                 assert False, "Unrecognized value type from selector"
         #
         def match_eq(v1f, v2f):
-            def match_eq_f(e, c):
+            def match_eq_f(fc, e, c):
                 return v1f(e, c) == v2f(e, c)
             return match_eq_f
         #
         def match_in(v1f, v2f):
-            def match_in_f(e, c):
+            def match_in_f(fc, e, c):
                 v1 = v1f(e, c)
                 if not v1: return True
                 v2 = v2f(e, c)
@@ -462,15 +981,10 @@ class EntitySelector(object):
             return match_in_f
         #
         def match_subtype(v1f, v2f):
-            def match_subtype_f(e, c):
-                return self._fieldcomp.subtype(v1f(e, c), v2f(e, c))
+            def match_subtype_f(fc, e, c):
+                return fc.subtype(v1f(e, c), v2f(e, c))
             return match_subtype_f
         #
-        if selector in {None, "", "ALL"}:
-            return None
-        sel = self.parse_selector(selector)
-        if not sel:
-            raise ValueError("Unrecognized selector syntax (%s)"%selector)
         v1f = get_val_f(sel['val1'])
         v2f = get_val_f(sel['val2'])
         if sel['comp'] == "==":
@@ -513,16 +1027,16 @@ class FieldComparison(object):
         If type1_uri is not specified, assume no restriction.
 
         If type2_uri is not specified, assume it does not satisfy the restriction.
+
+        Supertypes are found using the collection type graph, and include types
+        that are declared as supertypes indirectly (see `TypeGraph`).
         """
         # log.info("FieldComparison.subtype(%s, %s)"%(type1_uri, type2_uri))
         if not type2_uri or (type1_uri == type2_uri):
             return True
         if not type1_uri:
             return False
-        type1_info = self.get_uri_type_info(type1_uri)
-        type1_supertype_uris = (type1_info and type1_info.get_all_type_uris()) or []
-        # log.info("FieldComparison.subtype: type1_uris (supertypes) %r"%(type1_uris,))
-        return type2_uri in type1_supertype_uris
+        return get_type_graph(self._coll).subtype(type1_uri, type2_uri)
 
 if __name__ == "__main__":
     import doctest
@@ -0,0 +1,144 @@
+"""
+Persistent allocation of identifiers for new entities.
+
+New entities are given automatically generated identifiers, either sequence
+numbers (e.g. `00000042`) or, when an entity is copied, the identifier of the
+original entity with a sequence number suffix (e.g. `entity1_03`).  Finding the
+next unused identifier by probing for the existence of each candidate in turn
+takes time proportional to the number of entities already allocated, and an
+in-memory record of the last identifier allocated is lost when a server process
+is restarted, and is not shared between server processes.
+
+An identifier counter file, stored alongside the directory that contains the
+entities, records the last sequence number allocated for each identifier prefix.
+The counter file is read and updated while holding a lock on the directory that
+contains it, so a sequence number is allocated just once, even when several server
+processes are running.  When a counter file has no entry for a prefix, the
+directory is scanned once to find the highest sequence number in use.
+
+Copied entity identifier prefixes are many and are mostly used just once, so only
+the most recently used copy counters are kept in the counter file:  a copy counter
+that has been discarded is recovered, if needed, by scanning the directory again.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os.path
+import re
+import json
+import collections
+
+import logging
+log = logging.getLogger(__name__)
+
+from annalist                       import layout
+from annalist.models.entitystorage  import get_entity_storage
+
+#   Counter key used for plain sequence number identifiers
+SEQUENCE_KEY    = ""
+
+#   Maximum number of copied identifier counters kept in a counter file
+COPY_KEYS_MAX   = 32
+
+class EntityIdCounter(object):
+    """
+    Identifier counters for entities stored in a directory.
+    """
+
+    def __init__(self, dirpath):
+        """
+        Initialize identifier counter object.
+
+        dirpath     is the directory containing entity subdirectories.  The counter
+                    file is stored in the directory that contains this directory.
+        """
+        self._dirpath     = dirpath.rstrip("/")
+        self._counterpath = os.path.join(
+            os.path.dirname(self._dirpath),
+            layout.ENTITY_ID_COUNTER_FILE%{'id': os.path.basename(self._dirpath)}
+            )
+        return
+
+    def _read(self):
+        """
+        Returns an ordered dictionary of counters from the counter file, with copy
+        counters in order of last use, or an empty dictionary if the file is absent
+        or unreadable.  (Counters in a file written by an earlier software version
+        are not used, and are recovered by scanning the directory.)
+        """
+        counters = collections.OrderedDict()
+        try:
+            data = json.loads(get_entity_storage().read_file(self._counterpath))
+        except (IOError, ValueError):
+            return counters
+        if not isinstance(data, dict):
+            return counters
+        if isinstance(data.get("sequence", None), (int, long)):
+            counters[SEQUENCE_KEY] = data["sequence"]
+        for c in data.get("copies", []):
+            if isinstance(c, list) and len(c) == 2:
+                counters[c[0]] = c[1]
+        return counters
+
+    def _write(self, counters):
+        """
+        Write counter file with the sequence counter and the most recently used
+        copy counters from the supplied ordered dictionary.
+        """
+        copies = [ [k, v] for (k, v) in counters.items() if k != SEQUENCE_KEY ]
+        data   = { "copies": copies[-COPY_KEYS_MAX:] }
+        if SEQUENCE_KEY in counters:
+            data["sequence"] = counters[SEQUENCE_KEY]
+        get_entity_storage().write_file(
+            self._counterpath, json.dumps(data, separators=(',', ':'), sort_keys=True)
+            )
+        return
+
+    def allocate(self, key, id_pattern, entity_ids):
+        """
+        Allocate and return the next sequence number for identifiers with the
+        indicated prefix.
+
+        key         is the counter key: the identifier prefix used, or
+                    SEQUENCE_KEY for plain sequence numbers.
+        id_pattern  is a regular expression that matches identifiers allocated
+                    using the counter, with the sequence number as its first group.
+        entity_ids  is a function that returns an iterator over identifiers in
+                    the entity directory, used when the counter file has no entry
+                    for the indicated key.
+        """
+        storage = get_entity_storage()
+        lockdir = os.path.dirname(self._counterpath)
+        if not storage.isdir(lockdir):
+            return _max_seq(id_pattern, entity_ids()) + 1
+        with storage.lock(lockdir):
+            counters = self._read()
+            last_seq = counters.pop(key, None)
+            if not isinstance(last_seq, (int, long)):
+                last_seq = _max_seq(id_pattern, entity_ids())
+            counters[key] = last_seq + 1
+            self._write(counters)
+        return last_seq + 1
+
+def _max_seq(id_pattern, entity_ids):
+    """
+    Returns the highest sequence number among the supplied identifiers that match
+    the supplied pattern, or 0.
+
+    >>> _max_seq(re.compile(r"^(\d{8,})$"), ["00000002", "00000010", "entity1", "007"])
+    10
+    >>> _max_seq(re.compile(r"^e_(\d{2,})$"), ["e", "e_03", "e_x", "f_04"])
+    3
+    >>> _max_seq(re.compile(r"^(\d{8,})$"), [])
+    0
+    """
+    max_seq = 0
+    for i in entity_ids:
+        m = id_pattern.match(i)
+        if m:
+            max_seq = max(max_seq, int(m.group(1)))
+    return max_seq
+
+# End.
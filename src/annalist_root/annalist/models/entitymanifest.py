@@ -0,0 +1,197 @@
+"""
+Manifest of entities stored in a directory.
+
+Enumerating the entities of a type otherwise requires listing the type data
+directory and then probing each candidate for an entity body file.  A manifest
+records the identifiers of entities that have body files in a single compact file
+alongside the directory, so that enumeration needs just one directory stat and one
+file read.
+
+Only entity identifiers are recorded:  entity body files may be rewritten without
+changing the directory stat key (e.g. when an existing entity is saved), so any
+other information about an entity recorded in a manifest could become stale
+without being detected.
+
+The manifest records the stat key of the directory it describes, and is used only
+while that stat key is unchanged.  Otherwise, the directory is scanned and the
+manifest is rewritten.  Entity create, remove and rename operations update the
+manifest while holding a lock on the directory, so it remains valid as entities
+are added and removed.
+
+A manifest is not written for a directory that has been modified within the last
+few seconds, whether following a scan or an update, because a further change within
+the timestamp resolution of the underlying storage could go undetected.  (After an
+update, the manifest is removed, and rewritten by a later scan.)
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os.path
+import time
+import json
+import contextlib
+
+import logging
+log = logging.getLogger(__name__)
+
+from annalist                       import util
+from annalist.models.entitystorage  import get_entity_storage
+
+#   Directories modified less than this many seconds before being scanned are
+#   not recorded in a manifest.
+RACY_INTERVAL   = 2.0
+
+class EntityManifest(object):
+    """
+    Manifest of entities stored in a directory.
+    """
+
+    def __init__(self, dirpath, manifestpath, bodyfiles):
+        """
+        Initialize manifest object.
+
+        dirpath         is the directory containing entity subdirectories.
+        manifestpath    is the path of the manifest file.
+        bodyfiles       is a list of entity body file names, any of which indicates
+                        that an entity is present (i.e. the current body file name
+                        followed by any names used by earlier software versions).
+        """
+        self._dirpath      = dirpath
+        self._manifestpath = manifestpath
+        self._bodyfiles    = bodyfiles
+        return
+
+    def _read(self, dirstat):
+        """
+        Returns set of entity identifiers from the manifest file if it is valid for
+        the supplied directory stat key, otherwise None.
+        """
+        storage = get_entity_storage()
+        try:
+            manifest = json.loads(storage.read_file(self._manifestpath))
+        except (IOError, ValueError):
+            return None
+        if dirstat is None or _freeze(manifest.get("dir_stat")) != dirstat:
+            return None
+        entities = manifest.get("entities")
+        if not isinstance(entities, list):
+            return None         # Written by an earlier software version
+        return set(entities)
+
+    def _write(self, dirstat, entities):
+        """
+        Write manifest file with supplied directory stat key and set of entity
+        identifiers.
+        """
+        manifest = { "dir_stat": dirstat, "entities": sorted(entities) }
+        get_entity_storage().write_file(
+            self._manifestpath, json.dumps(manifest, separators=(',', ':'), sort_keys=True)
+            )
+        return
+
+    def _has_body(self, entity_id):
+        """
+        Returns True if the indicated entity has a body file.
+        """
+        storage = get_entity_storage()
+        for f in self._bodyfiles:
+            if storage.isfile(os.path.join(self._dirpath, entity_id, f)):
+                return True
+        return False
+
+    def _settled(self, dirstat):
+        """
+        Returns True if the directory stat key indicates that it was last modified
+        long enough ago that a subsequent change would be detected.
+        """
+        return dirstat[0] < time.time() - RACY_INTERVAL
+
+    def _scan(self):
+        """
+        Scan directory and return set of entity identifiers.
+        """
+        return set(
+            entity_id for entity_id in get_entity_storage().listdir(self._dirpath)
+              if util.valid_id(entity_id) and self._has_body(entity_id)
+            )
+
+    def entities(self):
+        """
+        Returns a set of identifiers of entities present in the directory.
+        """
+        storage  = get_entity_storage()
+        dirstat  = storage.stat_key(self._dirpath)
+        if dirstat is None:
+            return set()
+        entities = self._read(dirstat)
+        if entities is None:
+            entities = self._scan()
+            if self._settled(dirstat) and storage.stat_key(self._dirpath) == dirstat:
+                self._write(dirstat, entities)
+        return entities
+
+    def entity_ids(self):
+        """
+        Returns a sorted list of identifiers of entities present in the directory.
+        """
+        return sorted(self.entities())
+
+    @contextlib.contextmanager
+    def updating(self, entity_ids):
+        """
+        Context manager used when creating, updating or removing entities in the
+        directory, which updates the manifest on exit.  E.g.
+
+            with manifest.updating([entity_id]):
+                // create, update or remove entity
+            // manifest updated here
+
+        entity_ids  is a list of identifiers of entities that may be changed.
+
+        If the manifest is not valid on entry, or if the directory has been modified
+        too recently to be recorded, it is left to be rebuilt by a subsequent
+        directory scan.
+        """
+        storage = get_entity_storage()
+        if not storage.isdir(self._dirpath):
+            yield
+            return
+        with storage.lock(self._dirpath):
+            entities = self._read(storage.stat_key(self._dirpath))
+            yield
+            if entities is not None:
+                for entity_id in entity_ids:
+                    if self._has_body(entity_id):
+                        entities.add(entity_id)
+                    else:
+                        entities.discard(entity_id)
+                dirstat = storage.stat_key(self._dirpath)
+                if self._settled(dirstat):
+                    self._write(dirstat, entities)
+                else:
+                    self.remove()
+        return
+
+    def remove(self):
+        """
+        Remove manifest file.
+        """
+        storage = get_entity_storage()
+        if storage.isfile(self._manifestpath):
+            storage.remove_file(self._manifestpath)
+        return
+
+def _freeze(v):
+    """
+    Returns a hashable and comparable version of a stat key value read from JSON.
+
+    >>> _freeze([1.5, [2, None], 3]) == (1.5, (2, None), 3)
+    True
+    """
+    if isinstance(v, list):
+        return tuple(_freeze(e) for e in v)
+    return v
+
+# End.
@@ -0,0 +1,117 @@
+"""
+Process-wide cache of entity directories known not to exist.
+
+An entity that is not defined by a collection is looked for in each of the
+collection's alternative parents in turn (see `Entity._probe_alt_parentage`), and
+for each parent the current body file name and any body file names used by older
+software versions are probed.  Entities that are defined only in site data (e.g.
+built-in views and fields) are looked up very frequently, so each such lookup
+results in a cascade of failed file existence tests in every collection on the
+inheritance path.
+
+This cache records, for the directory containing entity directories of some type
+(e.g. a collection's views directory), the names of entity directories found not
+to exist, along with the stat key of the containing directory.  Creating or removing
+an entity directory changes the stat key of the containing directory, so a recorded
+absence is used only while the stat key is unchanged, and a cached miss costs a
+single `stat` of the containing directory.  Entries are also discarded after a short
+interval, and absences are not recorded for directories that have been modified very
+recently, as a further change within the timestamp resolution of the underlying
+storage could go undetected.
+
+Entries are kept in the order they are recorded:  expired entries are evicted when
+a new entry is recorded, and the oldest entries are evicted if the number of
+directories recorded would exceed a fixed limit.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os.path
+import time
+import threading
+import collections
+
+import logging
+log = logging.getLogger(__name__)
+
+from annalist.models.entitystorage  import get_entity_storage, register_fork_reset
+
+#   Seconds for which recorded absences are used
+MISSING_INTERVAL    = 10.0
+
+#   Directories modified less than this many seconds before being checked do not
+#   have absences recorded.
+RACY_INTERVAL       = 2.0
+
+#   Maximum number of containing directories for which absences are recorded
+MISSING_DIRS_MAX    = 1000
+
+_missing_lock   = threading.Lock()
+_missing        = collections.OrderedDict()
+                        # containing directory -> (time recorded, stat key, set of names)
+
+def _reset_after_fork():
+    global _missing_lock, _missing
+    _missing_lock = threading.Lock()
+    _missing      = collections.OrderedDict()
+    return
+
+register_fork_reset(_reset_after_fork)
+
+def entity_dir_missing(storage, entitydir):
+    """
+    Returns True if the indicated entity directory does not exist.
+
+    storage     is the storage object used to access the entity directory: absences
+                are recorded only when this is the current entity storage driver.
+    entitydir   is the (normalized) path of an entity directory.
+    """
+    if storage is not get_entity_storage():
+        return not storage.isdir(entitydir)
+    (dirpath, name) = os.path.split(entitydir.rstrip("/"))
+    now     = time.time()
+    dirstat = storage.stat_key(dirpath)
+    entry   = _missing.get(dirpath, None)
+    if entry and entry[1] == dirstat and entry[0] >= now - MISSING_INTERVAL:
+        if name in entry[2]:
+            return True
+    if dirstat is None:
+        return True
+    if storage.isdir(entitydir):
+        return False
+    if dirstat[0] < now - RACY_INTERVAL:
+        with _missing_lock:
+            entry = _missing.get(dirpath, None)
+            if not (entry and entry[1] == dirstat and entry[0] >= now - MISSING_INTERVAL):
+                entry = (now, dirstat, set())
+                _record_missing(dirpath, entry, now)
+            entry[2].add(name)
+    return True
+
+def _record_missing(dirpath, entry, now):
+    """
+    Record a new entry for the indicated directory, evicting expired entries and,
+    if needed, the oldest entries to keep within the limit.
+
+    Must be called with `_missing_lock` held.
+    """
+    _missing.pop(dirpath, None)
+    while _missing:
+        d = next(iter(_missing))
+        if _missing[d][0] >= now - MISSING_INTERVAL and len(_missing) < MISSING_DIRS_MAX:
+            break
+        del _missing[d]
+    _missing[dirpath] = entry
+    return
+
+def discard_missing():
+    """
+    Discard all recorded absences.
+    """
+    with _missing_lock:
+        _missing.clear()
+    return
+
+# End.
@@ -16,9 +16,9 @@ __license__     = "MIT (http://opensource.org/licenses/MIT)"
 import os
 import os.path
 import urlparse
-import shutil
 import json
 import errno
+import contextlib
 
 import logging
 log = logging.getLogger(__name__)
@@ -29,9 +29,25 @@ from annalist               import layout
 from annalist               import util
 from annalist.exceptions    import Annalist_Error
 from annalist.identifiers   import ANNAL, RDF, RDFS
+from annalist.models.entitystorage  import get_entity_storage
+from annalist.models.entitycache    import get_entity_cache
+from annalist.models.sitesnapshot   import get_site_snapshot, snapshot_storage, site_data_changed
+from annalist.models.entitytombstone import remove_tree_tombstone
 from annalist.resourcetypes import file_extension, file_extension_for_content_type
 from annalist.util          import make_type_entity_id, make_entity_base_url
 
+#   Entity data format migration version.  This is saved with each entity body (as
+#   `annal:migration_version`) to record that the entity data format migrations 
+#   (see `EntityRoot._migrate_values` and its overrides) have been applied, so that 
+#   they are not applied again when the entity is loaded.
+#
+#   This value MUST be changed whenever an entity data format migration is added or 
+#   changed: it is independent of the software and data compatibility versions.  A
+#   digest of the migration methods is recorded for each version by the entity tests
+#   (see `MIGRATION_DIGESTS` in `annalist.tests.test_entity`), which fail if any
+#   migration is changed without recording a new version.
+ENTITY_MIGRATION_VERSION = "1"
+
 #   -------------------------------------------------------------------------------------------
 #
 #   EntityRoot
@@ -228,8 +244,9 @@ class EntityRoot(object):
             body_dir = self._entitydir
             log.debug("EntityRoot.resource_file: dir %s, resource_ref %s"%(body_dir, resource_ref))
             file_name = os.path.join(body_dir, resource_ref)
-            if os.path.isfile(file_name):
-                return open(file_name, "rb")
+            storage   = get_entity_storage()
+            if storage.isfile(file_name):
+                return storage.open(file_name, "rb")
         return None
 
     def get_field(self, path):
@@ -261,6 +278,19 @@ class EntityRoot(object):
                 yield i
         return
 
+    @contextlib.contextmanager
+    def _updating_children(self, cls, entityids):
+        """
+        Context manager used when creating, updating or removing child entities.
+        Subclasses may override this to maintain information about their children
+        (e.g. see `RecordTypeData`).  This default implementation does nothing.
+
+        cls         is a subclass of Entity indicating the type of children updated.
+        entityids   is a list of identifiers of children that may be updated.
+        """
+        yield
+        return
+
     # I/O helper functions
 
     def _dir_path(self):
@@ -287,13 +317,14 @@ class EntityRoot(object):
         returns path of of object body, or None
         """
         (d, p, u) = self._dir_path_uri()
+        storage   = snapshot_storage(d)
         # log.debug("EntityRoot._exists_path %s"%(p))
-        if d and os.path.isdir(d):
-            if p and os.path.isfile(p):
+        if d and storage.isdir(d):
+            if p and storage.isfile(p):
                 # log.debug("EntityRoot._exists_path %s: OK"%(p))
                 return p
             mp = self._migrate_path()
-            if mp and os.path.isfile(mp):
+            if mp and storage.isfile(mp):
                 assert mp == p, "EntityRoot._exists_path: Migrated filename %s, expected %s"%(mp, p)
                 # log.info("EntityRoot._exists_path %s: Migrated from %s"%(mp, p))
                 return mp
@@ -351,7 +382,8 @@ class EntityRoot(object):
                 fullpath
                 )
         # Create directory (if needed) and save data
-        util.ensure_dir(body_dir)
+        storage = get_entity_storage()
+        storage.makedirs(body_dir)
         values = self._values.copy()
         values['@id']      = self._entityref
         values['@type']    = self._get_types(values.get('@type', None))
@@ -365,8 +397,15 @@ class EntityRoot(object):
         if self._entityid:
             values[ANNAL.CURIE.id] = self._entityid
         values.pop(ANNAL.CURIE.url, None)
-        with open(fullpath, "wt") as entity_io:
-            json.dump(values, entity_io, indent=2, separators=(',', ': '), sort_keys=True)
+        # Saved values are migrated to the current format and stamped, so that no
+        # migrations are needed when they are loaded
+        values = self._migrate_values(values)
+        values[ANNAL.CURIE.migration_version] = ENTITY_MIGRATION_VERSION
+        storage.write_file(
+            fullpath, json.dumps(values, indent=2, separators=(',', ': '), sort_keys=True)
+            )
+        get_entity_cache().invalidate(fullpath)
+        site_data_changed(fullpath)
         self._post_update_processing(values, post_update_flags)
         return
 
@@ -378,11 +417,16 @@ class EntityRoot(object):
         d = self._entitydir
         # Extra check to guard against accidentally deleting wrong thing
         if type_uri in self._values['@type'] and d.startswith(self._entitybasedir):
-            shutil.rmtree(d)
+            remove_tree_tombstone(d)
+            get_entity_cache().invalidate_dir(d)
+            site_data_changed(d)
         else:
-            log.error("Expected type_uri: %r, got %r"%(type_uri, e[ANNAL.CURIE.type]))
-            log.error("Expected dirbase:  %r, got %r"%(parent._entitydir, d))
-            raise Annalist_Error("Entity %s unexpected type %s or path %s"%(entityid, e[ANNAL.CURIE.type_id], d))
+            log.error("Expected type_uri: %r, got %r"%(type_uri, self._values['@type']))
+            log.error("Expected dirbase:  %r, got %r"%(self._entitybasedir, d))
+            raise Annalist_Error(
+                "Entity %s unexpected type %s or path %s"%
+                (self._entityid, self._values.get(ANNAL.CURIE.type_id), d)
+                )
         return
 
     def _load_values(self):
@@ -396,9 +440,13 @@ class EntityRoot(object):
         if body_file:
             # log.debug("EntityRoot._load_values body_file %r"%(body_file,))
             try:
-                # @@TODO: rework name access to support different underlays
-                with self._read_stream() as f:
-                    entitydata = json.load(util.strip_comments(f))
+                snapshot   = get_site_snapshot(body_file)
+                entitydata = snapshot and snapshot.get_values(body_file)
+                if entitydata is None:
+                    entitydata = get_entity_cache().get_values(
+                        type(self), body_file, self._read_values
+                        )
+                if entitydata is not None:
                     # log.debug("EntityRoot._load_values: url_path %s"%(self.get_view_url_path()))
                     entitydata[ANNAL.CURIE.url] = self.get_view_url_path()
                     return entitydata
@@ -415,6 +463,20 @@ class EntityRoot(object):
                     })
         return None
 
+    def _read_values(self):
+        """
+        Read and parse entity body from Annalist storage.
+
+        Returns a pair (size, values), where 'size' is the size of the stored body 
+        data, or None if the entity body is not present.
+        """
+        f = self._read_stream()
+        if f is None:
+            return None
+        with f:
+            body = f.read()
+        return (len(body), util.json_loads_body(body))
+
     def _ensure_values_loaded(self):
         """
         If values are not loaded and present for the current entity, read and store them.
@@ -424,7 +486,7 @@ class EntityRoot(object):
         if self._values is None:
             vals = self._load_values()
             if vals:
-                vals = self._migrate_values(vals)
+                vals = self._migrated_values(vals)
                 self.set_values(vals)
         return self._values
 
@@ -438,18 +500,20 @@ class EntityRoot(object):
         if self._migrate_filenames() is None:
             # log.debug("EntityRoot._migrate_path (skip)")
             return
+        storage = get_entity_storage()
         for old_data_filename in self._migrate_filenames():
             # This logic migrates data from previous filenames
             (basedir, old_data_filepath) = util.entity_dir_path(self._entitydir, [], old_data_filename)
-            if basedir and os.path.isdir(basedir):
-                if old_data_filepath and os.path.isfile(old_data_filepath):
+            if basedir and storage.isdir(basedir):
+                if old_data_filepath and storage.isfile(old_data_filepath):
                     # Old body file found here
                     (d, new_data_filepath) = self._dir_path()
                     log.info(
                         "EntityRoot._migrate_path: Migrate file %s to %s"%
                         (old_data_filepath, new_data_filepath)
                         )
-                    os.rename(old_data_filepath, new_data_filepath)
+                    storage.rename(old_data_filepath, new_data_filepath)
+                    get_entity_cache().invalidate(new_data_filepath)
                     return new_data_filepath
         # log.debug("EntityRoot._migrate_path (not found)")
         return None
@@ -484,7 +548,24 @@ class EntityRoot(object):
         to conform to the current format of the data.  The migration function should 
         be idempotent; i.e.
             x._migrate_values(x._migrate_values(e)) == x._migrate_values(e)
+
+        When a migration is added or changed, ENTITY_MIGRATION_VERSION must also be
+        changed so that entity data saved by earlier software is migrated (this is
+        checked by the entity tests).
+        """
+        return entitydata
+
+    def _migrated_values(self, entitydata):
+        """
+        Returns loaded entity data with format migrations applied.
+
+        Entity data saved by the current software version is stamped with the entity
+        migration version (see `_save`), and migrations are not applied again.  The
+        stamp is removed from the returned entity data.
         """
+        migration_version = entitydata.pop(ANNAL.CURIE.migration_version, None)
+        if migration_version != ENTITY_MIGRATION_VERSION:
+            entitydata = self._migrate_values(entitydata)
         return entitydata
 
     def _migrate_values_map_field_names(self, migration_map, entitydata):
@@ -527,9 +608,7 @@ class EntityRoot(object):
         parent_dir = os.path.dirname(os.path.join(self._entitydir, cls._entitypath or ""))
         assert "%" not in parent_dir, "_entitypath template variable interpolation may be in filename part only"
         # log.info("@@ EntityRoot._base_children: parent %s, parent_dir %s"%(self.get_id(),parent_dir))
-        child_files = []
-        if os.path.isdir(parent_dir):
-            child_files = os.listdir(parent_dir)
+        child_files = snapshot_storage(parent_dir).listdir(parent_dir)
         for fil in child_files:
             if util.valid_id(fil):
                 yield fil
@@ -553,23 +632,17 @@ class EntityRoot(object):
         return iter(())     # Empty iterator
 
     def _entity_files(self):
-        #@@TODO: abstract logic to work with non-file storage
-        #        Used by 'entitytypeinfo'
         """
         Iterates over files/resources (not subdirectories) that are part of the current entity.
 
         Returns pairs (p,f), where 'p' is a full path name, and 'f' is a filename within the 
         current entity directory. 
         """
-        for f in os.listdir(self._entitydir):
-            p = os.path.join(self._entitydir, f)
-            if os.path.isfile(p):
-                yield (p, f)
+        for f in get_entity_storage().listfiles(self._entitydir):
+            yield (os.path.join(self._entitydir, f), f)
         return
 
     def _copy_entity_files(self, src_entity):
-        #@@TODO: abstract logic to work with non-file storage
-        #        Used by 'entityedit', 'am_managecollections'
         """
         Copy metadata abnd attached resources from the supplied `src_entity` 
         to the current entity.
@@ -592,57 +665,49 @@ class EntityRoot(object):
                         "EntityRoot._copy_entity_files: error copying file %(file)s from %(src_id)s to %(id)s"%
                         msg_vals
                         )
-                    msgs.APPEND(message.ENTITY_COPY_FILE_ERROR%msg_vals)
+                    msgs.append(message.ENTITY_COPY_FILE_ERROR%msg_vals)
         return msgs
 
     def _unused_entity_files_dirs(self):
-        #@@TODO: abstract logic to work with non-file storage
         """
         Iterates over files/resources that are part of the current entity.
 
         Returns pairs (p,f), where 'p' is a full path name, and 'f' is a filename within the 
         current entity directory. 
         """
-        for f in os.listdir(self._entitydir):
+        storage = get_entity_storage()
+        for f in storage.listdir(self._entitydir):
             p = os.path.join(self._entitydir, f)
-            if os.path.exists(p):
+            if storage.exists(p):
                 yield (p, f)
         return
 
     def _exists_file(self, f):
-        #@@TODO: abstract logic to work with non-file storage
-        #        Used by 'entitytypeinfo'
         """
         Test if a file named 'f' exists in the current entity directory
         """
-        return os.path.isfile(os.path.join(self._entitydir, f))
+        return get_entity_storage().isfile(os.path.join(self._entitydir, f))
 
     def _copy_file(self, p, f):
-        #@@TODO: abstract logic to work with non-file storage
-        #        Used by 'entitytypeinfo'
         """
         Copy file with path 'p' to a new file 'f' in the current entity directory
         """
         new_p = os.path.join(self._entitydir, f)
         try:
-            shutil.copy(p, new_p)
-        except shutil.Error as e:
-            log.error('shutil.copy error: %s' % e)
-            return None
+            get_entity_storage().copy_file(p, new_p)
         except IOError as e:
-            log.error('shutil.copy IOError: %s' % e.strerror)
+            log.error('EntityRoot._copy_file IOError: %s' % e.strerror)
             return None
         return new_p
 
     def _rename_files(self, old_entity):
-        #@@TODO: abstract logic to work with non-file storage
-        #        Used by 'entitytypeinfo'
         """
         Rename old entity files to path of current entity (which must not exist),
         and return path to resulting entity, otherwise None.
         """
-        new_p = None
-        if os.path.exists(self._entitydir):
+        new_p   = None
+        storage = get_entity_storage()
+        if storage.exists(self._entitydir):
             log.error("EntityRoot._rename_files: destination %s already exists"%(self._entitydir,))
         elif not self._entitydir.startswith(self._entitybasedir):
             log.error(
@@ -656,16 +721,17 @@ class EntityRoot(object):
                 )
         else:
             try:
-                os.rename(old_entity._entitydir, self._entitydir)
+                storage.rename(old_entity._entitydir, self._entitydir)
+                get_entity_cache().invalidate_dir(old_entity._entitydir)
+                get_entity_cache().invalidate_dir(self._entitydir)
+                site_data_changed(old_entity._entitydir)
+                site_data_changed(self._entitydir)
                 new_p = self._entitydir
-            except IOError as e:
-                log.error("EntityRoot._rename_files: os.rename IOError: %s" % e.strerror)
+            except (IOError, OSError) as e:
+                log.error("EntityRoot._rename_files: rename error: %s" % e.strerror)
         return new_p
 
     def _fileobj(self, localname, filetypeuri, mimetype, mode):
-        #@@TODO: abstract logic to work with non-file storage
-        #        Used by 'entity', 'entitytypeinfo', 'site', 'entityedit', 'util',
-        #                'test_import_resource', 'test_render_ref_multifields', 'test_upload_file'
         """
         Returns a file object for accessing a blob associated with the current entity.
 
@@ -684,11 +750,9 @@ class EntityRoot(object):
             file_extension(filetypeuri)
             )
         file_name = os.path.join(body_dir, localname+"."+file_ext)
-        return open(file_name, mode)
+        return get_entity_storage().open(file_name, mode)
 
     def _metaobj(self, localpath, localname, mode):
-        #@@TODO: abstract logic to work with non-file storage
-        #        Used by 'collection', 'site'
         """
         Returns a file object for accessing a metadata resource associated with 
         the current entity.
@@ -701,13 +765,14 @@ class EntityRoot(object):
                     as the built-in `open` function).
         """
         (body_dir, body_file) = self._dir_path()  # Same as `_save`
+        storage   = get_entity_storage()
         local_dir = os.path.join(body_dir, localpath)
-        util.ensure_dir(local_dir)
-        filename = os.path.join(local_dir, localname)
+        storage.makedirs(local_dir)
+        filename  = os.path.join(local_dir, localname)
         # log.debug("entityroot._metaobj: self._entitydir %s"%(self._entitydir,))
         # log.debug("entityroot._metaobj: body_dir %s, body_file %s"%(body_dir, body_file))
         # log.debug("entityroot._metaobj: filename %s"%(filename,))
-        return open(filename, mode)
+        return storage.open(filename, mode)
 
     def _read_stream(self):
         """
@@ -721,12 +786,11 @@ class EntityRoot(object):
             // f is closed here
 
         """
-        # @@TODO: factor out logic in common with _metaobj/_fileobj
         f_stream  = None
         body_file = self._exists_path()
         if body_file:
             try:
-                f_stream = open(body_file, "rt")
+                f_stream = get_entity_storage().open(body_file, "rt")
             except IOError, e:
                 if e.errno != errno.ENOENT:
                     raise
@@ -0,0 +1,912 @@
+"""
+Storage drivers for Annalist entities.
+
+Entity classes (see `annalist.models.entityroot`) access stored entity bodies and
+attached resources through a storage driver rather than calling file system
+functions directly.  Paths presented to a driver follow the directory layout
+described in `annalist.layout`, so all drivers share a common naming scheme and
+the choice of driver is invisible to the rest of Annalist.
+
+Two drivers are provided:
+
+FileEntityStorage       stores entities as files in a directory tree.  This is
+                        the default driver.
+
+SqliteEntityStorage     stores entity bodies and attached resources in a single
+                        indexed SQLite database file in the site base directory.
+                        Existing files (e.g. installed site data) are used as an
+                        underlay for anything that is not in the database, so a
+                        site can be switched to this driver without conversion.
+
+The driver is selected by the ANNALIST_ENTITY_STORAGE setting ("file" or "sqlite").
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os
+import os.path
+import sys
+import io
+import time
+import errno
+import shutil
+import sqlite3
+import weakref
+import threading
+import contextlib
+import collections
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None        # Non-posix system: locking is within the current process only
+
+import logging
+log = logging.getLogger(__name__)
+
+from django.conf import settings
+
+from annalist               import layout
+from annalist               import util
+
+#   -------------------------------------------------------------------------------------------
+#
+#   Lock helper
+#
+#   -------------------------------------------------------------------------------------------
+
+_path_locks_lock = threading.Lock()
+_path_locks      = weakref.WeakValueDictionary()
+
+def _path_lock(path):
+    """
+    Returns a re-entrant lock object used to serialize access to the indicated path by
+    threads in the current process.  (File locks are held by open file descriptions,
+    so a thread that already holds a file lock must not request it again.)
+
+    Lock objects are kept only while referenced by their users, so that a lock is not
+    retained for every path ever locked.  A lock is not shared between paths, as 
+    a thread holding the lock for one path would not then request a file lock for
+    another.
+    """
+    path = os.path.normpath(path)
+    with _path_locks_lock:
+        lock = _path_locks.get(path)
+        if lock is None:
+            lock = _PathLock()
+            _path_locks[path] = lock
+        return lock
+
+class _PathLock(object):
+    """
+    Re-entrant lock for which only the outermost acquisition is reported, so that
+    a corresponding file lock is requested just once by the owning thread.
+    """
+
+    def __init__(self):
+        self._lock  = threading.RLock()
+        self._depth = 0
+        return
+
+    @contextlib.contextmanager
+    def hold(self):
+        """
+        Context manager that acquires the lock, and returns True if this is the
+        outermost acquisition by the current thread.
+        """
+        with self._lock:
+            self._depth += 1
+            try:
+                yield (self._depth == 1)
+            finally:
+                self._depth -= 1
+        return
+
+#   -------------------------------------------------------------------------------------------
+#
+#   Batched updates
+#
+#   -------------------------------------------------------------------------------------------
+
+_batch_local = threading.local()
+
+class StorageBatch(object):
+    """
+    Records deferred work for a batch of updates:  directories whose entries are
+    to be synchronized to storage, and post-update actions to be performed once
+    when the batch is completed.
+    """
+
+    def __init__(self):
+        self._sync_dirs  = set()
+        self._actions    = collections.OrderedDict()
+        return
+
+    def add_sync_dir(self, dirpath):
+        """
+        Note a directory whose entries are to be synchronized to storage.
+        """
+        self._sync_dirs.add(dirpath)
+        return
+
+    def defer(self, key, action):
+        """
+        Defer an action to be performed when the batch is completed.  If several
+        actions are deferred with the same key, only the last of them is performed.
+
+        key         is a value that identifies the deferred action (e.g. a tuple
+                    containing the action name and the path of affected data).
+        action      is a function, called with no arguments, to perform the action.
+        """
+        self._actions.pop(key, None)
+        self._actions[key] = action
+        return
+
+    def flush(self):
+        """
+        Synchronize updated directory entries to storage, then perform deferred
+        actions.  (Actions are performed outside the batch, so any further updates
+        they make are synchronized individually.)
+
+        Every deferred action is performed even if an earlier action fails:  the
+        first exception raised by an action is then re-raised.
+        """
+        for dirpath in sorted(self._sync_dirs):
+            _fsync_dir(dirpath)
+        self._sync_dirs.clear()
+        exc_info = None
+        while self._actions:
+            (_, action) = self._actions.popitem(last=False)
+            try:
+                action()
+            except Exception:
+                log.exception("StorageBatch.flush: deferred action failed")
+                exc_info = exc_info or sys.exc_info()
+        if exc_info:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return
+
+def current_batch():
+    """
+    Returns the batch of updates active for the current thread, or None.
+    """
+    return getattr(_batch_local, "batch", None)
+
+@contextlib.contextmanager
+def batch_updates():
+    """
+    Context manager for a batch of updates performed by the current thread.
+    Updates are written as they are made, but synchronization to storage and
+    post-update processing are deferred until the batch is completed.  A nested
+    batch is merged with the batch that contains it.  E.g.
+
+        with batch_updates():
+            // save entities
+        // data is synchronized and post-update actions performed here
+
+    The batch is completed even if an exception is raised within it, so that
+    post-update actions (e.g. updating collection generation stamps) are performed
+    for any updates already made.  In that case, an exception raised when completing
+    the batch is logged, and the original exception is propagated.
+    """
+    batch = current_batch()
+    if batch:
+        yield batch
+        return
+    batch = StorageBatch()
+    _batch_local.batch = batch
+    completed = False
+    try:
+        yield batch
+        completed = True
+    finally:
+        _batch_local.batch = None
+        if completed:
+            batch.flush()
+        else:
+            try:
+                batch.flush()
+            except Exception:
+                log.exception("batch_updates: error completing interrupted batch")
+    return
+
+def temp_file_name(name):
+    """
+    Returns the name of a temporary file used to write the named file, which is
+    distinct for each process and thread.
+
+    >>> temp_file_name("entity_data.jsonld").startswith(".entity_data.jsonld.")
+    True
+    >>> is_temp_file_name(temp_file_name("entity_data.jsonld"))
+    True
+    """
+    return ".%s.%d.%d.tmp"%(name, os.getpid(), threading.current_thread().ident)
+
+def is_temp_file_name(name):
+    """
+    Returns True if the supplied name is that of a temporary file used to write
+    another file (see `temp_file_name`).
+
+    >>> is_temp_file_name(".entity_data.jsonld.123.456.tmp")
+    True
+    >>> is_temp_file_name("entity_data.jsonld")
+    False
+    >>> is_temp_file_name(".upload.tmp")
+    False
+    """
+    if not (name.startswith(".") and name.endswith(".tmp")):
+        return False
+    parts = name[1:-4].rsplit(".", 2)
+    return len(parts) == 3 and parts[1].isdigit() and parts[2].isdigit()
+
+def _fsync_dir(dirpath):
+    """
+    Synchronize directory entries to storage (where supported).
+    """
+    try:
+        fd = os.open(dirpath, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass            # Directory fsync is not supported on all platforms
+    finally:
+        os.close(fd)
+    return
+
+#   Linux ioctl request code for creating a copy-on-write clone of a file
+FICLONE = 0x40049409
+
+def _reflink_file(src, dst):
+    """
+    Create file `dst` as a copy-on-write clone of file `src`, where supported by
+    the platform and file system.  Returns True if the clone is created.
+    """
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+    try:
+        with open(src, "rb") as fsrc:
+            with open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except (IOError, OSError):
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+    return True
+
+def _unshare_file(path, keep_data=True):
+    """
+    If the indicated file has more than one link, replace it with a copy (or, if
+    `keep_data` is False, remove it) so that it can be updated without affecting
+    the other links.
+    """
+    try:
+        if os.stat(path).st_nlink <= 1:
+            return
+    except OSError:
+        return      # No such file
+    if not keep_data:
+        os.remove(path)
+        return
+    tmppath = path+".%d.unshare.tmp"%(os.getpid(),)
+    shutil.copy2(path, tmppath)
+    os.rename(tmppath, path)
+    return
+
+#   -------------------------------------------------------------------------------------------
+#
+#   FileEntityStorage
+#
+#   -------------------------------------------------------------------------------------------
+
+class FileEntityStorage(object):
+    """
+    Entity storage driver that uses the file system directly.
+    """
+
+    def isdir(self, path):
+        """
+        Returns True if the indicated path is an existing directory.
+        """
+        return os.path.isdir(path)
+
+    def isfile(self, path):
+        """
+        Returns True if the indicated path is an existing file.
+        """
+        return os.path.isfile(path)
+
+    def exists(self, path):
+        """
+        Returns True if the indicated path is an existing file or directory.
+        """
+        return os.path.exists(path)
+
+    def stat_key(self, path):
+        """
+        Returns a value that changes whenever the indicated file or directory is
+        updated (used to validate cached data), or None if there is no such file.
+        The first element of the value returned is a modification time.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    def listdir(self, path):
+        """
+        Returns a list of names contained in the indicated directory, or an empty
+        list if there is no such directory.
+        """
+        if os.path.isdir(path):
+            return os.listdir(path)
+        return []
+
+    def listfiles(self, path):
+        """
+        Returns a list of names of files (not subdirectories) contained in the
+        indicated directory.  Temporary files used by `write_file` are not included.
+        """
+        return (
+            [ f for f in self.listdir(path)
+                if not is_temp_file_name(f) and os.path.isfile(os.path.join(path, f))
+            ])
+
+    def makedirs(self, path):
+        """
+        Ensure the indicated directory exists, creating it and any missing parents.
+        """
+        util.ensure_dir(path)
+        return
+
+    def open(self, path, mode):
+        """
+        Returns a file object for the indicated path, opened with the supplied mode
+        (as for the built-in `open` function).
+
+        A file opened for updating is first separated from any other links to the
+        same file (see `link_file`), so that the other links are not affected.
+        """
+        if "r" not in mode or "+" in mode:
+            _unshare_file(path, keep_data=("w" not in mode))
+        return open(path, mode)
+
+    def read_file(self, path):
+        """
+        Returns the content of the indicated file as a byte string.
+        """
+        with open(path, "rb") as f:
+            return f.read()
+
+    def write_file(self, path, data):
+        """
+        Write the supplied byte string data to the indicated file, replacing
+        any existing content.  The containing directory is created if needed.
+
+        The data is written to a temporary file which is then renamed, so the
+        indicated file always contains either its previous or its new content.
+        If enabled by the ANNALIST_SYNC_WRITES setting (default off), the data is
+        synchronized to storage before the file is renamed, and the directory entry
+        is synchronized after:  within a batch of updates (see `batch_updates`), 
+        synchronizing the directory entry is deferred until the batch is completed.
+        """
+        dirpath = os.path.dirname(path)
+        util.ensure_dir(dirpath)
+        sync    = getattr(settings, "ANNALIST_SYNC_WRITES", False)
+        batch   = current_batch()
+        tmppath = os.path.join(dirpath, temp_file_name(os.path.basename(path)))
+        try:
+            with open(tmppath, "wb") as f:
+                f.write(data)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.rename(tmppath, path)
+        except:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            raise
+        if sync:
+            if batch:
+                batch.add_sync_dir(dirpath)
+            else:
+                _fsync_dir(dirpath)
+        return
+
+    def remove_file(self, path):
+        """
+        Remove the indicated file.
+        """
+        os.remove(path)
+        return
+
+    def remove_tree(self, path):
+        """
+        Remove the indicated directory and everything it contains.
+        """
+        shutil.rmtree(path)
+        return
+
+    def rename(self, src, dst):
+        """
+        Rename the indicated file or directory.
+        """
+        os.rename(src, dst)
+        return
+
+    def copy_file(self, src, dst):
+        """
+        Copy the file at path `src` to a new file at `dst`.
+        """
+        _unshare_file(dst, keep_data=False)
+        shutil.copy(src, dst)
+        return
+
+    def link_file(self, src, dst):
+        """
+        Create a new file at `dst` with the same content as the file at `src`,
+        sharing the stored data where possible.  A copy-on-write clone (reflink)
+        is tried first, then a hard link, and finally the file data is copied.
+
+        Returns "reflink", "hardlink" or "copy" to indicate how the file was created.
+        """
+        util.ensure_dir(os.path.dirname(dst))
+        if _reflink_file(src, dst):
+            return "reflink"
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+        shutil.copy(src, dst)
+        return "copy"
+
+    def getsize(self, path):
+        """
+        Returns the size in bytes of the indicated file.
+        """
+        return os.path.getsize(path)
+
+    @contextlib.contextmanager
+    def lock(self, path):
+        """
+        Context manager that holds an exclusive lock associated with the indicated
+        existing file or directory, for coordinating updates between threads and
+        processes.  E.g.
+
+            with storage.lock(dirpath):
+                // update data in dirpath
+            // lock released here
+        """
+        with _path_lock(path).hold() as outermost:
+            if not outermost:
+                yield
+                return
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)    # Releases flock
+        return
+
+#   -------------------------------------------------------------------------------------------
+#
+#   SqliteEntityStorage
+#
+#   -------------------------------------------------------------------------------------------
+
+class SqliteEntityStorage(object):
+    """
+    Entity storage driver that keeps entity bodies and attached resources in
+    an SQLite database.
+
+    Each file and directory under the storage base directory is a row in a single
+    table, keyed by its normalized path and indexed by its containing directory,
+    so enumerating the children of a directory is a single indexed query.  Paths
+    outside the base directory, and anything not found in the database, are handled
+    by an underlying FileEntityStorage.
+    """
+
+    _schema = (
+        """CREATE TABLE IF NOT EXISTS entity_nodes"""+
+        """ ( path   TEXT PRIMARY KEY"""+
+        """ , parent TEXT NOT NULL"""+
+        """ , name   TEXT NOT NULL"""+
+        """ , isdir  INTEGER NOT NULL"""+
+        """ , data   BLOB"""+
+        """ , mtime  REAL NOT NULL"""+
+        """ )""",
+        """CREATE INDEX IF NOT EXISTS entity_nodes_parent ON entity_nodes (parent)"""
+        )
+
+    def __init__(self, basedir, dbpath):
+        """
+        Initialize SQLite storage driver.
+
+        basedir     is the directory below which all storage is handled using the database.
+        dbpath      is the SQLite database file name.
+        """
+        self._basedir  = os.path.normpath(basedir)
+        self._dbpath   = dbpath
+        self._underlay = FileEntityStorage()
+        self._local    = threading.local()
+        util.ensure_dir(os.path.dirname(dbpath))
+        with self._conn() as conn:
+            for stmt in self._schema:
+                conn.execute(stmt)
+        return
+
+    def _conn(self):
+        """
+        Return database connection for the current thread.
+        (SQLite connection objects cannot be shared between threads.)
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._dbpath, timeout=30)
+            conn.text_factory = str
+            self._local.conn  = conn
+        return conn
+
+    def _key(self, path):
+        """
+        Returns a database key for the supplied path, or None if the path is
+        not handled by the database.
+        """
+        p = os.path.normpath(path)
+        if p == self._basedir or p.startswith(self._basedir+os.sep):
+            return p
+        return None
+
+    def _node(self, key):
+        """
+        Returns (isdir, data) for the database entry with the supplied key, or None.
+        """
+        return self._conn().execute(
+            "SELECT isdir, data FROM entity_nodes WHERE path = ?", (key,)
+            ).fetchone()
+
+    def _touch(self, conn, key):
+        """
+        Update the modification time of the indicated directory entry (if present),
+        so that changes to a directory's content are reflected in its stat key.
+        """
+        conn.execute("UPDATE entity_nodes SET mtime = ? WHERE path = ?", (time.time(), key))
+        return
+
+    def _put_dirs(self, conn, key):
+        """
+        Ensure that directory entries exist for the supplied key and its parents,
+        stopping at the storage base directory.
+        """
+        now = time.time()
+        while key != self._basedir:
+            parent = os.path.dirname(key)
+            cur    = conn.execute(
+                "INSERT OR IGNORE INTO entity_nodes (path, parent, name, isdir, data, mtime) "+
+                "VALUES (?, ?, ?, 1, NULL, ?)",
+                (key, parent, os.path.basename(key), now)
+                )
+            if cur.rowcount == 0:
+                break
+            self._touch(conn, parent)
+            key = parent
+        return
+
+    def _put_file(self, key, data):
+        """
+        Store data for the file with the supplied key, creating containing directory
+        entries as needed.
+        """
+        parent = os.path.dirname(key)
+        with self._conn() as conn:
+            self._put_dirs(conn, parent)
+            if not self._node(key):
+                self._touch(conn, parent)
+            conn.execute(
+                "INSERT OR REPLACE INTO entity_nodes (path, parent, name, isdir, data, mtime) "+
+                "VALUES (?, ?, ?, 0, ?, ?)",
+                (key, parent, os.path.basename(key), sqlite3.Binary(data), time.time())
+                )
+        return
+
+    def isdir(self, path):
+        key  = self._key(path)
+        node = key and self._node(key)
+        if node:
+            return bool(node[0])
+        return (key == self._basedir) or self._underlay.isdir(path)
+
+    def isfile(self, path):
+        key  = self._key(path)
+        node = key and self._node(key)
+        if node:
+            return not node[0]
+        return self._underlay.isfile(path)
+
+    def exists(self, path):
+        return self.isdir(path) or self.isfile(path)
+
+    def stat_key(self, path):
+        """
+        Returns a value that changes whenever the indicated file or directory is
+        updated, or None if there is no such file.  The first element of the value
+        returned is a modification time.
+
+        A directory may have entries both in the database and in the underlay,
+        so the stat key combines both.
+        """
+        key = self._key(path)
+        row = key and self._conn().execute(
+            "SELECT mtime, length(data), isdir FROM entity_nodes WHERE path = ?", (key,)
+            ).fetchone()
+        fst = self._underlay.stat_key(path)
+        if row:
+            if fst and row[2]:
+                return (max(row[0], fst[0]), tuple(row), fst)
+            return tuple(row)
+        return fst
+
+    def listdir(self, path):
+        names = self._underlay.listdir(path)
+        key   = self._key(path)
+        if key:
+            rows  = self._conn().execute(
+                "SELECT name FROM entity_nodes WHERE parent = ?", (key,)
+                ).fetchall()
+            names = names + [ r[0] for r in rows if r[0] not in names ]
+        return names
+
+    def listfiles(self, path):
+        names = self._underlay.listfiles(path)
+        key   = self._key(path)
+        if key:
+            rows  = self._conn().execute(
+                "SELECT name FROM entity_nodes WHERE parent = ? AND isdir = 0", (key,)
+                ).fetchall()
+            names = names + [ r[0] for r in rows if r[0] not in names ]
+        return names
+
+    def makedirs(self, path):
+        key = self._key(path)
+        if key is None:
+            return self._underlay.makedirs(path)
+        with self._conn() as conn:
+            self._put_dirs(conn, key)
+        return
+
+    def open(self, path, mode):
+        key = self._key(path)
+        if key is None:
+            return self._underlay.open(path, mode)
+        if "r" in mode:
+            node = self._node(key)
+            if node is None:
+                return self._underlay.open(path, mode)
+            if node[0]:
+                raise IOError(errno.EISDIR, "Is a directory", path)
+            return SqliteReadStream(path, str(node[1]))
+        return SqliteWriteStream(self, key, path)
+
+    def read_file(self, path):
+        key  = self._key(path)
+        node = key and self._node(key)
+        if node and not node[0]:
+            return str(node[1])
+        return self._underlay.read_file(path)
+
+    def write_file(self, path, data):
+        key = self._key(path)
+        if key is None:
+            return self._underlay.write_file(path, data)
+        self._put_file(key, data)
+        return
+
+    def remove_file(self, path):
+        key = self._key(path)
+        if key:
+            with self._conn() as conn:
+                conn.execute("DELETE FROM entity_nodes WHERE path = ?", (key,))
+                self._touch(conn, os.path.dirname(key))
+        if self._underlay.isfile(path):
+            self._underlay.remove_file(path)
+        return
+
+    def remove_tree(self, path):
+        key = self._key(path)
+        if key:
+            with self._conn() as conn:
+                conn.execute(
+                    "DELETE FROM entity_nodes WHERE path = ? OR (path > ? AND path < ?)",
+                    (key,) + _subtree_range(key)
+                    )
+                self._touch(conn, os.path.dirname(key))
+        if self._underlay.exists(path):
+            self._underlay.remove_tree(path)
+        return
+
+    def rename(self, src, dst):
+        srckey = self._key(src)
+        dstkey = self._key(dst)
+        if srckey and dstkey and self._node(srckey):
+            with self._conn() as conn:
+                self._put_dirs(conn, os.path.dirname(dstkey))
+                conn.execute(
+                    "UPDATE entity_nodes SET path = ? || substr(path, length(?)+1) "+
+                    "WHERE path = ? OR (path > ? AND path < ?)",
+                    (dstkey, srckey, srckey) + _subtree_range(srckey)
+                    )
+                conn.execute(
+                    "UPDATE entity_nodes SET parent = ? || substr(parent, length(?)+1) "+
+                    "WHERE parent = ? OR (parent > ? AND parent < ?)",
+                    (dstkey, srckey, srckey) + _subtree_range(srckey)
+                    )
+                conn.execute(
+                    "UPDATE entity_nodes SET parent = ?, name = ? WHERE path = ?",
+                    (os.path.dirname(dstkey), os.path.basename(dstkey), dstkey)
+                    )
+                self._touch(conn, os.path.dirname(srckey))
+                self._touch(conn, os.path.dirname(dstkey))
+        if self._underlay.exists(src):
+            self._underlay.rename(src, dst)
+        return
+
+    def copy_file(self, src, dst):
+        self.write_file(dst, self.read_file(src))
+        return
+
+    def link_file(self, src, dst):
+        if self._key(dst) is None and self._key(src) is None:
+            return self._underlay.link_file(src, dst)
+        self.copy_file(src, dst)
+        return "copy"
+
+    def getsize(self, path):
+        key  = self._key(path)
+        node = key and self._node(key)
+        if node and not node[0]:
+            return len(node[1])
+        return self._underlay.getsize(path)
+
+    def lock(self, path):
+        if self._key(path):
+            # Database updates are coordinated using a lock on the database file
+            return self._underlay.lock(self._dbpath)
+        return self._underlay.lock(path)
+
+def _subtree_range(key):
+    """
+    Returns a pair of bounds (lower, upper) such that the paths descended from the
+    supplied key are those that compare between them.  Paths are compared as
+    strings, so the match is exact (unlike SQL LIKE, which ignores case).
+    """
+    return (key + os.sep, key + chr(ord(os.sep)+1))
+
+class SqliteReadStream(io.BytesIO):
+    """
+    File-like object for reading a resource stored in an SQLite database.
+    """
+
+    def __init__(self, name, data):
+        super(SqliteReadStream, self).__init__(data)
+        self.name = name
+        return
+
+class SqliteWriteStream(io.BytesIO):
+    """
+    File-like object for creating or replacing a resource stored in an SQLite database.
+    Data written is saved to the database when the stream is closed.
+    """
+
+    def __init__(self, storage, key, name):
+        super(SqliteWriteStream, self).__init__()
+        self.name     = name
+        self._storage = storage
+        self._key     = key
+        return
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
+        return super(SqliteWriteStream, self).write(data)
+
+    def close(self):
+        if not self.closed:
+            self._storage._put_file(self._key, self.getvalue())
+        super(SqliteWriteStream, self).close()
+        return
+
+#   -------------------------------------------------------------------------------------------
+#
+#   Storage driver selection
+#
+#   -------------------------------------------------------------------------------------------
+
+_entity_storage = None
+
+def make_entity_storage(driver=None):
+    """
+    Returns a new storage driver object.
+
+    driver      is the name of the storage driver to use ("file" or "sqlite").  If not
+                specified, the ANNALIST_ENTITY_STORAGE setting is used.
+    """
+    driver = driver or getattr(settings, "ANNALIST_ENTITY_STORAGE", "file")
+    if driver == "file":
+        return FileEntityStorage()
+    if driver == "sqlite":
+        site_dir = os.path.join(settings.BASE_DATA_DIR, layout.SITE_DIR)
+        return SqliteEntityStorage(
+            site_dir, os.path.join(site_dir, layout.SITE_STORE_FILE)
+            )
+    raise ValueError("Unrecognized entity storage driver (%s)"%(driver,))
+
+def get_entity_storage():
+    """
+    Returns the storage driver used for accessing entity data.
+    """
+    global _entity_storage
+    if _entity_storage is None:
+        _entity_storage = make_entity_storage()
+    return _entity_storage
+
+def set_entity_storage(storage):
+    """
+    Set storage driver used for accessing entity data, and return the previous driver.
+    (Supplying None causes the configured driver to be used on next access.)
+    """
+    global _entity_storage
+    prev_storage    = _entity_storage
+    _entity_storage = storage
+    return prev_storage
+
+#   -------------------------------------------------------------------------------------------
+#
+#   Worker processes
+#
+#   -------------------------------------------------------------------------------------------
+
+_fork_resets = []
+
+def register_fork_reset(reset):
+    """
+    Register a function to discard module-level locks, caches and threads in a new
+    worker process (see `reset_after_fork`).
+
+    reset       is a function, called with no arguments, that replaces the locks and
+                discards the cached values and threads of a module.
+    """
+    _fork_resets.append(reset)
+    return
+
+def reset_after_fork():
+    """
+    Reset process-wide state in a worker process created by `fork` (e.g. by a
+    `multiprocessing.Pool` initializer).
+
+    Only the forking thread exists in the new process, so a lock held by any other 
+    thread when the process was forked is never released, and threads started by the 
+    parent process (e.g. for loading entities or removing tombstones) are not running.  
+    Each module with such state registers a function to replace it.
+    """
+    for reset in _fork_resets:
+        reset()
+    return
+
+def _reset_after_fork():
+    global _path_locks_lock, _path_locks, _batch_local, _entity_storage
+    _path_locks_lock = threading.Lock()
+    _path_locks      = weakref.WeakValueDictionary()
+    _batch_local     = threading.local()
+    _entity_storage  = None
+    return
+
+register_fork_reset(_reset_after_fork)
+
+# End.
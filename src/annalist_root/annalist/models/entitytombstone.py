@@ -0,0 +1,208 @@
+"""
+Removal of entity directory trees using tombstones.
+
+Removing an entity removes its directory and everything it contains.  For a
+collection or type data, this may be a large directory tree, and removing it
+within the handling of an HTTP request ties up a server worker for as long as
+the removal takes, and may cause the request to time out.
+
+Instead, a directory tree to be removed is first renamed to a tombstone name in
+the same parent directory, which is a single storage operation, so the entity
+ceases to exist at once.  Tombstone names are not valid Annalist identifiers, so
+they are ignored when enumerating entities.  The tombstone tree is then removed
+by a background reaper thread (or immediately, if the ANNALIST_REMOVE_IN_BACKGROUND
+setting is not enabled).  Any tombstones left behind (e.g. by a server process that
+has been stopped) can be removed by `reap_tombstones`, which is used by the
+`annalist-manager removetombstones` command.  This looks for tombstones only in the
+site directories that contain entity directories (see `TOMBSTONE_CONTAINERS`), so
+that it does not visit every entity directory in the site.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os.path
+import errno
+import fnmatch
+import uuid
+import threading
+import Queue
+
+import logging
+log = logging.getLogger(__name__)
+
+from django.conf import settings
+
+from annalist                       import layout
+from annalist.models.entitystorage  import get_entity_storage, register_fork_reset
+
+#   Directories that contain entity directories, relative to the site directory,
+#   where tombstones are found by `reap_tombstones` ("*" matches any name)
+_coll_path      = layout.SITE_COLL_PATH%{'id': "*"}
+TOMBSTONE_CONTAINERS = (
+    [ ""
+    , os.path.dirname(_coll_path)
+    , _coll_path
+    , _coll_path + "/" + layout.COLL_BASE_REF.rstrip("/")
+    , _coll_path + "/" + layout.COLL_TYPEDATA_PATH%{'id': "*"}
+    , _coll_path + "/" + layout.COLL_META_DIR
+    , _coll_path + "/" + layout.COLL_META_DIR + "/*"
+    , _coll_path + "/" + layout.COLL_META_DIR + "/" + layout.ENUM_DIR + "/*"
+    ])
+
+_reaper_lock    = threading.Lock()
+_reaper_queue   = Queue.Queue()     # Tombstone paths waiting to be removed
+_reaper_thread  = None
+
+def _reset_after_fork():
+    global _reaper_lock, _reaper_queue, _reaper_thread
+    _reaper_lock    = threading.Lock()
+    _reaper_queue   = Queue.Queue()
+    _reaper_thread  = None
+    return
+
+register_fork_reset(_reset_after_fork)
+
+def is_tombstone(name):
+    """
+    Returns True if the supplied file or directory name is a tombstone name.
+
+    >>> is_tombstone(tombstone_name("entity1"))
+    True
+    >>> is_tombstone("entity1")
+    False
+    """
+    return layout.ENTITY_TOMBSTONE_MARK in name
+
+def tombstone_name(name):
+    """
+    Returns a new tombstone name for a directory with the supplied name.
+
+    >>> tombstone_name("entity1").startswith("entity1"+layout.ENTITY_TOMBSTONE_MARK)
+    True
+    """
+    return layout.ENTITY_TOMBSTONE_DIR%{'id': name, 'stamp': uuid.uuid4().hex}
+
+def remove_tree_tombstone(path):
+    """
+    Remove the indicated directory tree by renaming it to a tombstone, which is
+    then removed in the background.
+
+    Returns the path of the tombstone.
+    """
+    path = path.rstrip("/")
+    tomb = os.path.join(os.path.dirname(path), tombstone_name(os.path.basename(path)))
+    get_entity_storage().rename(path, tomb)
+    if getattr(settings, "ANNALIST_REMOVE_IN_BACKGROUND", False):
+        _start_reaper()
+        _reaper_queue.put(tomb)
+    else:
+        reap_tombstone(tomb)
+    return tomb
+
+def reap_tombstone(tomb):
+    """
+    Remove a tombstone directory tree.  A tombstone that has already been removed
+    (e.g. by another thread or process) is ignored.  Other errors are logged, and
+    leave the tombstone to be removed later.
+    """
+    try:
+        get_entity_storage().remove_tree(tomb)
+    except (IOError, OSError), e:
+        if e.errno == errno.ENOENT:
+            log.debug("reap_tombstone: %s already removed"%(tomb,))
+        else:
+            log.warning("reap_tombstone: cannot remove %s (%s)"%(tomb, e))
+    return
+
+def _reaper():
+    """
+    Reaper thread:  removes queued tombstones.
+    """
+    while True:
+        tomb = _reaper_queue.get()
+        try:
+            reap_tombstone(tomb)
+        finally:
+            _reaper_queue.task_done()
+    return
+
+def _start_reaper():
+    global _reaper_thread
+    with _reaper_lock:
+        # (A reaper thread started by a parent process does not run in a forked process)
+        if _reaper_thread is None or not _reaper_thread.is_alive():
+            _reaper_thread = threading.Thread(target=_reaper, name="annalist-reaper")
+            _reaper_thread.daemon = True
+            _reaper_thread.start()
+    return
+
+def wait_for_reaper():
+    """
+    Wait until all tombstones queued for removal in the background have been removed.
+    """
+    _reaper_queue.join()
+    return
+
+def _container_match(parts):
+    """
+    Returns a pair of flags (container, ancestor) indicating whether a directory,
+    whose path relative to the site directory has the supplied segments, is one of
+    `TOMBSTONE_CONTAINERS`, and whether it contains any of them.
+
+    >>> _container_match([])
+    (True, True)
+    >>> _container_match(["c", "coll1", "d"])
+    (True, True)
+    >>> _container_match(["c", "coll1", "d", "type1"])
+    (True, False)
+    >>> _container_match(["c", "coll1", "d", "type1", "entity1"])
+    (False, False)
+    """
+    container = False
+    ancestor  = False
+    for pattern in TOMBSTONE_CONTAINERS:
+        pattern_parts = pattern.split("/") if pattern else []
+        if len(parts) > len(pattern_parts):
+            continue
+        if all(fnmatch.fnmatchcase(p, pp) for (p, pp) in zip(parts, pattern_parts)):
+            if len(parts) == len(pattern_parts):
+                container = True
+            else:
+                ancestor  = True
+    return (container, ancestor)
+
+def find_tombstones(dirpath, parts=[]):
+    """
+    Iterates over tombstones in the site directory tree at the indicated
+    directory, looking only in directories that contain entity directories.
+
+    parts       is a list of segments of the path of `dirpath` relative to the
+                site directory (used internally when visiting subdirectories).
+    """
+    storage   = get_entity_storage()
+    container = _container_match(parts)[0]
+    for name in sorted(storage.listdir(dirpath)):
+        p = os.path.join(dirpath, name)
+        if is_tombstone(name):
+            if container:
+                yield p
+        elif any(_container_match(parts+[name])) and storage.isdir(p):
+            for t in find_tombstones(p, parts+[name]):
+                yield t
+    return
+
+def reap_tombstones(dirpath):
+    """
+    Remove all tombstones in the indicated site directory tree (see `find_tombstones`).
+
+    Returns a list of the tombstones found.
+    """
+    tombs = list(find_tombstones(dirpath))
+    for tomb in tombs:
+        log.info("reap_tombstones: %s"%(tomb,))
+        reap_tombstone(tomb)
+    return tombs
+
+# End.
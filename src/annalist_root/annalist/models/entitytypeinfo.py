@@ -7,6 +7,8 @@ __copyright__   = "Copyright 2014, G. Klyne"
 __license__     = "MIT (http://opensource.org/licenses/MIT)"
 
 import traceback
+import contextlib
+import itertools
 import logging
 log = logging.getLogger(__name__)
 
@@ -40,6 +42,8 @@ FIELD_ID    = layout.FIELD_TYPEID
 VOCAB_ID    = layout.VOCAB_TYPEID
 TASK_ID     = layout.TASK_TYPEID
 
+ENUM_ENTITIES_CHUNK = 64    # Number of entities loaded together when enumerating
+
 COLL_MESSAGES = (
     { 'parent_heading':         "(@@ COLL_MESSAGES.parent_heading - unused message @@)"
     , 'parent_missing':         "(@@ COLL_MESSAGES.parent_missing - unused message @@)"
@@ -467,17 +471,58 @@ class EntityTypeInfo(object):
                 entity = self._new_entity(entity_id)
                 entity_initial_values = self.get_initial_entity_values(entity_id)
                 entity.set_values(entity_initial_values)
-            elif self.entityclass.exists(self.entityparent, entity_id, altscope="all"):
+            else:
+                # `load` returns None if the entity does not exist, so there is no 
+                # need for a separate `exists` probe of the same storage locations.
                 entity = self.entityclass.load(
                     self.entityparent, entity_id, altscope="all"
                     )
-            else:
+            if entity is None:
                 log.debug(
                     "EntityTypeInfo.get_entity %s/%s at %s not found"%
                     (self.type_id, entity_id, self.entityparent._entitydir)
                     )
         return entity
 
+    def get_entities(self, entity_ids):
+        """
+        Loads and returns a list of entities for the current type, in the same order
+        as the supplied entity ids, with None for any entity that does not exist.
+
+        This is equivalent to calling `get_entity` for each id, except that entity 
+        data is read concurrently (see `Entity.load_many`).
+        """
+        entity_ids = [ extract_entity_id(i) for i in entity_ids ]
+        entities   = self.entityclass.load_many(
+            self.entityparent, entity_ids, altscope="all"
+            )
+        for entity_id, entity in zip(entity_ids, entities):
+            if entity is None:
+                log.debug(
+                    "EntityTypeInfo.get_entities %s/%s at %s not found"%
+                    (self.type_id, entity_id, self.entityparent._entitydir)
+                    )
+        return entities
+
+    def _enum_entities_chunked(self, altscope, id_filter=None):
+        """
+        Iterate over entities in collection with current type, loading entities
+        in batches using `get_entities`.  If `id_filter` is supplied, entities
+        for which it returns False are not loaded.  Entities that cannot be loaded
+        are skipped.
+        """
+        entity_ids = self.entityparent.child_entity_ids(self.entityclass, altscope=altscope)
+        if id_filter:
+            entity_ids = ( i for i in entity_ids if id_filter(self.type_id, i) )
+        while True:
+            chunk = list(itertools.islice(entity_ids, ENUM_ENTITIES_CHUNK))
+            if not chunk:
+                break
+            for entity in self.get_entities(chunk):
+                if entity is not None:
+                    yield entity
+        return
+
     def get_create_entity(self, entity_id):
         """
         Read or create an entity with the indicated entity_id.
@@ -523,7 +568,22 @@ class EntityTypeInfo(object):
         if old_typeinfo.entity_exists(old_entity_id):
             new_entity = self._new_entity(new_entity_id)
             old_entity = old_typeinfo._new_entity(old_entity_id)
-            p_new      = new_entity._rename_files(old_entity)
+            new_parent = self.entityparent
+            old_parent = old_typeinfo.entityparent
+            if new_parent._entitydir == old_parent._entitydir:
+                updating = new_parent._updating_children(
+                    self.entityclass, [old_entity_id, new_entity_id]
+                    )
+            else:
+                # Nested in a consistent order to avoid lock-order inversion
+                updating = contextlib.nested(*
+                    [ p._updating_children(c, [i]) for (d, p, c, i) in sorted(
+                        [ (old_parent._entitydir, old_parent, old_typeinfo.entityclass, old_entity_id)
+                        , (new_parent._entitydir, new_parent, self.entityclass, new_entity_id)
+                        ])
+                    ])
+            with updating:
+                p_new = new_entity._rename_files(old_entity)
             if not p_new:
                 log.warning(
                     "EntityTypeInfo.rename_entity: error renaming entity %s from %s to %s"%
@@ -558,19 +618,21 @@ class EntityTypeInfo(object):
             if not self.entityparent:
                 log.warning("EntityTypeInfo.enum_entities: missing entityparent; type_id %s"%(self.type_id))
             else:
-                for eid in self.entityparent.child_entity_ids(
-                        self.entityclass, 
-                        altscope=altscope):
-                    yield self.get_entity(eid)
+                for entity in self._enum_entities_chunked(altscope):
+                    yield entity
         return
 
-    def enum_entities_with_implied_values(self, user_perms=None, altscope=None):
+    def enum_entities_with_implied_values(self, user_perms=None, altscope=None, id_filter=None):
         """
         Iterate over entities in collection with current type.
         Returns entities with alias and inferred fields instantiated.
 
         If user_perms is supplied and not None, checks that they contain permission to
         list values of the appropriate type. 
+
+        If id_filter is supplied, it is a function that is called with a type id and
+        entity id, and returns False for entities that are to be skipped without
+        being loaded.
         """
         #@@
         # log.info(
@@ -591,15 +653,11 @@ class EntityTypeInfo(object):
                     (self.type_id)
                     )
                 # No record type info: return base entity without implied values
-                for eid in self.entityparent.child_entity_ids(
-                        self.entityclass, 
-                        altscope=altscope):
-                    yield self.get_entity(eid)
+                for entity in self._enum_entities_chunked(altscope, id_filter=id_filter):
+                    yield entity
             else:
-                for eid in self.entityparent.child_entity_ids(
-                        self.entityclass, 
-                        altscope=altscope):
-                    yield self.get_entity_implied_values(self.get_entity(eid))
+                for entity in self._enum_entities_chunked(altscope, id_filter=id_filter):
+                    yield self.get_entity_implied_values(entity)
         return
 
     def get_initial_entity_values(self, entity_id):
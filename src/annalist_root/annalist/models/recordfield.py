@@ -19,6 +19,8 @@ from django.conf import settings
 from annalist                   import layout
 from annalist.identifiers       import ANNAL
 from annalist.models.entity     import Entity
+from annalist.models.configcache import config_changed
+from annalist.models.collcontext import context_entity_changed
 from annalist.models.entitydata import EntityData
 
 class RecordField(EntityData):
@@ -127,9 +129,22 @@ class RecordField(EntityData):
         This method is called when a RecordField entity has been updated.  
 
         It invokes the containing collection method to regenerate the JSON LD context 
-        for the collection to which the field belongs.
+        for the collection to which the field belongs, recomputing just the
+        context description of this field.  Any cached configuration entities are
+        discarded.
         """
+        context_entity_changed(self._parent, self._entitytypeid, self.get_id())
+        config_changed(self._parent)
         self._parent.generate_coll_jsonld_context(flags=post_update_flags)
         return entitydata
 
+    def _remove(self, type_uri):
+        """
+        Remove RecordField entity, and discard any cached configuration entities.
+        """
+        super(RecordField, self)._remove(type_uri)
+        context_entity_changed(self._parent, self._entitytypeid, self.get_id())
+        config_changed(self._parent)
+        return
+
 # End.
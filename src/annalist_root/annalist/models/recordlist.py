@@ -28,6 +28,7 @@ from annalist.exceptions        import Annalist_Error
 from annalist.identifiers       import ANNAL
 from annalist                   import util
 from annalist.models.entity     import Entity
+from annalist.models.configcache import config_changed
 from annalist.models.entitydata import EntityData
 from annalist.util              import extract_entity_id
 
@@ -82,4 +83,22 @@ class RecordList(EntityData):
         # Return result
         return entitydata
 
+    def _post_update_processing(self, entitydata, post_update_flags):
+        """
+        Post-update processing.
+
+        This method is called when a RecordList entity has been updated, and
+        discards any cached configuration entities.
+        """
+        config_changed(self._parent)
+        return entitydata
+
+    def _remove(self, type_uri):
+        """
+        Remove RecordList entity, and discard any cached configuration entities.
+        """
+        super(RecordList, self)._remove(type_uri)
+        config_changed(self._parent)
+        return
+
 # End.
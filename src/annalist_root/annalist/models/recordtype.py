@@ -28,6 +28,7 @@ from annalist.exceptions        import Annalist_Error
 from annalist.identifiers       import ANNAL
 from annalist                   import util
 from annalist.models.entity     import Entity
+from annalist.models.configcache import config_changed
 from annalist.models.entitydata import EntityData
 
 class RecordType(EntityData):
@@ -81,4 +82,22 @@ class RecordType(EntityData):
         """
         return None
 
+    def _post_update_processing(self, entitydata, post_update_flags):
+        """
+        Post-update processing.
+
+        This method is called when a RecordType entity has been updated, and
+        discards any cached configuration entities.
+        """
+        config_changed(self._parent)
+        return entitydata
+
+    def _remove(self, type_uri):
+        """
+        Remove RecordType entity, and discard any cached configuration entities.
+        """
+        super(RecordType, self)._remove(type_uri)
+        config_changed(self._parent)
+        return
+
 # End.
@@ -10,6 +10,7 @@ import os
 import os.path
 import urlparse
 import shutil
+import contextlib
 
 import logging
 log = logging.getLogger(__name__)
@@ -20,8 +21,10 @@ from annalist                   import layout
 from annalist.exceptions        import Annalist_Error
 from annalist.identifiers       import ANNAL
 from annalist                   import util
-from annalist.models.entity     import Entity
+from annalist.models.entity     import Entity, alt_parents_changed
 from annalist.models.entitydata import EntityData
+from annalist.models.entitymanifest import EntityManifest
+from annalist.models.searchindex import search_type_removed
 
 class RecordTypeData(Entity):
 
@@ -60,6 +63,93 @@ class RecordTypeData(Entity):
         t = EntityData.remove(self, entity_id)
         return t
 
+    def _manifest(self, cls):
+        """
+        Returns an EntityManifest object for child entities of the indicated class,
+        or None if no manifest is used.
+        """
+        if not (issubclass(cls, EntityData) and getattr(settings, "ANNALIST_ENTITY_MANIFEST", False)):
+            return None
+        type_dir = self._entitydir.rstrip("/")
+        manifest_path = os.path.join(
+            os.path.dirname(type_dir), layout.TYPEDATA_MANIFEST_FILE%{'id': self.get_id()}
+            )
+        # Old body file names are included, as entities using them are migrated on access
+        body_files = [cls._entityfile, layout.ENTITY_OLD_DATA_FILE]
+        return EntityManifest(type_dir, manifest_path, body_files)
+
+    def child_entity_ids(self, cls, altscope=None):
+        """
+        Iterates over child entity identifiers of an indicated class.
+
+        When a manifest is used, every identifier returned by `_children` is known
+        to have an entity body, so no further existence test is needed.
+        """
+        if self._manifest(cls) is None:
+            for i in super(RecordTypeData, self).child_entity_ids(cls, altscope=altscope):
+                yield i
+            return
+        if altscope == "select":
+            altscope = "all"
+        for i in self._children(cls, altscope=altscope):
+            yield i
+        return
+
+    @contextlib.contextmanager
+    def _updating_children(self, cls, entityids):
+        """
+        Context manager used when creating, updating or removing child entities, 
+        which keeps the entity manifest up to date.
+        """
+        manifest = self._manifest(cls)
+        if manifest is None:
+            yield
+        else:
+            with manifest.updating(entityids):
+                yield
+        return
+
+    def _base_children(self, cls):
+        """
+        Iterates over candidate child identifiers of an indicated class, using the
+        entity manifest when applicable.
+        """
+        manifest = self._manifest(cls)
+        if manifest is None:
+            return super(RecordTypeData, self)._base_children(cls)
+        return iter(manifest.entity_ids())
+
+    def _remove(self, type_uri):
+        """
+        Remove type data and any associated entity manifest and search index entries.
+
+        Type data may be an alternative parent of type data in other collections,
+        so any memoized alternative parent lists are discarded.
+        """
+        super(RecordTypeData, self)._remove(type_uri)
+        manifest = self._manifest(EntityData)
+        if manifest:
+            manifest.remove()
+        search_type_removed(self)
+        alt_parents_changed(self._parent)
+        return
+
+    def _post_update_processing(self, entitydata, post_update_flags):
+        """
+        Post-update processing: discard memoized alternative parent lists, which
+        may include type data in other collections.
+        """
+        alt_parents_changed(self._parent)
+        return entitydata
+
+    def _alt_scope_dirs(self, altscope):
+        """
+        Returns a list of directories of entities whose changes may affect the
+        alternative parents of the current type data:  these are the collections
+        that may contain alternative type data.
+        """
+        return [ c._entitydir for c in self._parent.get_alt_entities(altscope="all") ]
+
     def _local_find_alt_parents(self):
         """
         Returns a list of alternative parents for the current inheritance branch only;
@@ -21,6 +21,8 @@ from annalist.exceptions        import Annalist_Error
 from annalist.identifiers       import ANNAL
 from annalist                   import util
 from annalist.models.entity     import Entity
+from annalist.models.configcache import config_changed
+from annalist.models.collcontext import context_entity_changed
 from annalist.models.entitydata import EntityData
 from annalist.util              import extract_entity_id
 
@@ -80,9 +82,21 @@ class RecordView(EntityData):
         This method is called when a RecordView entity has been updated.  
 
         It invokes the containing collection method to regenerate the JSON LD context 
-        for the collection to which the entity belongs.
+        for the collection to which the entity belongs, recomputing just the
+        contribution of this entity.  Any cached configuration entities are discarded.
         """
+        context_entity_changed(self._parent, self._entitytypeid, self.get_id())
+        config_changed(self._parent)
         self._parent.generate_coll_jsonld_context(flags=post_update_flags)
         return entitydata
 
+    def _remove(self, type_uri):
+        """
+        Remove RecordView entity, and discard any cached configuration entities.
+        """
+        super(RecordView, self)._remove(type_uri)
+        context_entity_changed(self._parent, self._entitytypeid, self.get_id())
+        config_changed(self._parent)
+        return
+
 # End.
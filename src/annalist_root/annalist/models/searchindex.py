@@ -0,0 +1,564 @@
+"""
+Persistent per-collection index of entity values, used for list searches and
+list entity selectors.
+
+A list search (the `search` parameter of a list view) selects entities that have
+a string value containing the search term.  Testing this means loading every
+candidate entity and examining all of its values, which for a large collection
+takes a long time for every request.
+
+This index records, for each entity stored in the type data of a collection,
+the distinct three-character substrings (trigrams) of its string values.  An
+entity can contain a search term only if it has every trigram of the search term,
+so the index yields a set of candidate entities (a superset of those that match)
+without any entity being loaded.  Only the candidates are then loaded, and by
+default each is checked for the search term (see the ANNALIST_SEARCH_VERIFY
+setting).  Search terms shorter than a trigram are not looked up in the index.
+
+The index is held in an SQLite database stored with the collection metadata.  It
+is built by `annalist-manager indexcollection` (not by a request, as building the
+index for a large collection takes a long time), and is then updated when entity
+data is saved or removed.  While the index is being built, updates are recorded and
+are not overwritten by the build, and the index is not used until the build is
+complete.  Entities that are not in the index (e.g. configuration entities, or
+entities inherited from other collections) are always loaded and checked.
+
+The index also records, for each of a declared set of property URIs (see the
+ANNALIST_PROPERTY_INDEXES setting), the string values of that property in each
+entity (or the string members of a list value).  This is used to select candidate
+entities for list entity selectors that compare an indexed property with a literal
+or context value (see `EntitySelector.index_filter`), when the index has been
+built for the currently declared properties.
+
+Data that is changed without using Annalist (e.g. by editing files directly) is not
+reflected in the index until it is rebuilt (see `discard_search_index`).
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os
+import os.path
+import json
+import sqlite3
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+from django.conf import settings
+
+from annalist                       import layout
+from annalist                       import util
+from annalist.identifiers           import ANNAL
+from annalist.models.entitystorage  import (
+    get_entity_storage, register_fork_reset, FileEntityStorage
+    )
+
+#   Length of substrings recorded in the index
+SEARCH_GRAM     = 3
+
+#   Maximum number of search term trigrams used to select candidates
+SEARCH_GRAMS_MAX = 64
+
+#   Number of entities added by a build between database commits
+BUILD_COMMIT    = 500
+
+#   Maximum number of property values in a single index query
+LOOKUP_VALUES_MAX = 500
+
+#   Database connections used by the current thread, keyed by database file name
+_index_local    = threading.local()
+
+def _reset_after_fork():
+    global _index_local
+    _index_local = threading.local()
+    return
+
+register_fork_reset(_reset_after_fork)
+
+def search_grams(text):
+    """
+    Returns a set of integer codes for the trigrams of the supplied string.
+
+    >>> sorted(search_grams(u"abcd")) == sorted([gram_code(u"abc"), gram_code(u"bcd")])
+    True
+    >>> search_grams(u"ab")
+    set([])
+    """
+    return set( gram_code(text[i:i+SEARCH_GRAM]) for i in range(len(text)-SEARCH_GRAM+1) )
+
+def gram_code(gram):
+    """
+    Returns an integer code for a trigram (each character is a Unicode code point
+    of up to 21 bits, so the code fits in an SQLite integer).
+
+    >>> gram_code(u"abc") == (ord(u"a") << 42) + (ord(u"b") << 21) + ord(u"c")
+    True
+    """
+    code = 0
+    for c in gram:
+        code = (code << 21) + ord(c)
+    return code
+
+def value_grams(val, grams=None):
+    """
+    Returns a set of trigram codes for all strings in a value, which may be a
+    dictionary or list containing other values (cf. `EntityFinder.value_contains`).
+
+    >>> grams = value_grams({'a': u"abc", 'b': [u"bcd", 1, {'c': "cde"}]})
+    >>> grams == set(gram_code(g) for g in (u"abc", u"bcd", u"cde"))
+    True
+    """
+    if grams is None:
+        grams = set()
+    if isinstance(val, dict):
+        for k in val:
+            value_grams(val[k], grams)
+    elif isinstance(val, list):
+        for v in val:
+            value_grams(v, grams)
+    elif isinstance(val, str):
+        grams.update(search_grams(val.decode("utf-8", "replace")))
+    elif isinstance(val, unicode):
+        grams.update(search_grams(val))
+    return grams
+
+def property_values(val):
+    """
+    Returns a list of values recorded in the index for a property value:  a string
+    value, or the string members of a list value.  A value that is present but not
+    recorded (e.g. a dictionary) is represented by None.  Absent or empty values
+    are not recorded.
+
+    >>> property_values(u"abc")
+    [u'abc']
+    >>> property_values(["abc", 1, "def"])
+    ['abc', 'def']
+    >>> property_values({'a': "b"})
+    [None]
+    >>> property_values([])
+    []
+    """
+    if not val:
+        return []
+    if isinstance(val, (str, unicode)):
+        return [val]
+    if isinstance(val, list):
+        vals = [ v for v in val if isinstance(v, (str, unicode)) ]
+        if vals:
+            return vals
+    return [None]
+
+def indexed_properties():
+    """
+    Returns a sorted list of the property URIs whose values are indexed.
+    """
+    return sorted(set(getattr(settings, "ANNALIST_PROPERTY_INDEXES", [])))
+
+class IndexedEntities(object):
+    """
+    Membership test for the entities recorded in a search index:  a (type_id, entity_id)
+    pair is tested using the identifiers of indexed entities of that type, which are
+    read from the index when first needed.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._ids  = {}     # type_id -> set of entity ids
+        return
+
+    def __contains__(self, key):
+        (type_id, entity_id) = key
+        if type_id not in self._ids:
+            self._ids[type_id] = set( r[0] for r in self._conn.execute(
+                "SELECT entity_id FROM search_entities WHERE type_id = ?", (type_id,)
+                ))
+        return entity_id in self._ids[type_id]
+
+class SearchIndex(object):
+    """
+    Search index for entity data in a collection.
+    """
+
+    _schema = (
+        """CREATE TABLE IF NOT EXISTS search_meta"""+
+        """ ( key    TEXT PRIMARY KEY"""+
+        """ , value  TEXT"""+
+        """ )""",
+        """CREATE TABLE IF NOT EXISTS search_entities"""+
+        """ ( id        INTEGER PRIMARY KEY"""+
+        """ , type_id   TEXT NOT NULL"""+
+        """ , entity_id TEXT NOT NULL"""+
+        """ , UNIQUE (type_id, entity_id)"""+
+        """ )""",
+        """CREATE TABLE IF NOT EXISTS search_postings"""+
+        """ ( gram   INTEGER NOT NULL"""+
+        """ , entity INTEGER NOT NULL"""+
+        """ , PRIMARY KEY (gram, entity)"""+
+        """ ) WITHOUT ROWID""",
+        """CREATE INDEX IF NOT EXISTS search_postings_entity ON search_postings (entity)""",
+        """CREATE TABLE IF NOT EXISTS search_properties"""+
+        """ ( property  TEXT NOT NULL"""+
+        """ , value     TEXT"""+
+        """ , entity    INTEGER NOT NULL"""+
+        """ )""",
+        """CREATE INDEX IF NOT EXISTS search_properties_value ON search_properties (property, value)""",
+        """CREATE INDEX IF NOT EXISTS search_properties_entity ON search_properties (entity)"""
+        )
+
+    def __init__(self, dbpath):
+        """
+        Initialize search index object.
+
+        dbpath      is the SQLite database file name for the index.
+        """
+        self._dbpath = dbpath
+        return
+
+    def _conn(self):
+        """
+        Returns a database connection for the current thread, creating the index
+        database if needed.  The connection is kept for use by the same thread until
+        the database file is replaced (e.g. when the index is removed and rebuilt).
+        (The index is derived data that can be rebuilt, so updates are not
+        synchronized to storage.)
+        """
+        conns = getattr(_index_local, "conns", None)
+        if conns is None:
+            conns = _index_local.conns = {}
+        file_key = self._file_key()
+        if self._dbpath in conns:
+            (conn, conn_key) = conns[self._dbpath]
+            if file_key is not None and file_key == conn_key:
+                return conn
+            self._close()
+        util.ensure_dir(os.path.dirname(self._dbpath))
+        conn = sqlite3.connect(self._dbpath, timeout=30)
+        conn.execute("PRAGMA synchronous = OFF")
+        for stmt in self._schema:
+            conn.execute(stmt)
+        conn.commit()
+        conns[self._dbpath] = (conn, self._file_key())
+        return conn
+
+    def _close(self):
+        """
+        Close the database connection kept for the current thread, if any.
+        """
+        conns = getattr(_index_local, "conns", {})
+        if self._dbpath in conns:
+            (conn, conn_key) = conns.pop(self._dbpath)
+            conn.close()
+        return
+
+    def _file_key(self):
+        """
+        Returns a value that identifies the index database file, or None if the
+        file does not exist.
+        """
+        try:
+            st = os.stat(self._dbpath)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino)
+
+    def exists(self):
+        """
+        Returns True if the index database exists.
+        """
+        return os.path.isfile(self._dbpath)
+
+    def _get_meta(self, conn, key):
+        row = conn.execute("SELECT value FROM search_meta WHERE key = ?", (key,)).fetchone()
+        return row and row[0]
+
+    def complete(self):
+        """
+        Returns True if the index has been built for the currently declared indexed
+        properties, and may be used for searching.
+        """
+        if not self.exists():
+            return False
+        conn       = self._conn()
+        complete   = self._get_meta(conn, "complete")
+        properties = self._get_meta(conn, "properties")
+        return bool(complete) and properties == json.dumps(indexed_properties())
+
+    def _put_entity(self, conn, type_id, entity_id, values, replace=True):
+        """
+        Record trigrams and indexed property values for an entity.  If `replace`
+        is False, an entity already in the index is left unchanged.
+        """
+        row = conn.execute(
+            "SELECT id FROM search_entities WHERE type_id = ? AND entity_id = ?",
+            (type_id, entity_id)
+            ).fetchone()
+        if row:
+            if not replace:
+                return
+            eid = row[0]
+            conn.execute("DELETE FROM search_postings WHERE entity = ?", (eid,))
+            conn.execute("DELETE FROM search_properties WHERE entity = ?", (eid,))
+        else:
+            eid = conn.execute(
+                "INSERT INTO search_entities (type_id, entity_id) VALUES (?, ?)",
+                (type_id, entity_id)
+                ).lastrowid
+        conn.executemany(
+            "INSERT INTO search_postings (gram, entity) VALUES (?, ?)",
+            ( (g, eid) for g in value_grams(values) )
+            )
+        conn.executemany(
+            "INSERT INTO search_properties (property, value, entity) VALUES (?, ?, ?)",
+            ( (p, v, eid) for p in indexed_properties()
+                          for v in set(property_values(values.get(p, None))) )
+            )
+        return
+
+    def update_entity(self, type_id, entity_id, values):
+        """
+        Update the index entry for an entity that has been saved.  Nothing is done
+        if the index does not exist.
+
+        type_id     is the type id of the entity.
+        entity_id   is the entity id.
+        values      is a dictionary of entity values to be indexed.
+        """
+        if not self.exists():
+            return
+        conn = self._conn()
+        with conn:
+            self._put_entity(conn, type_id, entity_id, values)
+        return
+
+    def remove_entity(self, type_id, entity_id):
+        """
+        Remove the index entry for an entity that has been removed.
+        """
+        self._remove("type_id = ? AND entity_id = ?", (type_id, entity_id))
+        return
+
+    def remove_type(self, type_id):
+        """
+        Remove index entries for all entities of a type whose data has been removed.
+        """
+        self._remove("type_id = ?", (type_id,))
+        return
+
+    def _remove(self, where, params):
+        if not self.exists():
+            return
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "DELETE FROM search_postings WHERE entity IN "+
+                "(SELECT id FROM search_entities WHERE "+where+")",
+                params
+                )
+            conn.execute(
+                "DELETE FROM search_properties WHERE entity IN "+
+                "(SELECT id FROM search_entities WHERE "+where+")",
+                params
+                )
+            conn.execute("DELETE FROM search_entities WHERE "+where, params)
+        return
+
+    def build(self, entities):
+        """
+        Build the index from the supplied entity values.  Entities that are added
+        to the index by updates while the build proceeds are not changed, unless
+        the index was built for different indexed properties, in which case all
+        entries are replaced.
+
+        entities    is an iterator over triples (type_id, entity_id, values).
+        """
+        log.info("SearchIndex.build: %s"%(self._dbpath,))
+        properties = json.dumps(indexed_properties())
+        conn = self._conn()
+        try:
+            if self._get_meta(conn, "properties") != properties:
+                for table in ("search_meta", "search_entities", "search_postings", "search_properties"):
+                    conn.execute("DELETE FROM "+table)
+                conn.execute(
+                    "INSERT INTO search_meta (key, value) VALUES ('properties', ?)",
+                    (properties,)
+                    )
+                conn.commit()
+            count = 0
+            for (type_id, entity_id, values) in entities:
+                self._put_entity(conn, type_id, entity_id, values, replace=False)
+                count += 1
+                if count%BUILD_COMMIT == 0:
+                    conn.commit()
+            conn.execute("INSERT OR REPLACE INTO search_meta (key, value) VALUES ('complete', '1')")
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        return
+
+    def search(self, search):
+        """
+        Look up a search term in the index.
+
+        Returns a pair (indexed, matched), where `indexed` is a container of (type_id,
+        entity_id) pairs for all entities in the index (see `IndexedEntities`) and 
+        `matched` is a set of those that may contain the search term, or None if the
+        index cannot be used for the search term.
+        """
+        grams = sorted(search_grams(search))[:SEARCH_GRAMS_MAX]
+        if not grams:
+            return None
+        conn    = self._conn()
+        indexed = IndexedEntities(conn)
+        matched = set(conn.execute(
+            "SELECT e.type_id, e.entity_id FROM search_postings p "+
+            "JOIN search_entities e ON e.id = p.entity "+
+            "WHERE p.gram IN (%s) "%(",".join("?"*len(grams)))+
+            "GROUP BY p.entity HAVING COUNT(*) = ?",
+            grams + [len(grams)]
+            ))
+        return (indexed, matched)
+
+    def lookup_property(self, property_uri, values, missing=False):
+        """
+        Look up entities with any of the supplied values for a property.
+
+        property_uri    is the URI (or CURIE) of the property.
+        values          is a list of string values.
+        missing         if True, entities with no value (or an empty value) for the
+                        property are also matched.
+
+        Returns a pair (indexed, matched), where `indexed` is a container of (type_id,
+        entity_id) pairs for all entities in the index (see `IndexedEntities`) and
+        `matched` is a set of those that have one of the supplied values (or for which
+        a list value contains one of the supplied values), or None if the property is
+        not indexed.
+        """
+        if property_uri not in indexed_properties():
+            return None
+        conn    = self._conn()
+        indexed = IndexedEntities(conn)
+        matched = set()
+        values  = list(values)
+        for i in range(0, len(values), LOOKUP_VALUES_MAX):
+            chunk = values[i:i+LOOKUP_VALUES_MAX]
+            matched.update(conn.execute(
+                "SELECT DISTINCT e.type_id, e.entity_id FROM search_properties p "+
+                "JOIN search_entities e ON e.id = p.entity "+
+                "WHERE p.property = ? AND p.value IN (%s)"%(",".join("?"*len(chunk))),
+                [property_uri] + chunk
+                ))
+        if missing:
+            matched.update(conn.execute(
+                "SELECT e.type_id, e.entity_id FROM search_entities e "+
+                "WHERE NOT EXISTS (SELECT 1 FROM search_properties p "+
+                "WHERE p.entity = e.id AND p.property = ?)",
+                (property_uri,)
+                ))
+        return (indexed, matched)
+
+    def remove(self):
+        """
+        Remove the index, which is not used until it is built again.
+        """
+        self._close()
+        if self.exists():
+            os.remove(self._dbpath)
+        return
+
+def get_search_index(coll):
+    """
+    Returns the search index object for a collection, or None if a search index
+    is not used (see the ANNALIST_SEARCH_INDEX setting).  Search indexes are used
+    only with file system entity storage.
+    """
+    if not getattr(settings, "ANNALIST_SEARCH_INDEX", False):
+        return None
+    if not isinstance(get_entity_storage(), FileEntityStorage):
+        return None
+    (meta_dir, meta_file) = coll._dir_path()
+    return SearchIndex(os.path.join(meta_dir, layout.COLL_SEARCH_INDEX_FILE))
+
+def entity_index_values(entity, values):
+    """
+    Returns the values recorded in the search index for an entity:  the stored
+    entity values (without implied values, such as field aliases) and the entity
+    URL, which is added when entity values are loaded.  The same values are
+    used when the index is built and when it is updated for a saved entity.
+
+    entity      is the entity.
+    values      is a dictionary of the stored entity values.
+    """
+    values = dict(values)
+    values[ANNAL.CURIE.url] = entity.get_view_url_path()
+    return values
+
+def _entity_index(entity):
+    """
+    Returns the search index for an entity stored in the type data of a collection,
+    or None.
+    """
+    typedata = entity._parent
+    if getattr(typedata, "_entitytypeid", None) != layout.TYPEDATA_TYPEID:
+        return None
+    return get_search_index(typedata._parent)
+
+def search_entity_changed(entity, values):
+    """
+    Called when entity data has been saved, to update the collection search index.
+
+    entity      is the entity that has been saved.
+    values      is a dictionary of the saved entity values.
+    """
+    index = _entity_index(entity)
+    if index:
+        try:
+            index.update_entity(
+                entity._parent.get_id(), entity.get_id(), entity_index_values(entity, values)
+                )
+        except sqlite3.Error, e:
+            log.warning("search_entity_changed: %s (%s)"%(index._dbpath, e))
+            index.remove()
+    return
+
+def search_entity_removed(entity):
+    """
+    Called when entity data has been removed, to update the collection search index.
+    """
+    index = _entity_index(entity)
+    if index:
+        try:
+            index.remove_entity(entity._parent.get_id(), entity.get_id())
+        except sqlite3.Error, e:
+            log.warning("search_entity_removed: %s (%s)"%(index._dbpath, e))
+            index.remove()
+    return
+
+def search_type_removed(typedata):
+    """
+    Called when all entity data for a type has been removed, to update the
+    collection search index.
+    """
+    index = get_search_index(typedata._parent)
+    if index:
+        try:
+            index.remove_type(typedata.get_id())
+        except sqlite3.Error, e:
+            log.warning("search_type_removed: %s (%s)"%(index._dbpath, e))
+            index.remove()
+    return
+
+def discard_search_index(coll):
+    """
+    Discard the search index for a collection (e.g. when entity data has been
+    updated directly), which is not used until it is built again.
+    """
+    index = get_search_index(coll)
+    if index:
+        index.remove()
+    return
+
+# End.
@@ -35,6 +35,9 @@ from annalist.util                  import (
 from annalist.models.annalistuser   import AnnalistUser
 from annalist.models.entityroot     import EntityRoot
 from annalist.models.sitedata       import SiteData
+from annalist.models.sitesnapshot   import update_site_data_stamp
+from annalist.models.configcache    import config_changed
+from annalist.models.sitecollections import get_collections_directory
 from annalist.models.collection     import Collection
 from annalist.models.recordvocab    import RecordVocab
 from annalist.models.recordview     import RecordView
@@ -129,6 +132,11 @@ class Site(EntityRoot):
     def site_data(self):
         """
         Return dictionary of site data
+
+        Collection descriptions are taken from a cached directory of the site's
+        collections (see `sitecollections`), so collection metadata is not reloaded
+        for every request.  Use `collections` or `collections_dict` to access the
+        collection objects.
         """
         # @@TODO: consider using generic view logic for this mapping (and elsewhere?)
         #         This is currently a bit of a kludge, designed to match the site
@@ -140,7 +148,7 @@ class Site(EntityRoot):
         site_data["title"] = site_data.get(RDFS.CURIE.label, message.SITE_NAME_DEFAULT)
         # log.info("site.site_data: site_data %r"%(site_data))
         colls = collections.OrderedDict()
-        for k, v in self.collections_dict().items():
+        for k, v in get_collections_directory(self).items():
             # log.info("site.site_data: colls[%s] %r"%(k, v))
             colls[k] = dict(v.items(), id=k, url=v[ANNAL.CURIE.url], title=v[RDFS.CURIE.label])
         site_data["collections"] = colls
@@ -422,6 +430,7 @@ class Site(EntityRoot):
         s = os.path.join(site_data_src, sdir)
         d = os.path.join(site_data_tgt, sdir)
         replacetree(s, d)
+        Site._site_data_dir_updated(sitedata)
         return
 
     @staticmethod
@@ -434,6 +443,19 @@ class Site(EntityRoot):
         s = os.path.join(site_data_src, sdir)
         d = os.path.join(site_data_tgt, sdir)
         updatetree(s, d)
+        Site._site_data_dir_updated(sitedata)
+        return
+
+    @staticmethod
+    def _site_data_dir_updated(sitedata):
+        """
+        Called when configuration data for a collection (or the site data) has been
+        replaced or updated, to discard cached configuration entities.
+        """
+        config_changed(sitedata)
+        if sitedata.get_id() == layout.SITEDATA_ID:
+            site_data_tgt, site_data_file = sitedata._dir_path()
+            update_site_data_stamp(site_data_tgt)
         return
 
     @staticmethod
@@ -0,0 +1,117 @@
+"""
+Process-wide cache of the collections directory of a site.
+
+The site data presented with every page (see `Site.site_data`) includes a list
+of collections in the site, with their labels and URLs.  Constructing this list
+means loading the metadata of every collection in the site, which is repeated for
+every request handled because view objects are not retained between requests.
+
+This cache holds, for each site, the metadata values of the collections in the
+site, ordered by collection identifier.  An entry is used while the stat keys of
+the site collections directory and of a collections stamp file in the site base
+directory are unchanged.  The stamp file is rewritten whenever collection metadata
+is created, updated or removed (see `collections_changed`), and adding or removing
+a collection directory changes the collections directory stat key, so updates made
+by other processes are detected.  Updates made by the current process discard the
+cache immediately.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os.path
+import uuid
+import json
+import threading
+from collections    import OrderedDict
+
+import logging
+log = logging.getLogger(__name__)
+
+from annalist                       import layout
+from annalist.models.entitystorage  import get_entity_storage, current_batch, register_fork_reset
+
+_directory_lock       = threading.Lock()
+_directory_cache      = {}  # site directory -> (stamps, OrderedDict of coll_id -> values)
+_directory_generation = 0   # Incremented when the cache is discarded
+
+def _reset_after_fork():
+    global _directory_lock, _directory_cache
+    _directory_lock  = threading.Lock()
+    _directory_cache = {}
+    return
+
+register_fork_reset(_reset_after_fork)
+
+def collections_stamp_path(site):
+    """
+    Returns the path of the collections stamp file for the indicated site.
+    """
+    return os.path.join(site._entitydir, layout.SITE_COLLECTIONS_STAMP_FILE)
+
+def _collections_dir(site):
+    return os.path.join(site._entitydir, layout.SITE_COLL_PATH%{'id': ""})
+
+def collections_changed(site=None):
+    """
+    Called when a collection is created, updated or removed, to discard cached
+    collection directories.
+
+    site        if supplied, is the site containing the changed collection:  its
+                collections stamp file is rewritten so that other processes discard
+                their cached directories.  (Within a batch of updates, the stamp is
+                rewritten once when the batch is completed.)
+    """
+    global _directory_generation
+    if site is not None:
+        batch = current_batch()
+        if batch:
+            batch.defer(("update_collections_stamp", collections_stamp_path(site)),
+                lambda: _update_stamp(site)
+                )
+        else:
+            _update_stamp(site)
+    with _directory_lock:
+        _directory_cache.clear()
+        _directory_generation += 1
+    return
+
+def _update_stamp(site):
+    """
+    Write a new collections stamp file for the indicated site.
+    """
+    storage = get_entity_storage()
+    path    = collections_stamp_path(site)
+    if storage.isdir(os.path.dirname(path)):
+        storage.write_file(path, json.dumps({ "stamp": uuid.uuid4().hex }))
+    return
+
+def _site_stamps(site):
+    storage = get_entity_storage()
+    return (
+        storage.stat_key(_collections_dir(site)),
+        storage.stat_key(collections_stamp_path(site))
+        )
+
+def get_collections_directory(site):
+    """
+    Returns an ordered dictionary of the metadata values of collections in the
+    indicated site, indexed by collection identifier.
+
+    The returned dictionary and values are shared, and must not be modified by
+    the caller.
+    """
+    key    = os.path.normpath(site._entitydir)
+    stamps = _site_stamps(site)
+    entry  = _directory_cache.get(key, None)
+    if entry and entry[0] == stamps:
+        return entry[1]
+    generation = _directory_generation
+    colls      = OrderedDict(sorted( (c.get_id(), c.get_values()) for c in site.collections() ))
+    with _directory_lock:
+        if generation == _directory_generation:
+            _directory_cache[key] = (stamps, colls)
+    return colls
+
+# End.
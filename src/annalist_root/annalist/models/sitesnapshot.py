@@ -0,0 +1,234 @@
+"""
+Read-only in-memory snapshot of site-wide definitions.
+
+The site data collection (`_annalist_site`) supplies inherited type, list, view,
+group, field, enumeration and vocabulary definitions for every user collection, so
+these are read whenever a form is rendered.  These definitions change only when the
+site data is updated (e.g. by `annalist-manager updatesitedata`), so they are held
+in a snapshot that is loaded once, and answers existence tests, directory listings
+and entity value reads without accessing storage.
+
+A snapshot is used only while a version stamp file in the site data collection
+metadata directory is unchanged.  The stamp file is rewritten when site data is
+replaced or updated, and when an entity within the snapshot is saved, removed or
+renamed, causing every process using the site data to reload its snapshot.  The
+stamp file is checked at most once every few seconds:  updates made by the current
+process are visible immediately.
+
+If the stamp file is not present, no snapshot is used.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os.path
+import time
+import uuid
+import json
+import datetime
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+import annalist
+from annalist                       import layout
+from annalist                       import util
+from annalist.models.entitystorage  import get_entity_storage, register_fork_reset
+from annalist.models.entitycache    import copy_values
+from annalist.models.entitytombstone import is_tombstone
+
+#   Site data directories whose content is held in the snapshot.  (User permissions
+#   may be updated at any time, so are always read from storage.)
+SNAPSHOT_DIRS   = (
+    [ layout.TYPE_DIR, layout.LIST_DIR, layout.VIEW_DIR, layout.GROUP_DIR
+    , layout.FIELD_DIR, layout.ENUM_DIR, layout.VOCAB_DIR
+    ])
+
+#   Minimum interval, in seconds, between checks of the site data version stamp.
+CHECK_INTERVAL  = 2.0
+
+#   Path segment that locates the site data collection metadata directory
+SITEDATA_META_MARK = "/" + layout.SITEDATA_META_DIR + "/"
+
+class SiteDataSnapshot(object):
+    """
+    Immutable snapshot of site data definitions.
+
+    Provides read-only access methods compatible with those of the entity storage
+    drivers (see `entitystorage`), for paths that are covered by the snapshot.
+    """
+
+    def __init__(self, metadir):
+        """
+        Load snapshot of site data.
+
+        metadir     is the site data collection metadata directory.
+        """
+        self._metadir = metadir
+        self._dirs    = {}      # directory path -> tuple of names in directory
+        self._files   = {}      # file path -> entity values, or None
+        storage = get_entity_storage()
+        for d in SNAPSHOT_DIRS:
+            self._load_dir(storage, os.path.join(metadir, d))
+        log.info(
+            "SiteDataSnapshot: loaded %d directories, %d files from %s"%
+            (len(self._dirs), len(self._files), metadir)
+            )
+        return
+
+    def _load_dir(self, storage, dirpath):
+        """
+        Load directory and its content into the snapshot.
+        """
+        if not storage.isdir(dirpath):
+            return
+        names = tuple(sorted(n for n in storage.listdir(dirpath) if not is_tombstone(n)))
+        self._dirs[dirpath] = names
+        for name in names:
+            p = os.path.join(dirpath, name)
+            if storage.isdir(p):
+                self._load_dir(storage, p)
+            elif name.endswith(".jsonld"):
+                try:
+                    self._files[p] = util.json_loads_body(storage.read_file(p))
+                except (IOError, ValueError), e:
+                    log.warning("SiteDataSnapshot: cannot load %s (%s)"%(p, e))
+                    self._files[p] = None
+            else:
+                self._files[p] = None
+        return
+
+    def covers(self, path):
+        """
+        Returns True if the indicated (normalized) path is in the snapshot, or would
+        be in the snapshot if the corresponding file or directory existed.
+        """
+        return _site_meta_dir(path) == self._metadir and _in_snapshot_dirs(self._metadir, path)
+
+    def isdir(self, path):
+        return os.path.normpath(path) in self._dirs
+
+    def isfile(self, path):
+        return os.path.normpath(path) in self._files
+
+    def exists(self, path):
+        return self.isdir(path) or self.isfile(path)
+
+    def listdir(self, path):
+        return list(self._dirs.get(os.path.normpath(path), ()))
+
+    def get_values(self, path):
+        """
+        Returns a copy of entity values for the indicated body file, or None.
+        """
+        v = self._files.get(os.path.normpath(path), None)
+        return v and copy_values(v)
+
+_snapshots_lock = threading.Lock()
+_snapshots      = {}    # metadata directory -> (time checked, stamp, SiteDataSnapshot or None)
+
+def _reset_after_fork():
+    global _snapshots_lock, _snapshots
+    _snapshots_lock = threading.Lock()
+    _snapshots      = {}
+    return
+
+register_fork_reset(_reset_after_fork)
+
+def _site_meta_dir(path):
+    """
+    Returns the site data metadata directory containing the indicated (normalized)
+    path, or None.
+    """
+    i = path.find(SITEDATA_META_MARK)
+    if i < 0:
+        return None
+    return path[:i+len(SITEDATA_META_MARK)-1]
+
+def _in_snapshot_dirs(metadir, path):
+    """
+    Returns True if the indicated (normalized) path is in a snapshot directory
+    of the indicated site data metadata directory.
+    """
+    return path[len(metadir)+1:].split("/", 1)[0] in SNAPSHOT_DIRS
+
+def _stamp_path(metadir):
+    return os.path.join(metadir, layout.SITEDATA_STAMP_FILE)
+
+def get_site_snapshot(path):
+    """
+    Returns a valid snapshot of the site data covering the indicated path, or None.
+    """
+    path    = os.path.normpath(path)
+    metadir = _site_meta_dir(path)
+    if metadir is None:
+        return None
+    now = time.time()
+    (checked, stamp, snapshot) = _snapshots.get(metadir, (None, None, None))
+    if checked is None or checked < now - CHECK_INTERVAL:
+        with _snapshots_lock:
+            (_, stamp, snapshot) = _snapshots.get(metadir, (None, None, None))
+            new_stamp = get_entity_storage().stat_key(_stamp_path(metadir))
+            if new_stamp is None:
+                snapshot = None
+            elif snapshot is None or new_stamp != stamp:
+                snapshot = SiteDataSnapshot(metadir)
+            _snapshots[metadir] = (now, new_stamp, snapshot)
+    if snapshot and snapshot.covers(path):
+        return snapshot
+    return None
+
+def snapshot_storage(path):
+    """
+    Returns an object for read-only access to the indicated path:  a site data
+    snapshot if one covers the path, otherwise the current entity storage driver.
+    """
+    return get_site_snapshot(path) or get_entity_storage()
+
+def update_site_data_stamp(metadir):
+    """
+    Write a new site data version stamp, causing all processes to reload any
+    snapshot of the site data.
+
+    metadir     is the site data collection metadata directory.
+    """
+    metadir = os.path.normpath(metadir)
+    stamp   = (
+        { "annal:software_version": annalist.__version_data__
+        , "updated":                datetime.datetime.now().replace(microsecond=0).isoformat()
+        , "stamp":                  uuid.uuid4().hex
+        })
+    with _snapshots_lock:
+        _snapshots.pop(metadir, None)
+        get_entity_storage().write_file(
+            _stamp_path(metadir), json.dumps(stamp, indent=2, sort_keys=True)
+            )
+    return
+
+def site_data_changed(path):
+    """
+    Called when an entity is saved, removed or renamed:  if the indicated path is
+    covered by site data snapshots, a new site data version stamp is written.
+    """
+    path    = os.path.normpath(path)
+    metadir = _site_meta_dir(path)
+    if metadir is None or not _in_snapshot_dirs(metadir, path):
+        return
+    if get_entity_storage().isfile(_stamp_path(metadir)):
+        update_site_data_stamp(metadir)
+    else:
+        with _snapshots_lock:
+            _snapshots.pop(metadir, None)
+    return
+
+def discard_snapshots():
+    """
+    Discard all site data snapshots, which are reloaded when next used.
+    """
+    with _snapshots_lock:
+        _snapshots.clear()
+    return
+
+# End.
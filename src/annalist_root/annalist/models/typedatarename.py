@@ -0,0 +1,218 @@
+"""
+Directory-level renaming of type data.
+
+When a type is renamed, every instance of the type is moved to the type data
+directory for the new type id, and its type id and type URI values are updated.
+Moving instances one at a time means creating a copy of each entity, copying any
+attached resources, and then removing the original, which for a type with many
+instances takes time (and storage) proportional to the total size of the type data.
+
+Instead, the type data directory is renamed with a single storage operation, and
+then each entity is saved in place with the new type id and type URIs (so that the
+usual post-update processing, such as updating the search index, is performed).
+A rename marker file, stored alongside the type data directories, records the
+progress of the operation:  it is written before the directory is renamed, updated
+periodically as entity bodies are rewritten (in identifier order), and removed
+when the operation is complete.  If a rename is interrupted, it can be completed
+later by `resume_type_data_renames`.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os.path
+import json
+
+import logging
+log = logging.getLogger(__name__)
+
+from annalist                       import layout
+from annalist                       import util
+from annalist.identifiers           import ANNAL
+from annalist.models.entity         import alt_parents_changed
+from annalist.models.entitydata     import EntityData
+from annalist.models.recordtypedata import RecordTypeData
+from annalist.models.entitystorage  import get_entity_storage, batch_updates
+from annalist.models.entitycache    import get_entity_cache
+from annalist.models.sitesnapshot   import site_data_changed
+from annalist.models.searchindex    import search_type_removed
+
+#   Number of entity bodies rewritten between updates of the rename marker
+REWRITE_CHECKPOINT  = 100
+
+def _type_data_dir(coll, type_id):
+    return RecordTypeData(coll, type_id)._entitydir.rstrip("/")
+
+def _coll_data_dir(coll):
+    return os.path.join(coll._entitydir, layout.COLL_TYPEDATA_PATH%{'id': ""}).rstrip("/")
+
+def _marker_path(coll, type_id):
+    return os.path.join(_coll_data_dir(coll), layout.TYPEDATA_RENAME_FILE%{'id': type_id})
+
+def _write_marker(coll, rename):
+    get_entity_storage().write_file(
+        _marker_path(coll, rename["new_type_id"]),
+        json.dumps(rename, indent=2, separators=(',', ': '), sort_keys=True)
+        )
+    return
+
+def _entity_ids(dirpath):
+    storage = get_entity_storage()
+    if not storage.isdir(dirpath):
+        return []
+    return sorted(i for i in storage.listdir(dirpath) if util.valid_id(i))
+
+def rename_type_data(coll, old_type_id, new_type_id, type_uri, type_uris):
+    """
+    Rename the type data for a type, and update the type id and type URIs of
+    all instances of the type defined by the collection.
+
+    coll        is the collection whose type data is renamed.
+    old_type_id is the type id whose data is renamed.
+    new_type_id is the new type id for the type data.
+    type_uri    is the type URI for the renamed type (`annal:type`).
+    type_uris   is a list of all type URIs for instances of the renamed type
+                (`@type`).
+
+    Returns True if the type data has been renamed, or False if it cannot be
+    renamed as a unit (because there is no type data for the old type id, or
+    there is already type data for the new type id that contains entities), in
+    which case instances must be moved individually.
+    """
+    storage = get_entity_storage()
+    src_dir = _type_data_dir(coll, old_type_id)
+    dst_dir = _type_data_dir(coll, new_type_id)
+    if not RecordTypeData.exists(coll, old_type_id):
+        return False
+    if storage.isdir(dst_dir):
+        if _entity_ids(dst_dir):
+            return False
+        # Empty type data (e.g. created when the new type was saved) is replaced
+        storage.remove_tree(dst_dir)
+        get_entity_cache().invalidate_dir(dst_dir)
+    log.info("rename_type_data: %s/%s -> %s"%(coll.get_id(), old_type_id, new_type_id))
+    rename = (
+        { "old_type_id":    old_type_id
+        , "new_type_id":    new_type_id
+        , "type_uri":       type_uri
+        , "type_uris":      list(type_uris)
+        , "renamed":        False
+        , "rewritten":      ""
+        })
+    _write_marker(coll, rename)
+    _complete_rename(coll, rename)
+    return True
+
+def _complete_rename(coll, rename):
+    """
+    Complete a type data rename operation described by a rename marker.
+    """
+    storage     = get_entity_storage()
+    old_type_id = rename["old_type_id"]
+    new_type_id = rename["new_type_id"]
+    src_dir     = _type_data_dir(coll, old_type_id)
+    dst_dir     = _type_data_dir(coll, new_type_id)
+    if not rename["renamed"]:
+        if storage.isdir(src_dir):
+            storage.rename(src_dir, dst_dir)
+        _discard_manifests(coll, [old_type_id, new_type_id])
+        _rename_id_counters(coll, old_type_id, new_type_id)
+        # Search index entries for the new type id are added as entities are saved
+        search_type_removed(RecordTypeData(coll, old_type_id))
+        get_entity_cache().invalidate_dir(src_dir)
+        site_data_changed(src_dir)
+        alt_parents_changed(coll)
+        rename["renamed"] = True
+        _write_marker(coll, rename)
+    # Type data metadata is rewritten with the new type id
+    typedata = RecordTypeData.create(coll, new_type_id, {})
+    count    = 0
+    with batch_updates():
+        for entity_id in _entity_ids(dst_dir):
+            if entity_id <= rename["rewritten"]:
+                continue
+            _rewrite_entity(rename, typedata, entity_id)
+            count += 1
+            if count%REWRITE_CHECKPOINT == 0:
+                rename["rewritten"] = entity_id
+                _write_marker(coll, rename)
+    site_data_changed(dst_dir)
+    storage.remove_file(_marker_path(coll, new_type_id))
+    return
+
+def _discard_manifests(coll, type_ids):
+    """
+    Discard entity manifests for the indicated type data, which are rebuilt
+    when next used.
+    """
+    storage  = get_entity_storage()
+    for type_id in type_ids:
+        manifest = os.path.join(_coll_data_dir(coll), layout.TYPEDATA_MANIFEST_FILE%{'id': type_id})
+        if storage.isfile(manifest):
+            storage.remove_file(manifest)
+    return
+
+def _rename_id_counters(coll, old_type_id, new_type_id):
+    """
+    Move any identifier counters for the old type data to the new type data.
+    """
+    storage     = get_entity_storage()
+    old_counter = os.path.join(_coll_data_dir(coll), layout.ENTITY_ID_COUNTER_FILE%{'id': old_type_id})
+    new_counter = os.path.join(_coll_data_dir(coll), layout.ENTITY_ID_COUNTER_FILE%{'id': new_type_id})
+    if storage.isfile(old_counter):
+        if storage.isfile(new_counter):
+            storage.remove_file(new_counter)
+        storage.rename(old_counter, new_counter)
+    return
+
+def _rewrite_entity(rename, typedata, entity_id):
+    """
+    Save an entity in renamed type data with the new type id and type URIs.
+    (Loading the entity also migrates any old body file name.)
+    """
+    entity = EntityData.load(typedata, entity_id)
+    if entity is None:
+        log.error("rename_type_data: error loading %s/%s"%(typedata.get_id(), entity_id))
+        return
+    types  = list(rename["type_uris"])
+    if EntityData._entitytype not in types:
+        types.append(EntityData._entitytype)
+    values = entity.get_values()
+    values['@type']               = types
+    values[ANNAL.CURIE.type_id]   = rename["new_type_id"]
+    values[ANNAL.CURIE.type]      = rename["type_uri"]
+    entity._save()
+    return
+
+def resume_type_data_renames(coll):
+    """
+    Complete any type data rename operations for a collection that have been
+    interrupted.
+
+    Returns a list of the new type ids of the renamed type data.
+    """
+    storage  = get_entity_storage()
+    coll_dir = _coll_data_dir(coll)
+    suffix   = layout.TYPEDATA_RENAME_FILE%{'id': ""}
+    resumed  = []
+    if not storage.isdir(coll_dir):
+        return resumed
+    for f in sorted(storage.listdir(coll_dir)):
+        if not f.endswith(suffix):
+            continue
+        marker = os.path.join(coll_dir, f)
+        try:
+            rename = json.loads(storage.read_file(marker))
+        except (IOError, ValueError), e:
+            log.error("resume_type_data_renames: error loading %s"%(marker))
+            log.error(e)
+            continue
+        log.info("resume_type_data_renames: %s/%s -> %s"%
+            (coll.get_id(), rename["old_type_id"], rename["new_type_id"])
+            )
+        _complete_rename(coll, rename)
+        resumed.append(rename["new_type_id"])
+    return resumed
+
+# End.
@@ -0,0 +1,149 @@
+"""
+Per-collection graph of type URIs, used for subtype queries.
+
+Entity types may declare supertypes (see `annal:supertype_uri`), and a list of
+entities of some type includes entities of its subtypes.  Finding the subtypes of
+a type means examining every type definition that applies for a collection, and a
+`subtype` entity selector does this for every entity tested.
+
+This module records, for each type URI used by the type definitions of a collection,
+the set of its (transitive) supertype URIs and the identifiers of the types that
+are its subtypes, so that these queries are dictionary lookups.  The graph is
+computed when first used, and is discarded when configuration entities (including
+type definitions) are changed (see `annalist.models.configcache`).
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import logging
+log = logging.getLogger(__name__)
+
+from annalist.identifiers           import ANNAL
+from annalist.models.recordtype     import RecordType
+from annalist.models.configcache    import get_config_derived
+
+def type_uris(recordtype):
+    """
+    Returns a pair (type_uri, supertype_uris) for a type definition, where
+    `supertype_uris` is a list of the supertype URIs declared by the type
+    (cf. `EntityTypeInfo.get_all_type_uris`).
+
+    >>> type_uris(
+    ...     { 'annal:uri': "test:t1"
+    ...     , 'annal:supertype_uri': [{'@id': "test:t2"}, {'@id': "test:t3"}]
+    ...     })
+    ('test:t1', ['test:t2', 'test:t3'])
+    >>> type_uris({ 'annal:uri': "", 'annal:url': "/testsite/c/coll/_type/t1/" })
+    ('/testsite/c/coll/_type/t1/', [])
+    """
+    type_uri = recordtype.get(ANNAL.CURIE.uri, None) or recordtype.get(ANNAL.CURIE.url, None)
+    supertype_uris = [
+        st['@id'] for st in (recordtype.get(ANNAL.CURIE.supertype_uri, None) or [])
+                  if st.get('@id', None)
+        ]
+    return (type_uri, supertype_uris)
+
+class TypeGraph(object):
+    """
+    Transitive supertype and subtype relations between type URIs.
+
+    >>> g = TypeGraph(
+    ...     [ ("t1", "test:t1", ["test:t2"])
+    ...     , ("t2", "test:t2", ["test:t3"])
+    ...     , ("t3", "test:t3", [])
+    ...     , ("t4", "test:t4", ["test:t3", "test:t4"])
+    ...     ])
+    >>> sorted(g.supertype_uris("test:t1"))
+    ['test:t1', 'test:t2', 'test:t3']
+    >>> sorted(g.subtype_ids("test:t3"))
+    ['t1', 't2', 't3', 't4']
+    >>> sorted(g.subtype_ids("test:t2"))
+    ['t1', 't2']
+    >>> g.subtype("test:t1", "test:t3")
+    True
+    >>> g.subtype("test:t3", "test:t1")
+    False
+    >>> sorted(g.supertype_uris("test:undefined"))
+    []
+    """
+
+    def __init__(self, types):
+        """
+        Initialize type graph.
+
+        types       is an iterable of triples (type_id, type_uri, supertype_uris)
+                    for the type definitions that apply for a collection.
+        """
+        direct          = {}    # type URI -> set of declared supertype URIs
+        type_id_uris    = []    # (type_id, type_uri) for each type
+        for (type_id, type_uri, supertype_uris) in types:
+            if type_uri:
+                direct.setdefault(type_uri, set()).update(supertype_uris)
+                type_id_uris.append((type_id, type_uri))
+        self._supertypes = {}   # type URI -> set of type URI and its transitive supertypes
+        for type_uri in direct:
+            self._supertypes[type_uri] = self._closure(direct, type_uri)
+        self._subtype_ids = {}  # type URI -> set of ids of type and its transitive subtypes
+        for (type_id, type_uri) in type_id_uris:
+            for st in self._supertypes[type_uri]:
+                self._subtype_ids.setdefault(st, set()).add(type_id)
+        return
+
+    @staticmethod
+    def _closure(direct, type_uri):
+        """
+        Returns the set of a type URI and its transitive supertypes.  Cycles of
+        supertype declarations are allowed.
+        """
+        found = set([type_uri])
+        todo  = [type_uri]
+        while todo:
+            for st in direct.get(todo.pop(), ()):
+                if st not in found:
+                    found.add(st)
+                    todo.append(st)
+        return found
+
+    def supertype_uris(self, type_uri):
+        """
+        Returns a set of the supplied type URI and all of its supertype URIs, or an
+        empty set if the type URI is not used by any type definition.
+        """
+        return self._supertypes.get(type_uri, frozenset())
+
+    def subtype_ids(self, type_uri):
+        """
+        Returns a set of the ids of types whose type URI is the supplied type URI
+        or any of its subtypes.
+        """
+        return self._subtype_ids.get(type_uri, frozenset())
+
+    def subtype(self, type1_uri, type2_uri):
+        """
+        Returns True if the first type is the same as or a subtype of the second type.
+        """
+        return type1_uri == type2_uri or type2_uri in self.supertype_uris(type1_uri)
+
+def _build_type_graph(coll):
+    """
+    Returns a type graph for the type definitions that apply for a collection.
+    """
+    types = []
+    for type_id in coll._children(RecordType, altscope="all"):
+        t = coll.get_type(type_id)
+        if t:
+            (type_uri, supertype_uris) = type_uris(t)
+            types.append((type_id, type_uri, supertype_uris))
+    return TypeGraph(types)
+
+def get_type_graph(coll):
+    """
+    Returns a type graph for the indicated collection, which is computed when first
+    used, and discarded when a type definition (or other configuration entity) that
+    applies for the collection is changed.
+    """
+    return get_config_derived(coll, "type_graph", _build_type_graph)
+
+# End.
@@ -33,6 +33,7 @@ from annalist.models.recordfield    import RecordField
 from annalist.models.recordtypedata import RecordTypeData
 from annalist.models.entitydata     import EntityData
 from annalist.models.collectiondata import initialize_coll_data, copy_coll_data, migrate_coll_data
+from annalist.models.entitytombstone import wait_for_reaper
 
 from tests                          import TestHost, TestHostUri, TestBasePath, TestBaseUri, TestBaseDir
 from tests                          import test_layout
@@ -97,19 +98,14 @@ def copySitedata(src, sitedatasrc, tgt):
 
 def init_annalist_test_site():
     log.debug("init_annalist_test_site")
+    # Don't reset site data while tombstones from a previous test are being removed
+    wait_for_reaper()
     copySitedata(
         settings.SITE_SRC_ROOT+"/sampledata/testinit/"+test_layout.SITE_DIR, 
         settings.SITE_SRC_ROOT+"/annalist/data/sitedata",
         TestBaseDir)
     testsite = Site(TestBaseUri, TestBaseDir)
     testsite.generate_site_jsonld_context()
-    # Reset id generator counters
-    EntityData._last_id   = 0
-    RecordType._last_id   = 0
-    RecordView._last_id   = 0
-    RecordList._last_id   = 0
-    RecordField._last_id  = 0
-    AnnalistUser._last_id = 0
     return testsite
 
 def entitydata_create_values(coll, etype, entity_id, update="Entity"):
@@ -152,13 +148,6 @@ def init_annalist_test_coll(coll_id="testcoll", type_id="testtype"):
         entitydata_create_values(testcoll,testtype,"entity1")
         )
     testcoll.generate_coll_jsonld_context()
-    # Reset id generator counters
-    EntityData._last_id   = 0
-    RecordType._last_id   = 0
-    RecordView._last_id   = 0
-    RecordList._last_id   = 0
-    RecordField._last_id  = 0
-    AnnalistUser._last_id = 0
     return testcoll
 
 def create_test_coll_inheriting(
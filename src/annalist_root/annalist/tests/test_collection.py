@@ -8,6 +8,8 @@ __license__     = "MIT (http://opensource.org/licenses/MIT)"
 
 import os
 import json
+import threading
+import multiprocessing
 import unittest
 
 import logging
@@ -29,6 +31,26 @@ from annalist.models.site           import Site
 from annalist.models.collection     import Collection
 from annalist.models.annalistuser   import AnnalistUser
 from annalist.models.recordtype     import RecordType
+from annalist.models.recordtypedata import RecordTypeData
+from annalist.models.recordfield    import RecordField
+from annalist.models.entitydata     import EntityData
+from annalist.models.entityroot     import ENTITY_MIGRATION_VERSION
+from annalist.models.entitystorage  import get_entity_storage
+from annalist.models.collectiondata import copy_coll_data, migrate_coll_data
+from annalist.models.collectioncopy import CopyStats, _init_copy_process
+from annalist.models.collectionmigrate import _init_migrate_process
+from annalist.models.entitycache    import get_entity_cache
+from annalist.models.entity         import alt_parents_changed
+from annalist.models                import configcache
+from annalist.models                import collcontext
+from annalist.models                import entity
+from annalist.models                import entitystorage
+from annalist.models                import entityfinder
+from annalist.models                import entitymissing
+from annalist.models                import entitytombstone
+from annalist.models                import sitecollections
+from annalist.models                import sitesnapshot
+from annalist.models.configcache    import get_generation
 
 from annalist.views.collection      import CollectionEditView
 
@@ -56,6 +78,9 @@ from entity_testtypedata    import (
 from entity_testviewdata    import (
     recordview_create_values, recordview_read_values,
     )
+from entity_testfielddata   import (
+    recordfield_create_values,
+    )
 from entity_testlistdata    import (
     recordlist_create_values, recordlist_read_values,
     )
@@ -75,6 +100,36 @@ from entity_testcolldata    import (
     collectiondata_view_url
     )
 
+#   -----------------------------------------------------------------------------
+#
+#   Worker process helpers
+#
+#   -----------------------------------------------------------------------------
+
+def module_locks():
+    """
+    Returns the module-level locks used by the current process.
+    """
+    return (
+        [ entity._load_pool_lock
+        , entity._alt_memo_lock
+        , entitystorage._path_locks_lock
+        , get_entity_cache()._lock
+        , configcache._config_lock
+        , collcontext._context_lock
+        , entityfinder._selector_lock
+        , entitymissing._missing_lock
+        , entitytombstone._reaper_lock
+        , sitecollections._directory_lock
+        , sitesnapshot._snapshots_lock
+        ])
+
+def acquire_module_locks(_):
+    """
+    Try to acquire each module-level lock without waiting (in a worker process).
+    """
+    return [ l.acquire(False) for l in module_locks() ]
+
 #   -----------------------------------------------------------------------------
 #
 #   Collection object tests
@@ -93,6 +148,7 @@ class CollectionTest(AnnalistTestCase):
     def setUp(self):
         init_annalist_test_site()
         init_annalist_test_coll()
+        collcontext.discard_contexts()
         self.testsite     = Site(TestBaseUri, TestBaseDir)
         self.testcoll     = Collection(self.testsite, "testcoll")
         self.coll1        = collection_values("coll1")
@@ -380,6 +436,382 @@ class CollectionTest(AnnalistTestCase):
         self.assertEquals(testuser["rdfs:label"], "Test User")
         return
 
+    def test_alt_parent_memo_updated(self):
+        # Memoized alternative parents are refreshed when inheritance is changed
+        coll_id = "newcoll"
+        newcoll = Collection.create(self.testsite, coll_id, collection_create_values(coll_id))
+        parentids = [ p.get_id() for p in newcoll.get_alt_entities(altscope="all") ]
+        self.assertEqual(parentids, ["newcoll", layout.SITEDATA_ID])
+        self.assertFalse(RecordType.exists(newcoll, "testtype", altscope="all"))
+        newcoll.set_alt_entities(self.testcoll)
+        parentids = [ p.get_id() for p in newcoll.get_alt_entities(altscope="all") ]
+        self.assertEqual(parentids, ["newcoll", "testcoll", layout.SITEDATA_ID])
+        self.assertTrue(RecordType.exists(newcoll, "testtype", altscope="all"))
+        return
+
+    def test_alt_parent_memo_type_data(self):
+        # Memoized alternative type data parents are refreshed when type data is created
+        coll_id  = "newcoll"
+        newcoll  = Collection.create(self.testsite, coll_id, collection_create_values(coll_id))
+        newcoll.set_alt_entities(self.testcoll)
+        newdata  = RecordTypeData.create(newcoll, "newtype", {})
+        self.assertEqual([ p.get_id() for p in newdata.get_alt_entities(altscope="all") ], ["newtype"])
+        RecordTypeData.create(self.testcoll, "newtype", {})
+        self.assertEqual(
+            [ p._parent.get_id() for p in newdata.get_alt_entities(altscope="all") ],
+            ["newcoll", "testcoll"]
+            )
+        return
+
+    def test_alt_parent_memo_shared(self):
+        # Memoized alternative parents are shared by entity objects for a collection,
+        # and are not discarded by loading the collection or by changes to unrelated
+        # collections
+        coll_id = "newcoll"
+        newcoll = Collection.create(self.testsite, coll_id, collection_create_values(coll_id))
+        newcoll.set_alt_entities(self.testcoll)
+        newcoll._save()
+        altparents = newcoll.get_alt_entities(altscope="all")
+        parentids  = [ p.get_id() for p in altparents ]
+        self.assertEqual(parentids, ["newcoll", "testcoll", layout.SITEDATA_ID])
+        self.assertIn((newcoll._entitydir, "all"), entity._alt_memo)
+        samecoll = Collection.load(self.testsite, coll_id)
+        sameparents = samecoll.get_alt_entities(altscope="all")
+        self.assertIs(sameparents[0], samecoll)
+        self.assertIs(sameparents[1], altparents[1])
+        self.assertEqual([ p.get_id() for p in sameparents ], parentids)
+        # A collection object with different inheritance does not use the memoized list
+        barecoll = Collection(self.testsite, coll_id)
+        self.assertEqual(
+            [ p.get_id() for p in barecoll.get_alt_entities(altscope="all") ],
+            ["newcoll", layout.SITEDATA_ID]
+            )
+        samecoll = Collection.load(self.testsite, coll_id)
+        sameparents = samecoll.get_alt_entities(altscope="all")
+        self.assertEqual([ p.get_id() for p in sameparents ], parentids)
+        # Changes to other collections do not discard the memoized list
+        key = (samecoll._entitydir, "all")
+        tag = samecoll._alt_memo_tag(samecoll._alt_scope_dirs("all"))
+        othercoll = Collection.create(self.testsite, "othercoll", collection_create_values("othercoll"))
+        alt_parents_changed(othercoll)
+        self.assertIsNotNone(entity._alt_memo_get(key, tag))
+        alt_parents_changed(samecoll)
+        self.assertIsNone(entity._alt_memo_get(key, tag))
+        return
+
+    def test_config_cache(self):
+        # Configuration entities are cached, and cached values are refreshed on update
+        self.testcoll.add_view("view1", self.view1_add)
+        v1 = self.testcoll.get_view("view1")
+        v2 = Collection(self.testsite, "testcoll").get_view("view1")
+        self.assertIsNot(v1, v2)
+        self.assertEqual(v1.get_values(), v2.get_values())
+        self.assertEqual(v2.get_values(), self.view1)
+        v2[RDFS.CURIE.label] = "Updated label"
+        self.assertEqual(self.testcoll.get_view("view1")[RDFS.CURIE.label], self.view1[RDFS.CURIE.label])
+        v2._save()
+        self.assertEqual(self.testcoll.get_view("view1")[RDFS.CURIE.label], "Updated label")
+        self.testcoll.remove_view("view1")
+        self.assertEqual(self.testcoll.get_view("view1"), None)
+        # Site-wide definitions
+        f = self.testcoll.get_field_config("Entity_id")
+        self.assertEqual(f._parent.get_id(), layout.SITEDATA_ID)
+        self.assertEqual(self.testcoll.get_field_config("Entity_id").get_values(), f.get_values())
+        self.assertEqual(self.testcoll.get_group("no_such_group"), None)
+        return
+
+    def test_get_fields(self):
+        # Several field descriptions retrieved together, with and without cached entries
+        fids = ["Entity_id", "Entity_label", "no_such_field", "Entity_id"]
+        def values(fs):
+            return [ None if f is None else f.get_values() for f in fs ]
+        fs = self.testcoll.get_fields(fids)
+        self.assertEqual(values(fs), values([ self.testcoll.get_field_config(fid) for fid in fids ]))
+        self.assertEqual(values(self.testcoll.get_fields(fids)), values(fs))
+        fcontexts = self.testcoll.get_field_uri_jsonld_contexts(fids, Collection.get_field_jsonld_context)
+        self.assertEqual(sorted(fcontexts.keys()), sorted(set(fids)))
+        for fid in fids:
+            self.assertEqual(
+                fcontexts[fid],
+                self.testcoll.get_field_uri_jsonld_context(fid, Collection.get_field_jsonld_context)
+                )
+        self.assertEqual(fcontexts["no_such_field"], (None, None))
+        return
+
+    def test_config_generation(self):
+        gen = get_generation(self.testcoll)
+        self.testcoll.add_view("view1", self.view1_add)
+        self.assertEqual(get_generation(self.testcoll), gen+1)
+        self.testcoll.remove_view("view1")
+        self.assertEqual(get_generation(self.testcoll), gen+2)
+        return
+
+    def test_config_cache_external_update(self):
+        # Cached configuration entities are refreshed when the generation stamp is
+        # updated by another process (simulated here by updating files directly)
+        self.testcoll.add_view("view1", self.view1_add)
+        self.assertEqual(self.testcoll.get_view("view1").get_values(), self.view1)
+        view_file = os.path.join(
+            self.testcoll._entitydir, layout.COLL_VIEW_PATH%{'id': "view1"}, layout.VIEW_META_FILE
+            )
+        with open(view_file, "rt") as f:
+            body = f.read()
+        with open(view_file, "wt") as f:
+            f.write(body.replace(self.view1[RDFS.CURIE.label], "External update"))
+        testcoll = Collection(self.testsite, "testcoll")
+        self.assertEqual(testcoll.get_view("view1")[RDFS.CURIE.label], self.view1[RDFS.CURIE.label])
+        configcache._update_generation(self.testcoll)
+        testcoll = Collection(self.testsite, "testcoll")
+        self.assertEqual(testcoll.get_view("view1")[RDFS.CURIE.label], "External update")
+        return
+
+    def test_coll_context_incremental(self):
+        # Collection context is updated as contributing entities are changed, with
+        # the same result as building the context from scratch
+        def full_context():
+            collcontext.discard_contexts()
+            return Collection(self.testsite, "testcoll").get_coll_jsonld_context()
+        ctx = self.testcoll.get_coll_jsonld_context()
+        self.assertNotIn("rdfs:ctxprop", ctx)
+        self.assertEqual(ctx, full_context())
+        field_values = recordfield_create_values(field_id="ctxfield")
+        field_values[ANNAL.CURIE.property_uri] = "rdfs:ctxprop"
+        RecordField.create(self.testcoll, "ctxfield", field_values)
+        self.testcoll.add_view("view1",
+            recordview_create_values("testcoll", "view1", extra_field="ctxfield")
+            )
+        ctx = self.testcoll.get_coll_jsonld_context()
+        self.assertEqual(ctx["rdfs:ctxprop"], {"vid": "view1", "fid": "ctxfield"})
+        self.assertEqual(ctx, full_context())
+        # Update field
+        ctx = self.testcoll.get_coll_jsonld_context()
+        field_values[ANNAL.CURIE.field_render_type] = "Enum_render_type/URILink"
+        RecordField.create(self.testcoll, "ctxfield", field_values)
+        ctx = self.testcoll.get_coll_jsonld_context()
+        self.assertEqual(ctx["rdfs:ctxprop"], {"vid": "view1", "fid": "ctxfield", "@type": "@id"})
+        self.assertEqual(ctx, full_context())
+        # Remove view
+        ctx = self.testcoll.get_coll_jsonld_context()
+        self.testcoll.remove_view("view1")
+        ctx = self.testcoll.get_coll_jsonld_context()
+        self.assertNotIn("rdfs:ctxprop", ctx)
+        self.assertEqual(ctx, full_context())
+        return
+
+    def test_coll_context_parent_update(self):
+        # Collection context is rebuilt when an alternative parent is updated by another
+        # process (simulated here by updating files directly), even if a local change
+        # has been made since the context was recorded.  (Stamps are read once for each
+        # collection object, so a new collection object is used after the update.)
+        self.testcoll.add_view("view1",
+            recordview_create_values("testcoll", "view1", extra_field="Entity_see_also", extra_field_uri="rdfs:ctxprop")
+            )
+        newcoll = Collection.create(self.testsite, "newcoll", collection_create_values("newcoll"))
+        newcoll.set_alt_entities(self.testcoll)
+        newcoll._save()
+        ctx = newcoll.get_coll_jsonld_context()
+        self.assertIn("rdfs:ctxprop", ctx)
+        collcontext.context_entity_changed(newcoll, layout.VIEW_TYPEID, "view2")
+        view_file = os.path.join(
+            self.testcoll._entitydir, layout.COLL_VIEW_PATH%{'id': "view1"}, layout.VIEW_META_FILE
+            )
+        with open(view_file, "rt") as f:
+            body = f.read()
+        with open(view_file, "wt") as f:
+            f.write(body.replace("rdfs:ctxprop", "rdfs:extprop"))
+        configcache._update_generation(self.testcoll)
+        configcache._update_generation(newcoll)
+        newcoll = Collection.load(self.testsite, "newcoll")
+        ctx = newcoll.get_coll_jsonld_context()
+        self.assertNotIn("rdfs:ctxprop", ctx)
+        self.assertIn("rdfs:extprop", ctx)
+        self.testcoll.remove_view("view1")
+        return
+
+    def test_coll_context_unchanged_not_written(self):
+        (coll_dir, _) = self.testcoll._dir_path()
+        context_file  = os.path.join(coll_dir, layout.COLL_CONTEXT_FILE)
+        self.testcoll.generate_coll_jsonld_context()
+        with open(context_file, "rt") as f:
+            body = f.read()
+        with open(context_file, "wt") as f:
+            f.write(body.replace("Generated by", "Not rewritten:"))
+        # Update that does not affect context: file is not rewritten
+        self.testcoll.add_view("view1", self.view1_add)
+        with open(context_file, "rt") as f:
+            self.assertIn("Not rewritten:", f.read())
+        # Update that affects context: file is rewritten
+        self.testcoll.add_view("view2",
+            recordview_create_values("testcoll", "view2", extra_field="Entity_see_also", extra_field_uri="rdfs:ctxprop")
+            )
+        with open(context_file, "rt") as f:
+            body = f.read()
+        self.assertNotIn("Not rewritten:", body)
+        self.assertIn("rdfs:ctxprop", body)
+        return
+
+    def test_batch_updates_context(self):
+        # Collection context is regenerated once, when the batch of updates is completed
+        (coll_dir, _) = self.testcoll._dir_path()
+        context_file  = os.path.join(coll_dir, layout.COLL_CONTEXT_FILE)
+        os.remove(context_file)
+        with self.testcoll.batch_updates():
+            self.testcoll.add_view("view1", self.view1_add)
+            self.testcoll.add_view("view2", self.view2_add)
+            self.assertFalse(os.path.exists(context_file))
+        self.assertTrue(os.path.exists(context_file))
+        self.assertEqual(self.testcoll.get_view("view2").get_values(), self.view2)
+        return
+
+    def test_batch_updates_exception(self):
+        # Generation stamp and context are updated when a batch of updates is
+        # interrupted by an exception after an entity has been saved
+        (coll_dir, _) = self.testcoll._dir_path()
+        context_file  = os.path.join(coll_dir, layout.COLL_CONTEXT_FILE)
+        os.remove(context_file)
+        gen = get_generation(self.testcoll)
+        with self.assertRaises(ValueError):
+            with self.testcoll.batch_updates():
+                self.testcoll.add_view("view1", self.view1_add)
+                raise ValueError("batch interrupted")
+        self.assertEqual(get_generation(self.testcoll), gen+1)
+        self.assertTrue(os.path.exists(context_file))
+        return
+
+    def test_copy_coll_data(self):
+        typedata = RecordTypeData.load(self.testcoll, "testtype")
+        for i in range(60):
+            EntityData.create(typedata, "copy%02d"%i, {"rdfs:label": "Copy entity %d"%i})
+        entity1  = EntityData.load(typedata, "entity1")
+        src_file = os.path.join(entity1._entitydir, "resource.txt")
+        with open(src_file, "w") as f:
+            f.write("resource data")
+        copycoll = Collection.create(self.testsite, "copycoll", collection_create_values("copycoll"))
+        stats    = CopyStats()
+        msgs     = copy_coll_data(self.testcoll, copycoll, stats=stats)
+        self.assertEqual(msgs, [])
+        self.assertEqual(stats.files, 1)
+        self.assertEqual(stats.bytes, len("resource data"))
+        self.assertGreaterEqual(stats.entities, 62)
+        self.assertTrue(RecordType.exists(copycoll, "testtype"))
+        copydata = RecordTypeData.load(copycoll, "testtype")
+        self.assertEqual(EntityData.load(copydata, "copy59")["rdfs:label"], "Copy entity 59")
+        copy1    = EntityData.load(copydata, "entity1")
+        self.assertEqual(copy1.get_values()["rdfs:label"], entity1.get_values()["rdfs:label"])
+        tgt_file = os.path.join(copy1._entitydir, "resource.txt")
+        with open(tgt_file) as f:
+            self.assertEqual(f.read(), "resource data")
+        # Updating the copied file does not affect the original
+        with get_entity_storage().open(tgt_file, "wt") as f:
+            f.write("updated data")
+        with open(src_file) as f:
+            self.assertEqual(f.read(), "resource data")
+        return
+
+    def check_worker_locks(self, initializer):
+        # Locks held by other threads when a worker process is forked are not
+        # held in the worker process
+        locks    = module_locks()
+        held     = threading.Event()
+        release  = threading.Event()
+        def hold_locks():
+            for l in locks:
+                l.acquire()
+            held.set()
+            release.wait()
+            for l in locks:
+                l.release()
+            return
+        holder = threading.Thread(target=hold_locks)
+        holder.start()
+        held.wait()
+        try:
+            pool = multiprocessing.Pool(1, initializer=initializer)
+            try:
+                acquired = pool.map_async(acquire_module_locks, [0]).get(timeout=30)
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            release.set()
+            holder.join()
+        self.assertEqual(acquired, [[True]*len(locks)])
+        return
+
+    def test_copy_process_locks(self):
+        self.check_worker_locks(_init_copy_process)
+        return
+
+    def test_copy_coll_data_after_load_many(self):
+        # Copy worker processes are forked after entity load and reaper threads start
+        typedata = RecordTypeData.load(self.testcoll, "testtype")
+        for i in range(20):
+            EntityData.create(typedata, "copy%02d"%i, {"rdfs:label": "Copy entity %d"%i})
+        entities = EntityData.load_many(typedata, ["copy%02d"%i for i in range(20)])
+        self.assertEqual(entities[19]["rdfs:label"], "Copy entity 19")
+        EntityData.remove(typedata, "copy19")
+        forkcoll = Collection.create(self.testsite, "forkcoll", collection_create_values("forkcoll"))
+        self.addCleanup(self.testsite.remove_collection, "forkcoll")
+        self.assertEqual(copy_coll_data(self.testcoll, forkcoll), [])
+        copydata = RecordTypeData.load(forkcoll, "testtype")
+        self.assertEqual(EntityData.load(copydata, "copy18")["rdfs:label"], "Copy entity 18")
+        self.assertFalse(EntityData.exists(copydata, "copy19"))
+        return
+
+    def test_migrate_process_locks(self):
+        self.check_worker_locks(_init_migrate_process)
+        return
+
+    def test_migrate_coll_data_after_load_many(self):
+        # Migrate worker processes are forked after entity load and reaper threads start
+        typedata  = RecordTypeData.load(self.testcoll, "testtype")
+        body_path = {}
+        for i in range(20):
+            e = EntityData.create(typedata, "migr%02d"%i, {"rdfs:label": "Migrate entity %d"%i})
+            body_path[i] = os.path.join(e._entitydir, EntityData._entityfile)
+        entities = EntityData.load_many(typedata, ["migr%02d"%i for i in range(20)])
+        self.assertEqual(entities[19]["rdfs:label"], "Migrate entity 19")
+        EntityData.remove(typedata, "migr19")
+        for i in range(19):
+            with open(body_path[i], "w") as f:
+                f.write(json.dumps({"rdfs:label": "Migrate entity %d"%i}))
+        testcoll = Collection.load(self.testsite, "testcoll")
+        self.assertEqual(migrate_coll_data(testcoll, processes=2), [])
+        for i in range(19):
+            with open(body_path[i]) as f:
+                values = json.load(f)
+            self.assertEqual(values[ANNAL.CURIE.migration_version], ENTITY_MIGRATION_VERSION)
+        return
+
+    def test_migrate_coll_data_resume(self):
+        # Entities recorded as migrated by an interrupted migration are skipped, but
+        # not other entities (e.g. migr15, created after the migration was interrupted)
+        typedata  = RecordTypeData.load(self.testcoll, "testtype")
+        body_path = {}
+        for i in range(60):
+            e = EntityData.create(typedata, "migr%02d"%i, {"rdfs:label": "Migrate entity %d"%i})
+            body_path[i] = os.path.join(e._entitydir, EntityData._entityfile)
+            with open(body_path[i], "w") as f:
+                f.write(json.dumps({"rdfs:label": "Migrate entity %d"%i}))
+        (meta_dir, _) = self.testcoll._dir_path()
+        marker_path   = os.path.join(meta_dir, layout.COLL_MIGRATE_FILE)
+        with open(marker_path, "w") as f:
+            f.write(json.dumps(
+                { "migration_version": ENTITY_MIGRATION_VERSION
+                , "migrated_ids": { "testtype": ["migr%02d"%i for i in range(30) if i != 15] }
+                }))
+        testcoll = Collection.load(self.testsite, "testcoll")
+        self.assertEqual(migrate_coll_data(testcoll, processes=2), [])
+        self.assertFalse(os.path.exists(marker_path))
+        for i in range(60):
+            with open(body_path[i]) as f:
+                values = json.load(f)
+            self.assertEqual(ANNAL.CURIE.migration_version in values, i >= 30 or i == 15)
+        self.assertEqual(
+            EntityData.load(typedata, "migr45")["rdfs:label"], "Migrate entity 45"
+            )
+        return
+
 #   -----------------------------------------------------------------------------
 #
 #   CollectionEditView tests
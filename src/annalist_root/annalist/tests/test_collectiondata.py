@@ -33,6 +33,7 @@ from annalist.util                          import valid_id
 from annalist.models.site                   import Site
 from annalist.models.sitedata               import SiteData
 from annalist.models.collection             import Collection
+from annalist.models.entityroot             import ENTITY_MIGRATION_VERSION
 # from annalist.models.annalistuser           import AnnalistUser
 
 # from annalist.views.annalistuserdelete      import AnnalistUserDeleteConfirmedView
@@ -318,6 +319,7 @@ class CollectionDataEditViewTest(AnnalistTestCase):
             , "rdfs:label":             "Collection testcoll"
             , "rdfs:comment":           "Description of Collection testcoll"
             , "annal:software_version": annalist.__version_data__
+            , "annal:migration_version": ENTITY_MIGRATION_VERSION
             })
         self.assertEqual(colldata, expected)
         return
@@ -380,6 +382,7 @@ class CollectionDataEditViewTest(AnnalistTestCase):
             , "rdfs:label":             "Collection testcoll"
             , "rdfs:comment":           "Description of Collection testcoll"
             , "annal:software_version": annalist.__version_data__
+            , "annal:migration_version": ENTITY_MIGRATION_VERSION
             })
         self.assertEqual(colldata, expected)
         return
@@ -7,6 +7,14 @@ __copyright__   = "Copyright 2014, G. Klyne"
 __license__     = "MIT (http://opensource.org/licenses/MIT)"
 
 import os
+import ast
+import json
+import shutil
+import time
+import hashlib
+import inspect
+import textwrap
+import threading
 import unittest
 
 import logging
@@ -19,11 +27,64 @@ from django.test.client         import Client
 
 from annalist.identifiers       import ANNAL
 from annalist.models.entity     import EntityRoot, Entity
+from annalist.models.entityroot import ENTITY_MIGRATION_VERSION
+from annalist.models.entityidcounter import EntityIdCounter, COPY_KEYS_MAX
+from annalist.models                import entitymissing
+from annalist.models                import entitytombstone
+from annalist.models.entitytombstone import (
+    tombstone_name, is_tombstone, wait_for_reaper, reap_tombstone, reap_tombstones
+    )
 
 from AnnalistTestCase       import AnnalistTestCase
 from tests                  import TestHost, TestHostUri, TestBasePath, TestBaseUri, TestBaseDir
 from init_tests             import init_annalist_test_site, init_annalist_test_coll, resetSitedata
 
+#   Digests of entity data format migration methods (see `migration_digest`) for each
+#   value of ENTITY_MIGRATION_VERSION.  When a migration is added or changed, the
+#   migration version must be changed, and the new digest recorded here.
+MIGRATION_DIGESTS = (
+    { "1":  "5854c729d3705c409caa251ad684db5b8574f78b"
+    })
+
+def migration_classes():
+    """
+    Returns a list of the entity classes that define entity data format migrations.
+    """
+    # Import modules for all entity classes with migrations
+    from annalist.models.collection     import Collection
+    from annalist.models.annalistuser   import AnnalistUser
+    from annalist.models.recordtype     import RecordType
+    from annalist.models.recordlist     import RecordList
+    from annalist.models.recordview     import RecordView
+    from annalist.models.recordgroup    import RecordGroup
+    from annalist.models.recordfield    import RecordField
+    from annalist.models.recordvocab    import RecordVocab
+    classes = []
+    pending = [EntityRoot]
+    while pending:
+        cls = pending.pop()
+        if "annalist.models." in cls.__module__:
+            classes.append(cls)
+        pending.extend(cls.__subclasses__())
+    return classes
+
+def migration_digest(classes):
+    """
+    Returns a digest of the migration methods (`_migrate_values` and its helpers)
+    defined by the supplied classes, which changes when the code of any of these
+    methods is changed (but not their docstrings or comments).
+    """
+    dumps = []
+    for cls in classes:
+        for name in sorted(cls.__dict__):
+            if name.startswith("_migrate_values"):
+                src  = textwrap.dedent(inspect.getsource(cls.__dict__[name]))
+                func = ast.parse(src).body[0]
+                if func.body and isinstance(func.body[0], ast.Expr) and isinstance(func.body[0].value, ast.Str):
+                    func.body = func.body[1:]
+                dumps.append("%s.%s: %s"%(cls.__name__, name, ast.dump(func)))
+    return hashlib.sha1("\n".join(sorted(set(dumps)))).hexdigest()
+
 #   -----------------------------------------------------------------------------
 #
 #   EntityRoot tests
@@ -185,6 +246,7 @@ class EntityRootTest(TestCase):
             , 'annal:type_id':  None
             , 'annal:type':     'test:EntityRootType'
             , 'annal:url':      TestBasePath+'/'
+            , 'annal:migration_version': ENTITY_MIGRATION_VERSION
             , 'title':          'Name collection coll1'
             , 'type':           'annal:EntityRoot'
             })
@@ -206,6 +268,24 @@ class EntityRootTest(TestCase):
         self.assertEqual(v2, test_values_returned)
         return
 
+    def test_entityroot_migration_version(self):
+        # Changing an entity data format migration requires a new migration version
+        digest = migration_digest(migration_classes())
+        self.assertEqual(MIGRATION_DIGESTS.get(ENTITY_MIGRATION_VERSION), digest,
+            "Entity data format migrations have changed: change ENTITY_MIGRATION_VERSION "+
+            "and record the new migration digest %s in MIGRATION_DIGESTS"%(digest,)
+            )
+        self.assertEqual(len(set(MIGRATION_DIGESTS.values())), len(MIGRATION_DIGESTS))
+        # A migration method of a subclass is included in the digest
+        class TestEntityMigrated(TestEntityRootType):
+            def _migrate_values(self, entitydata):
+                entitydata["title"] = entitydata.pop("name", None)
+                return entitydata
+        self.assertNotEqual(
+            migration_digest(migration_classes() + [TestEntityMigrated]), digest
+            )
+        return
+
     def test_entityroot_exists(self):
         test_values = (
             { 'type':   'annal:EntityRoot'
@@ -297,9 +377,11 @@ class EntityTest(AnnalistTestCase):
 
     def setUp(self):
         init_annalist_test_site()
+        self._remove_id_counters()
         return
 
     def tearDown(self):
+        self._remove_id_counters()
         return
 
     @classmethod
@@ -307,6 +389,15 @@ class EntityTest(AnnalistTestCase):
         resetSitedata()
         return
 
+    def _remove_id_counters(self):
+        # Test entities are stored directly in the test site directory, so their
+        # identifier counter file is outside the test site data
+        for d in [TestBaseDir, os.path.join(TestBaseDir, "sub")]:
+            p = EntityIdCounter(d)._counterpath
+            if os.path.exists(p):
+                os.remove(p)
+        return
+
     #   ----------------------------------------
     #
     #   Helpers
@@ -503,6 +594,73 @@ class EntityTest(AnnalistTestCase):
         self.assertFalse(TestEntityType.exists(r, "testid3"))
         return
 
+    def test_entity_remove_tombstone(self):
+        test_values = self.values_created(entity_type='test:EntityType', entity_title='Name entity test')
+        r = EntityRoot(TestBaseUri, TestBaseUri, TestBaseDir, TestBaseDir)
+        e = TestEntityType.create(r, "testid4", test_values)
+        # Tombstones are not enumerated as entities
+        tomb = os.path.join(TestBaseDir, tombstone_name("testid5"))
+        os.makedirs(tomb)
+        self.assertNotIn(os.path.basename(tomb), list(r._children(TestEntityType)))
+        # Removed entity is renamed to a tombstone, and removed in the background
+        s = TestEntityType.remove(r, "testid4")
+        self.assertFalse(TestEntityType.exists(r, "testid4"))
+        wait_for_reaper()
+        self.assertEqual(
+            [ t for t in os.listdir(TestBaseDir) if is_tombstone(t) ],
+            [ os.path.basename(tomb) ]
+            )
+        # Remaining tombstones are removed on request
+        self.assertEqual(reap_tombstones(TestBaseDir), [tomb])
+        self.assertFalse(os.path.exists(tomb))
+        return
+
+    def test_entity_reap_tombstones_containers(self):
+        # Tombstones are found only in directories that contain entity directories
+        type_dir  = os.path.join(TestBaseDir, "c", "testcoll", "d", "testtype")
+        tomb      = os.path.join(type_dir, tombstone_name("entity1"))
+        tomb_skip = os.path.join(type_dir, "entity2", tombstone_name("attachment"))
+        os.makedirs(tomb)
+        os.makedirs(tomb_skip)
+        try:
+            self.assertEqual(reap_tombstones(TestBaseDir), [tomb])
+            self.assertFalse(os.path.exists(tomb))
+            self.assertTrue(os.path.exists(tomb_skip))
+        finally:
+            shutil.rmtree(os.path.join(type_dir, "entity2"))
+        return
+
+    def test_entity_reap_tombstone_removed(self):
+        # A tombstone that has already been removed is ignored without a warning
+        warnings = []
+        handler  = logging.Handler(logging.WARNING)
+        handler.emit = warnings.append
+        tomb_log = logging.getLogger(entitytombstone.__name__)
+        tomb_log.addHandler(handler)
+        try:
+            reap_tombstone(os.path.join(TestBaseDir, tombstone_name("testid6")))
+        finally:
+            tomb_log.removeHandler(handler)
+        self.assertEqual(warnings, [])
+        return
+
+    def test_entity_reaper_restarted(self):
+        # The reaper is started again if its thread is not running (e.g. in a
+        # process forked by a process in which the reaper was started)
+        test_values = self.values_created(entity_type='test:EntityType', entity_title='Name entity test')
+        r = EntityRoot(TestBaseUri, TestBaseUri, TestBaseDir, TestBaseDir)
+        e = TestEntityType.create(r, "testid7", test_values)
+        stopped = threading.Thread(target=lambda: None)
+        stopped.start()
+        stopped.join()
+        entitytombstone._reaper_thread = stopped
+        TestEntityType.remove(r, "testid7")
+        self.assertIsNot(entitytombstone._reaper_thread, stopped)
+        self.assertTrue(entitytombstone._reaper_thread.is_alive())
+        wait_for_reaper()
+        self.assertEqual([ t for t in os.listdir(TestBaseDir) if is_tombstone(t) ], [])
+        return
+
     # The following tests repeat the above using an entity class with 
     # an explcit relative path from parent to entity.
 
@@ -574,4 +732,87 @@ class EntityTest(AnnalistTestCase):
         self.assertEqual(eid, "00000003")
         return
 
+    def test_entity_allocate_id_persistent(self):
+        test_values = self.values_created(entity_type='test:EntityTypeSub', entity_title='Name entity test')
+        r = EntityRoot(TestBaseUri, TestBaseUri, TestBaseDir, TestBaseDir)
+        # Without a counter file, highest sequence number in use is found by scanning
+        TestEntityTypeSub.create(r, "00000005", test_values)
+        TestEntityTypeSub.create(r, "testid1", test_values)
+        TestEntityTypeSub.create(r, "testid1_03", test_values)
+        self.assertEqual(TestEntityTypeSub.allocate_new_id(r), "00000006")
+        self.assertEqual(TestEntityTypeSub.allocate_new_id(r), "00000007")
+        self.assertEqual(TestEntityTypeSub.allocate_new_id(r, base_id="testid1"), "testid1_04")
+        self.assertEqual(TestEntityTypeSub.allocate_new_id(r, base_id="testid1"), "testid1_05")
+        # Allocation continues from the counter file, not the directory content
+        TestEntityTypeSub.remove(r, "00000005")
+        self.assertEqual(TestEntityTypeSub.allocate_new_id(r), "00000008")
+        # Existing entity is skipped
+        TestEntityTypeSub.create(r, "00000009", test_values)
+        self.assertEqual(TestEntityTypeSub.allocate_new_id(r), "00000010")
+        return
+
+    def test_entity_allocate_id_copies_pruned(self):
+        r = EntityRoot(TestBaseUri, TestBaseUri, TestBaseDir, TestBaseDir)
+        for i in range(COPY_KEYS_MAX+10):
+            TestEntityTypeSub.allocate_new_id(r, base_id="testid%d"%i)
+        self.assertEqual(TestEntityTypeSub.allocate_new_id(r, base_id="testid0"), "testid0_01")
+        self.assertEqual(TestEntityTypeSub.allocate_new_id(r), "00000001")
+        # Only the most recently used copy counters are kept
+        counterpath = EntityIdCounter(os.path.join(TestBaseDir, "sub"))._counterpath
+        with open(counterpath, "r") as f:
+            counters = json.load(f)
+        self.assertEqual(counters["sequence"], 1)
+        self.assertEqual(len(counters["copies"]), COPY_KEYS_MAX)
+        self.assertEqual(counters["copies"][-1], ["testid0", 1])
+        # A discarded copy counter is recovered by scanning the directory
+        TestEntityTypeSub.create(r, "testid1_01", self.values_created())
+        self.assertEqual(TestEntityTypeSub.allocate_new_id(r, base_id="testid1"), "testid1_02")
+        return
+
+    def test_entity_missing_cached(self):
+        test_values = self.values_created(entity_type='test:EntityTypeSub', entity_title='Name entity test')
+        r = EntityRoot(TestBaseUri, TestBaseUri, TestBaseDir, TestBaseDir)
+        TestEntityTypeSub.create(r, "testid1", test_values)
+        subdir = os.path.normpath(os.path.join(TestBaseDir, "sub"))
+        # Absences are not recorded for a recently modified directory
+        self.assertFalse(TestEntityTypeSub.exists(r, "testid2"))
+        self.assertNotIn(subdir, entitymissing._missing)
+        t = time.time() - 60
+        os.utime(subdir, (t, t))
+        self.assertFalse(TestEntityTypeSub.exists(r, "testid2"))
+        self.assertIn("testid2", entitymissing._missing[subdir][2])
+        self.assertFalse(TestEntityTypeSub.exists(r, "testid2"))
+        # Creating the entity updates the directory, so the recorded absence is not used
+        TestEntityTypeSub.create(r, "testid2", test_values)
+        self.assertTrue(TestEntityTypeSub.exists(r, "testid2"))
+        self.assertEqual(TestEntityTypeSub.load(r, "testid2").get_id(), "testid2")
+        return
+
+    def test_entity_missing_evicted(self):
+        test_values = self.values_created(entity_type='test:EntityTypeSub', entity_title='Name entity test')
+        r = EntityRoot(TestBaseUri, TestBaseUri, TestBaseDir, TestBaseDir)
+        TestEntityTypeSub.create(r, "evictid1", test_values)
+        subdir = os.path.normpath(os.path.join(TestBaseDir, "sub"))
+        t = time.time() - 60
+        os.utime(subdir, (t, t))
+        entitymissing.discard_missing()
+        now = time.time()
+        entitymissing._missing["/expired"] = (now - entitymissing.MISSING_INTERVAL - 1, None, set(["x"]))
+        entitymissing._missing["/recent"]  = (now, None, set(["x"]))
+        # Expired entries are evicted when a new entry is recorded
+        self.assertFalse(TestEntityTypeSub.exists(r, "evictid2"))
+        self.assertEqual(list(entitymissing._missing), ["/recent", subdir])
+        # Oldest entries are evicted to keep within the limit
+        save_max = entitymissing.MISSING_DIRS_MAX
+        try:
+            entitymissing.MISSING_DIRS_MAX = 2
+            del entitymissing._missing[subdir]
+            entitymissing._missing["/recent2"] = (now, None, set(["x"]))
+            self.assertFalse(TestEntityTypeSub.exists(r, "evictid2"))
+            self.assertEqual(list(entitymissing._missing), ["/recent2", subdir])
+        finally:
+            entitymissing.MISSING_DIRS_MAX = save_max
+            entitymissing.discard_missing()
+        return
+
 # End.
@@ -213,6 +213,40 @@ class SubtypeSelectionTest(AnnalistTestCase):
         self._check_entity_list("testtypes", expect_entities)
         return
 
+    def test_list_types_indirect(self):
+        # Subtype of a subtype, created after the type hierarchy has been used
+        self._check_entity_list("testtypes", 
+            [ ("testtype1", "entity1") 
+            , ("testtype2", "entity2") 
+            , ("testtypes", "entitys") 
+            ])
+        testtype11 = RecordType.create(
+            self.testcoll, "testtype11",
+            recordtype_create_values(
+                coll_id="testcoll", type_id="testtype11", type_uri="test:testtype11", 
+                supertype_uris=["test:testtype1"]
+                )
+            )
+        testdata11 = RecordTypeData.create(self.testcoll, "testtype11", {})
+        self.addCleanup(RecordType.remove, self.testcoll, "testtype11")
+        self.addCleanup(RecordTypeData.remove, self.testcoll, "testtype11")
+        e11 = EntityData.create(testdata11, "entity11", 
+            entitydata_create_values(
+                "entity11", type_id="testtype11", extra_fields={"test:turi": "test:testtype11"} 
+                )
+            )
+        self._check_entity_list("testtypes", 
+            [ ("testtype1",  "entity1") 
+            , ("testtype11", "entity11") 
+            , ("testtype2",  "entity2") 
+            , ("testtypes",  "entitys") 
+            ])
+        self._check_entity_list("testtype1", 
+            [ ("testtype1",  "entity1") 
+            , ("testtype11", "entity11") 
+            ])
+        return
+
     def test_select_subtypes(self):
         ref_view  = self._create_ref_type_view()
         ref_field = self._create_ref_type_field()
@@ -0,0 +1,140 @@
+"""
+Tests for entity values cache
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os
+import time
+import unittest
+
+import logging
+log = logging.getLogger(__name__)
+
+from django.conf                    import settings
+from django.test                    import TestCase # cf. https://docs.djangoproject.com/en/dev/topics/testing/tools/#assertions
+
+from annalist.identifiers           import RDF, RDFS, ANNAL
+from annalist.models.entitycache    import EntityCache, get_entity_cache
+from annalist.models.site           import Site
+from annalist.models.collection     import Collection
+from annalist.models.recordtypedata import RecordTypeData
+from annalist.models.entitydata     import EntityData
+
+from AnnalistTestCase       import AnnalistTestCase
+from tests                  import TestHost, TestHostUri, TestBasePath, TestBaseUri, TestBaseDir
+from init_tests             import init_annalist_test_site, init_annalist_test_coll, resetSitedata
+
+#   -----------------------------------------------------------------------------
+#
+#   Entity cache tests
+#
+#   -----------------------------------------------------------------------------
+
+class EntityCacheTest(AnnalistTestCase):
+    """
+    Tests for entity cache
+    """
+
+    def setUp(self):
+        init_annalist_test_site()
+        init_annalist_test_coll()
+        self.testsite = Site(TestBaseUri, TestBaseDir)
+        self.testcoll = Collection(self.testsite, "testcoll")
+        self.testdata = RecordTypeData(self.testcoll, "testtype")
+        self.cache    = get_entity_cache()
+        self.cache.clear()
+        # Backdate entity body so it is eligible for caching
+        self.body     = EntityData.path(self.testdata, "entity1")
+        t = time.time() - 60
+        os.utime(self.body, (t, t))
+        return
+
+    def tearDown(self):
+        return
+
+    @classmethod
+    def tearDownClass(cls):
+        resetSitedata()
+        return
+
+    def test_cache_hit(self):
+        e1 = EntityData.load(self.testdata, "entity1")
+        self.assertEqual(self.cache.stats()['misses'], 1)
+        self.assertEqual(self.cache.stats()['entries'], 1)
+        e2 = EntityData.load(self.testdata, "entity1")
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(e1.get_values(), e2.get_values())
+        return
+
+    def test_cache_values_copied(self):
+        e1 = EntityData.load(self.testdata, "entity1")
+        e1[RDFS.CURIE.label] = "updated label"
+        e2 = EntityData.load(self.testdata, "entity1")
+        self.assertEqual(e2[RDFS.CURIE.label], "Entity testcoll/testtype/entity1")
+        return
+
+    def test_cache_external_update(self):
+        e1 = EntityData.load(self.testdata, "entity1")
+        with open(self.body, "rt") as f:
+            body = f.read()
+        with open(self.body, "wt") as f:
+            f.write(body.replace("Entity testcoll/testtype/entity1", "External update"))
+        t = time.time() - 30
+        os.utime(self.body, (t, t))
+        e2 = EntityData.load(self.testdata, "entity1")
+        self.assertEqual(e2[RDFS.CURIE.label], "External update")
+        self.assertEqual(self.cache.stats()['hits'], 0)
+        return
+
+    def test_cache_save_remove(self):
+        e1 = EntityData.load(self.testdata, "entity1")
+        e1[RDFS.CURIE.label] = "updated label"
+        e1._save()
+        e2 = EntityData.load(self.testdata, "entity1")
+        self.assertEqual(e2[RDFS.CURIE.label], "updated label")
+        EntityData.remove(self.testdata, "entity1")
+        self.assertEqual(EntityData.load(self.testdata, "entity1"), None)
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        return
+
+    def test_cache_size_bound(self):
+        cache = EntityCache(100)
+        def loader(size, val):
+            return lambda: (size, {"v": val})
+        self.assertEqual(cache.get_values(EntityData, self.body, loader(60, 1)), {"v": 1})
+        self.assertEqual(cache.get_values(EntityData, self.body+"x", loader(60, 2)), {"v": 2})
+        self.assertEqual(cache.get_values(EntityData, self.body, loader(60, 3)), {"v": 1})
+        t = time.time() - 60
+        os.utime(self.testdata._entitydir, (t, t))
+        cache.get_values(EntityData, self.testdata._entitydir, loader(60, 4))
+        stats = cache.stats()
+        self.assertEqual(stats['entries'],   1)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['size'],      60)
+        return
+
+    def test_cache_invalidate_dir(self):
+        cache = EntityCache(1000)
+        def loader(val):
+            return lambda: (10, {"v": val})
+        self.assertEqual(cache.get_values(EntityData, self.body, loader(1)), {"v": 1})
+        cache.invalidate(self.body+"x")
+        cache.invalidate_dir(self.testdata._entitydir+"x")
+        self.assertEqual(cache.get_values(EntityData, self.body, loader(2)), {"v": 1})
+        # Values read before a containing directory was invalidated are discarded
+        cache.invalidate_dir(self.testcoll._entitydir)
+        self.assertEqual(cache.get_values(EntityData, self.body, loader(3)), {"v": 3})
+        self.assertEqual(cache.get_values(EntityData, self.body, loader(4)), {"v": 3})
+        cache.invalidate_dir(self.testdata._entitydir)
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertEqual(cache._dir_gens, {})
+        cache.get_values(EntityData, self.body, loader(5))
+        cache.invalidate(self.body)
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertEqual(cache._paths, {})
+        return
+
+# End.
@@ -7,6 +7,7 @@ __copyright__   = "Copyright 2014, G. Klyne"
 __license__     = "MIT (http://opensource.org/licenses/MIT)"
 
 import os
+import json
 import unittest
 
 import logging
@@ -14,6 +15,7 @@ log = logging.getLogger(__name__)
 
 from django.conf                    import settings
 from django.test                    import TestCase # cf. https://docs.djangoproject.com/en/dev/topics/testing/tools/#assertions
+from django.test.utils              import override_settings
 
 from annalist.identifiers           import RDF, RDFS, ANNAL
 from annalist                       import layout
@@ -24,6 +26,9 @@ from annalist.models.collection     import Collection
 from annalist.models.recordtype     import RecordType
 from annalist.models.recordtypedata import RecordTypeData
 from annalist.models.entitydata     import EntityData
+from annalist.models.entitytypeinfo import EntityTypeInfo
+from annalist.models.entityfinder   import EntityFinder
+from annalist.models.searchindex    import get_search_index
 
 from AnnalistTestCase       import AnnalistTestCase
 from tests                  import TestHost, TestHostUri, TestBasePath, TestBaseUri, TestBaseDir
@@ -105,6 +110,214 @@ class EntityDataTest(AnnalistTestCase):
         self.assertDictionaryMatch(ed, v)
         return
 
+    def test_entitydata_load_many(self):
+        for i in ("entitydata1", "entitydata2", "entitydata3"):
+            EntityData.create(self.testdata, i, entitydata_create_values(i))
+        ids = ["entitydata3", "nosuchentity", "entitydata1", "entitydata2", "!invalid"]
+        es  = EntityData.load_many(self.testdata, ids)
+        self.assertEqual(len(es), 5)
+        self.assertEqual([ e and e.get_id() for e in es ], 
+            ["entitydata3", None, "entitydata1", "entitydata2", None]
+            )
+        for e in es:
+            if e:
+                ed = EntityData.load(self.testdata, e.get_id()).get_values()
+                self.assertDictionaryMatch(e.get_values(), ed)
+        return
+
+    def test_entitydata_get_entities(self):
+        init_annalist_test_coll()
+        EntityData.create(self.testdata, "entitydata1", entitydata_create_values("entitydata1"))
+        typeinfo = EntityTypeInfo(self.testcoll, "testtype")
+        es = typeinfo.get_entities(["entitydata1", "nosuchentity"])
+        self.assertEqual(es[0].get_values(), typeinfo.get_entity("entitydata1").get_values())
+        self.assertEqual(es[1], None)
+        return
+
+    def test_entitydata_search_index(self):
+        init_annalist_test_coll()
+        testcoll = Collection.load(self.testsite, "testcoll")
+        for i in ("entitydata1", "entitydata2", "entitydata3"):
+            EntityData.create(self.testdata, i, {"rdfs:label": "Label for %s"%i})
+        finder = EntityFinder(testcoll)
+        def search_ids(search):
+            return sorted(e.get_id() for e in finder.get_entities(type_id="testtype", search=search))
+        # Index is not built for a search
+        get_search_index(testcoll).remove()
+        (meta_dir, _) = testcoll._dir_path()
+        self.assertEqual(search_ids("for entitydata2"), ["entitydata2"])
+        self.assertFalse(os.path.exists(os.path.join(meta_dir, layout.COLL_SEARCH_INDEX_FILE)))
+        self.assertTrue(finder.build_search_index())
+        self.assertEqual(search_ids("for entitydata2"), ["entitydata2"])
+        # Index is updated when entities are saved and removed
+        EntityData.create(self.testdata, "entitydata4", {"rdfs:label": "New label for entitydata2"})
+        self.assertEqual(search_ids("for entitydata2"), ["entitydata2", "entitydata4"])
+        EntityData.remove(self.testdata, "entitydata2")
+        self.assertEqual(search_ids("for entitydata2"), ["entitydata4"])
+        # Indexed entities that do not contain the search term are not loaded
+        e3 = EntityData.load(self.testdata, "entitydata3")
+        with open(os.path.join(e3._entitydir, EntityData._entityfile), "w") as f:
+            f.write(json.dumps({"rdfs:label": "Label for entitydata2"}))
+        self.assertEqual(search_ids("for entitydata2"), ["entitydata4"])
+        # Search terms shorter than the index substring length are not looked up
+        self.assertEqual(search_ids("a4"), ["entitydata4"])
+        return
+
+    @override_settings(ANNALIST_PROPERTY_INDEXES=["@type", "test:kind"])
+    def test_entitydata_search_index_values(self):
+        # The same values are indexed when the index is built and when an entity is saved
+        init_annalist_test_coll()
+        testcoll = Collection.load(self.testsite, "testcoll")
+        testtype = RecordType.load(testcoll, "testtype")
+        testtype[ANNAL.CURIE.field_aliases] = (
+            [ { ANNAL.CURIE.alias_target: "test:kind", ANNAL.CURIE.alias_source: "rdfs:label" } ]
+            )
+        testtype._save()
+        values = {"rdfs:label": "Label for entitydata1"}
+        EntityData.create(self.testdata, "entitydata1", values)
+        self.assertTrue(EntityFinder(testcoll).build_search_index())
+        index = get_search_index(testcoll)
+        def index_entries():
+            conn = index._conn()
+            eid  = conn.execute(
+                "SELECT id FROM search_entities WHERE type_id = ? AND entity_id = ?",
+                ("testtype", "entitydata1")
+                ).fetchone()[0]
+            grams = conn.execute("SELECT gram FROM search_postings WHERE entity = ?", (eid,))
+            props = conn.execute("SELECT property, value FROM search_properties WHERE entity = ?", (eid,))
+            return (sorted(grams), sorted(props))
+        built = index_entries()
+        self.assertNotIn("test:kind", [ p for (p, v) in built[1] ])
+        EntityData.create(self.testdata, "entitydata1", values)
+        self.assertEqual(index_entries(), built)
+        # The database connection is kept until the index is removed
+        self.assertIs(index._conn(), index._conn())
+        conn = index._conn()
+        index.remove()
+        self.assertIsNot(index._conn(), conn)
+        return
+
+    @override_settings(ANNALIST_PROPERTY_INDEXES=["@type", "test:kind"])
+    def test_entitydata_property_index(self):
+        init_annalist_test_coll()
+        testcoll = Collection.load(self.testsite, "testcoll")
+        for i, kind in (("entitydata1", "a"), ("entitydata2", "b"), ("entitydata3", "")):
+            EntityData.create(self.testdata, i, {"rdfs:label": "Label", "test:kind": kind})
+        def select_ids(selector, context={}):
+            finder = EntityFinder(testcoll, selector=selector)
+            return sorted(e.get_id() for e in finder.get_entities(type_id="testtype", context=context))
+        # Index is not built for a selector
+        (meta_dir, _) = testcoll._dir_path()
+        self.assertEqual(select_ids("[test:kind] == 'a'"), ["entitydata1"])
+        self.assertFalse(os.path.exists(os.path.join(meta_dir, layout.COLL_SEARCH_INDEX_FILE)))
+        self.assertTrue(EntityFinder(testcoll).build_search_index())
+        self.assertEqual(select_ids("[test:kind] == 'a'"), ["entitydata1"])
+        self.assertEqual(select_ids("'b' in [test:kind]"), ["entitydata2"])
+        # Entities with no value for the property are selected by `in`
+        self.assertEqual(
+            select_ids("[test:kind] in view[test:kinds]", {"view": {"test:kinds": ["b"]}}),
+            ["entity1", "entitydata2", "entitydata3"]
+            )
+        # Index is updated when entities are saved and removed
+        EntityData.create(self.testdata, "entitydata4", {"rdfs:label": "Label", "test:kind": "a"})
+        EntityData.remove(self.testdata, "entitydata1")
+        self.assertEqual(select_ids("[test:kind] == 'a'"), ["entitydata4"])
+        # Indexed entities that cannot be selected are not loaded
+        e2 = EntityData.load(self.testdata, "entitydata2")
+        with open(os.path.join(e2._entitydir, EntityData._entityfile), "w") as f:
+            f.write(json.dumps({"rdfs:label": "Label", "test:kind": "a"}))
+        self.assertEqual(select_ids("[test:kind] == 'a'"), ["entitydata4"])
+        # Comparisons between entity values are not answered from the index
+        self.assertEqual(
+            select_ids("[test:kind] == [test:kind]"),
+            ["entity1", "entitydata2", "entitydata3", "entitydata4"]
+            )
+        return
+
+    @override_settings(ANNALIST_PROPERTY_INDEXES=["@type", "test:kind"])
+    def test_entitydata_property_index_not_indexed(self):
+        init_annalist_test_coll()
+        testcoll = Collection.load(self.testsite, "testcoll")
+        for i, other in (("entitydata1", "a"), ("entitydata2", "b")):
+            EntityData.create(self.testdata, i, {"rdfs:label": "Label", "test:other": other})
+        EntityFinder(testcoll).build_search_index()
+        # Selector on a property that is not indexed does not use the index
+        finder = EntityFinder(testcoll, selector="[test:other] == 'a'")
+        self.assertIsNone(finder.selector_index_filter({}, type_id="testtype"))
+        self.assertEqual(
+            [ e.get_id() for e in finder.get_entities(type_id="testtype") ], 
+            ["entitydata1"]
+            )
+        return
+
+    def test_entitydata_property_index_config_type(self):
+        init_annalist_test_coll()
+        testcoll = Collection.load(self.testsite, "testcoll")
+        EntityFinder(testcoll).build_search_index()
+        # Selector for configuration entities does not use the index
+        finder = EntityFinder(testcoll, selector="'annal:Field' in [@type]")
+        self.assertIsNone(finder.selector_index_filter({}, type_id="_field"))
+        self.assertIsNotNone(finder.selector_index_filter({}, type_id="testtype"))
+        field_ids = [ e.get_id() for e in finder.get_entities(type_id="_field", altscope="all") ]
+        self.assertIn("Entity_id", field_ids)
+        return
+
+    def test_entitydata_sorted_page(self):
+        init_annalist_test_coll()
+        testcoll = Collection.load(self.testsite, "testcoll")
+        for i in range(1, 6):
+            EntityData.create(self.testdata, "entitydata%d"%i, {"rdfs:label": "Label %d"%i})
+        finder = EntityFinder(testcoll)
+        loaded = []
+        load   = finder._load_keyed_entities
+        def load_keyed_entities(typeinfos, keys):
+            loaded.extend(keys)
+            return load(typeinfos, keys)
+        finder._load_keyed_entities = load_keyed_entities
+        def page_ids(finder, **kwargs):
+            return [ e.get_id() for e in finder.get_entities_sorted(type_id="testtype", **kwargs) ]
+        # Only entities on the page requested are loaded
+        self.assertEqual(page_ids(finder, limit=2), ["entity1", "entitydata1"])
+        self.assertEqual(len(loaded), 2)
+        self.assertEqual(page_ids(finder, offset=2, limit=2), ["entitydata2", "entitydata3"])
+        self.assertEqual(page_ids(finder, after="testtype/entitydata3"), ["entitydata4", "entitydata5"])
+        self.assertEqual(page_ids(finder, after="testtype/entitydata5"), [])
+        self.assertEqual(
+            page_ids(finder), 
+            ["entity1", "entitydata1", "entitydata2", "entitydata3", "entitydata4", "entitydata5"]
+            )
+        # Selected entities are counted for the page
+        finder = EntityFinder(testcoll, selector="[rdfs:label] in view[labels]")
+        context = {"view": {"labels": ["Label 2", "Label 4", "Label 5"]}}
+        self.assertEqual(page_ids(finder, context=context, limit=2), ["entitydata2", "entitydata4"])
+        self.assertEqual(page_ids(finder, context=context, offset=2, limit=2), ["entitydata5"])
+        return
+
+    def test_entitydata_load_many_missing(self):
+        EntityData.create(self.testdata, "entitydata1", {"rdfs:label": "Label 1"})
+        e = EntityData.create(self.testdata, "entitydata2", {"rdfs:label": "Label 2"})
+        os.remove(os.path.join(e._entitydir, EntityData._entityfile))
+        loaded = []
+        class LoadCountRecordType(RecordType):
+            def _load_values(self):
+                loaded.append(self.get_id())
+                return super(LoadCountRecordType, self)._load_values()
+        # Each parent is tried just once for an entity that is not found
+        alt_parents = self.testcoll.get_alt_entities(altscope="all")
+        self.assertGreater(len(alt_parents), 1)
+        self.assertEqual(
+            LoadCountRecordType.load_many(self.testcoll, ["nosuch"], altscope="all"), [None]
+            )
+        self.assertEqual(loaded, ["nosuch"]*len(alt_parents))
+        # Entities that cannot be loaded are skipped when enumerating
+        typeinfo = EntityTypeInfo(self.testcoll, "testtype")
+        entities = list(typeinfo.enum_entities())
+        self.assertNotIn(None, entities)
+        entity_ids = [ e.get_id() for e in entities ]
+        self.assertIn("entitydata1", entity_ids)
+        self.assertNotIn("entitydata2", entity_ids)
+        return
+
     def test_entitydata_type_id(self):
         r = EntityRoot(TestBaseUri, TestBaseUri, TestBaseDir, TestBaseDir)
         self.assertEqual(r.get_type_id(),   None)
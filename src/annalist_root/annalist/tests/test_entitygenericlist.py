@@ -284,6 +284,37 @@ class EntityGenericListViewTest(AnnalistTestCase):
         self.assertEqual(len(entities), 164)    # Will change with site data
         return
 
+    def test_get_default_all_scope_all_list_pages(self):
+        # List all entities a page at a time, following links to the next page
+        def list_ids(r):
+            return [ (e['entity_type_id'], e['entity_id']) for e in context_list_entities(r.context) ]
+        u = entitydata_list_all_url("testcoll", list_id="Default_list_all", scope="all")
+        r = self.client.get(u)
+        self.assertEqual(r.status_code,   200)
+        self.assertEqual(r.context['next_page_url'], "")
+        all_ids  = list_ids(r)
+        page_ids = []
+        u = entitydata_list_all_url(
+            "testcoll", list_id="Default_list_all", scope="all", 
+            query_params={"limit": "50"}
+            )
+        while u:
+            r = self.client.get(u)
+            self.assertEqual(r.status_code,   200)
+            self.assertLessEqual(len(list_ids(r)), 50)
+            page_ids += list_ids(r)
+            u = r.context['next_page_url']
+        self.assertEqual(page_ids, all_ids)
+        # Pages can also be selected by offset
+        u = entitydata_list_all_url(
+            "testcoll", list_id="Default_list_all", scope="all", 
+            query_params={"offset": "50", "limit": "50"}
+            )
+        r = self.client.get(u)
+        self.assertEqual(list_ids(r), all_ids[50:100])
+        self.assertContains(r, "Next page")
+        return
+
     def test_get_types_list(self):
         # List types in current collection
         u = entitydata_list_type_url(
@@ -0,0 +1,178 @@
+"""
+Tests for entity manifest used for enumerating entity data records
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os
+import json
+import time
+import shutil
+import unittest
+
+import logging
+log = logging.getLogger(__name__)
+
+from django.conf                    import settings
+from django.test                    import TestCase # cf. https://docs.djangoproject.com/en/dev/topics/testing/tools/#assertions
+
+from annalist                       import layout
+from annalist.identifiers           import RDF, RDFS, ANNAL
+from annalist.models.site           import Site
+from annalist.models.collection     import Collection
+from annalist.models.recordtypedata import RecordTypeData
+from annalist.models.entitydata     import EntityData
+from annalist.models.entitytypeinfo import EntityTypeInfo
+
+from AnnalistTestCase       import AnnalistTestCase
+from tests                  import TestHost, TestHostUri, TestBasePath, TestBaseUri, TestBaseDir
+from init_tests             import init_annalist_test_site, init_annalist_test_coll, resetSitedata
+from entity_testentitydata  import entitydata_create_values
+
+#   -----------------------------------------------------------------------------
+#
+#   Entity manifest tests
+#
+#   -----------------------------------------------------------------------------
+
+class EntityManifestTest(AnnalistTestCase):
+    """
+    Tests for entity manifest
+    """
+
+    def setUp(self):
+        init_annalist_test_site()
+        init_annalist_test_coll()
+        self.testsite = Site(TestBaseUri, TestBaseDir)
+        self.testcoll = Collection(self.testsite, "testcoll")
+        self.testdata = RecordTypeData(self.testcoll, "testtype")
+        self.type_dir = self.testdata._entitydir.rstrip("/")
+        self.manifest_path = os.path.join(
+            os.path.dirname(self.type_dir),
+            layout.TYPEDATA_MANIFEST_FILE%{'id': "testtype"}
+            )
+        return
+
+    def tearDown(self):
+        resetSitedata(scope="collections")
+        return
+
+    @classmethod
+    def tearDownClass(cls):
+        resetSitedata()
+        return
+
+    def _backdate_type_dir(self):
+        t = time.time() - 60
+        os.utime(self.type_dir, (t, t))
+        return
+
+    def _read_manifest(self):
+        with open(self.manifest_path, "r") as f:
+            return json.load(f)
+
+    def _entity_ids(self):
+        return list(self.testdata.child_entity_ids(EntityData))
+
+    def test_manifest_not_written_for_recent_update(self):
+        self.assertEqual(self._entity_ids(), ["entity1"])
+        self.assertFalse(os.path.exists(self.manifest_path))
+        return
+
+    def test_manifest_built(self):
+        self._backdate_type_dir()
+        self.assertEqual(self._entity_ids(), ["entity1"])
+        self.assertTrue(os.path.exists(self.manifest_path))
+        self.assertEqual(self._read_manifest()["entities"], ["entity1"])
+        # Manifest name is not enumerated as a type data entity
+        self.assertNotIn("testtype.manifest", list(self.testcoll.child_entity_ids(RecordTypeData)))
+        return
+
+    def test_manifest_used(self):
+        self._backdate_type_dir()
+        self._entity_ids()
+        # Entity directory without body is omitted from the manifest,
+        # so a manifest entry added by hand is returned only if the manifest is used
+        m = self._read_manifest()
+        m["entities"].append("entity_x")
+        with open(self.manifest_path, "w") as f:
+            json.dump(m, f)
+        self.assertEqual(self._entity_ids(), ["entity1", "entity_x"])
+        return
+
+    def test_manifest_create_remove(self):
+        self._backdate_type_dir()
+        self._entity_ids()
+        # Manifest is not written for the recently modified directory
+        EntityData.create(self.testdata, "entity2", entitydata_create_values("entity2"))
+        self.assertFalse(os.path.exists(self.manifest_path))
+        self.assertEqual(self._entity_ids(), ["entity1", "entity2"])
+        self.assertFalse(os.path.exists(self.manifest_path))
+        self._backdate_type_dir()
+        self.assertEqual(self._entity_ids(), ["entity1", "entity2"])
+        self.assertEqual(self._read_manifest()["entities"], ["entity1", "entity2"])
+        EntityData.remove(self.testdata, "entity1")
+        self.assertFalse(os.path.exists(self.manifest_path))
+        self.assertEqual(self._entity_ids(), ["entity2"])
+        return
+
+    def test_manifest_update_settled(self):
+        # Manifest is updated if the directory is not recently modified on exit
+        self._backdate_type_dir()
+        self._entity_ids()
+        with self.testdata._manifest(EntityData).updating(["entity3"]):
+            shutil.copytree(
+                os.path.join(self.type_dir, "entity1"),
+                os.path.join(self.type_dir, "entity3")
+                )
+            self._backdate_type_dir()
+        self.assertEqual(self._read_manifest()["entities"], ["entity1", "entity3"])
+        self.assertEqual(self._entity_ids(), ["entity1", "entity3"])
+        return
+
+    def test_manifest_resave(self):
+        # Re-saving an existing entity does not change the directory stat key, so the
+        # manifest remains in use, and records only entity identifiers
+        self._backdate_type_dir()
+        self._entity_ids()
+        manifest = self._read_manifest()
+        e1 = EntityData.load(self.testdata, "entity1")
+        e1["rdfs:label"] = "Updated label"
+        e1._save()
+        self.assertEqual(self._read_manifest(), manifest)
+        self.assertEqual(manifest["entities"], ["entity1"])
+        self.assertEqual(self._entity_ids(), ["entity1"])
+        self.assertEqual(
+            EntityData.load(self.testdata, "entity1")["rdfs:label"], "Updated label"
+            )
+        return
+
+    def test_manifest_rename(self):
+        self._backdate_type_dir()
+        self._entity_ids()
+        typeinfo = EntityTypeInfo(self.testcoll, "testtype")
+        typeinfo.rename_entity("entity_new", typeinfo, "entity1")
+        self.assertFalse(os.path.exists(self.manifest_path))
+        self.assertEqual(self._entity_ids(), ["entity_new"])
+        return
+
+    def test_manifest_external_update(self):
+        self._backdate_type_dir()
+        self._entity_ids()
+        shutil.copytree(
+            os.path.join(self.type_dir, "entity1"),
+            os.path.join(self.type_dir, "entity3")
+            )
+        self.assertEqual(self._entity_ids(), ["entity1", "entity3"])
+        return
+
+    def test_manifest_remove_type_data(self):
+        self._backdate_type_dir()
+        self._entity_ids()
+        RecordTypeData.remove(self.testcoll, "testtype")
+        self.assertFalse(os.path.exists(self.manifest_path))
+        return
+
+# End.
@@ -0,0 +1,325 @@
+"""
+Tests for entity storage drivers
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import logging
+log = logging.getLogger(__name__)
+
+from django.conf                    import settings
+from django.test                    import TestCase # cf. https://docs.djangoproject.com/en/dev/topics/testing/tools/#assertions
+from django.test.utils              import override_settings
+
+from annalist.identifiers           import RDF, RDFS, ANNAL
+from annalist.models                import entitystorage
+from annalist.models.entitystorage  import (
+    FileEntityStorage, SqliteEntityStorage,
+    make_entity_storage, get_entity_storage, set_entity_storage,
+    batch_updates, current_batch, temp_file_name
+    )
+from annalist.models.site           import Site
+from annalist.models.collection     import Collection
+from annalist.models.recordtypedata import RecordTypeData
+from annalist.models.entitydata     import EntityData
+
+from AnnalistTestCase       import AnnalistTestCase
+from tests                  import TestHost, TestHostUri, TestBasePath, TestBaseUri, TestBaseDir
+from init_tests             import init_annalist_test_site, init_annalist_test_coll, resetSitedata
+from entity_testentitydata  import entitydata_dir, entitydata_create_values
+
+#   -----------------------------------------------------------------------------
+#
+#   Storage driver tests
+#
+#   -----------------------------------------------------------------------------
+
+class StorageDriverTestMixin(object):
+    """
+    Tests common to all storage drivers.  The test case class must set
+    `self.storage` and `self.basedir`.
+    """
+
+    def _path(self, *segs):
+        return os.path.join(self.basedir, *segs)
+
+    def test_write_read(self):
+        p = self._path("d", "e1", "entity_data.jsonld")
+        self.storage.makedirs(os.path.dirname(p))
+        with self.storage.open(p, "wt") as f:
+            f.write('{"a": "b"}')
+        self.assertTrue(self.storage.isdir(self._path("d", "e1")))
+        self.assertTrue(self.storage.isfile(p))
+        self.assertFalse(self.storage.isdir(p))
+        with self.storage.open(p, "rt") as f:
+            self.assertEqual(f.read(), '{"a": "b"}')
+        self.assertEqual(self.storage.read_file(p), '{"a": "b"}')
+        return
+
+    def test_listdir(self):
+        for e in ("e1", "e2", "e3"):
+            self.storage.write_file(self._path("d", e, "entity_data.jsonld"), "{}")
+        self.storage.write_file(self._path("d", "e1", "resource.txt"), "text")
+        self.assertEqual(sorted(self.storage.listdir(self._path("d"))), ["e1", "e2", "e3"])
+        self.assertEqual(
+            sorted(self.storage.listfiles(self._path("d", "e1"))),
+            ["entity_data.jsonld", "resource.txt"]
+            )
+        self.assertEqual(self.storage.listdir(self._path("nodir")), [])
+        return
+
+    def test_rename(self):
+        self.storage.write_file(self._path("d", "e1", "entity_data.jsonld"), "e1data")
+        self.storage.write_file(self._path("d", "e1_x", "entity_data.jsonld"), "e1xdata")
+        self.storage.rename(self._path("d", "e1"), self._path("d", "e2"))
+        self.assertFalse(self.storage.exists(self._path("d", "e1")))
+        self.assertTrue(self.storage.isdir(self._path("d", "e2")))
+        self.assertEqual(self.storage.read_file(self._path("d", "e2", "entity_data.jsonld")), "e1data")
+        self.assertEqual(self.storage.read_file(self._path("d", "e1_x", "entity_data.jsonld")), "e1xdata")
+        self.assertEqual(sorted(self.storage.listdir(self._path("d"))), ["e1_x", "e2"])
+        self.assertEqual(self.storage.listdir(self._path("d", "e2")), ["entity_data.jsonld"])
+        return
+
+    def test_remove_tree(self):
+        self.storage.write_file(self._path("d", "e1", "entity_data.jsonld"), "e1data")
+        self.storage.write_file(self._path("d", "e10", "entity_data.jsonld"), "e10data")
+        self.storage.remove_tree(self._path("d", "e1"))
+        self.assertFalse(self.storage.exists(self._path("d", "e1")))
+        self.assertFalse(self.storage.exists(self._path("d", "e1", "entity_data.jsonld")))
+        self.assertTrue(self.storage.isfile(self._path("d", "e10", "entity_data.jsonld")))
+        return
+
+    def test_copy_file(self):
+        self.storage.write_file(self._path("d", "e1", "resource.txt"), "text")
+        self.storage.makedirs(self._path("d", "e2"))
+        self.storage.copy_file(self._path("d", "e1", "resource.txt"), self._path("d", "e2", "res.txt"))
+        self.assertEqual(self.storage.read_file(self._path("d", "e2", "res.txt")), "text")
+        return
+
+
+class FileEntityStorageTest(StorageDriverTestMixin, unittest.TestCase):
+    """
+    Tests for file system storage driver
+    """
+
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp(prefix="annalist_storage_")
+        self.storage = FileEntityStorage()
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+        return
+
+
+    def test_write_atomic(self):
+        p = self._path("d", "e1", "entity_data.jsonld")
+        self.storage.write_file(p, "olddata")
+        self.storage.write_file(p, "newdata")
+        self.assertEqual(self.storage.read_file(p), "newdata")
+        # No temporary files are left behind
+        self.assertEqual(os.listdir(self._path("d", "e1")), ["entity_data.jsonld"])
+        return
+
+    @override_settings(ANNALIST_SYNC_WRITES=True)
+    def test_write_sync(self):
+        p1 = self._path("d", "e1", "entity_data.jsonld")
+        p2 = self._path("d", "e2", "entity_data.jsonld")
+        self.storage.write_file(p1, "data1")
+        with batch_updates() as b:
+            self.storage.write_file(p2, "data2")
+            self.assertEqual(b._sync_dirs, {os.path.dirname(p2)})
+        self.assertEqual(b._sync_dirs, set())
+        self.assertEqual(self.storage.read_file(p1), "data1")
+        self.assertEqual(self.storage.read_file(p2), "data2")
+        return
+
+    def test_listfiles_temp_files(self):
+        # Temporary files left by an interrupted write are not listed
+        p = self._path("d", "e1", "entity_data.jsonld")
+        self.storage.write_file(p, "data")
+        if not os.path.isdir(self._path("d", "e1")):
+            os.makedirs(self._path("d", "e1"))
+        with open(self._path("d", "e1", temp_file_name("entity_data.jsonld")), "wt") as f:
+            f.write("partial")
+        with open(self._path("d", "e1", "resource.tmp"), "wt") as f:
+            f.write("resource")
+        self.assertEqual(
+            sorted(self.storage.listfiles(self._path("d", "e1"))), 
+            ["entity_data.jsonld", "resource.tmp"]
+            )
+        return
+
+    def test_link_file(self):
+        src = self._path("d", "e1", "resource.txt")
+        dst = self._path("d", "e2", "resource.txt")
+        self.storage.write_file(src, "text")
+        how = self.storage.link_file(src, dst)
+        self.assertIn(how, ["reflink", "hardlink", "copy"])
+        self.assertEqual(self.storage.read_file(dst), "text")
+        self.assertEqual(self.storage.getsize(dst), 4)
+        # Updating the linked file does not affect the original
+        with self.storage.open(dst, "wt") as f:
+            f.write("newtext")
+        self.assertEqual(self.storage.read_file(dst), "newtext")
+        self.assertEqual(self.storage.read_file(src), "text")
+        self.assertEqual(os.stat(src).st_nlink, 1)
+        # Appending to a hard linked file preserves its content
+        os.remove(dst)
+        os.link(src, dst)
+        with self.storage.open(dst, "at") as f:
+            f.write("more")
+        self.assertEqual(self.storage.read_file(dst), "textmore")
+        self.assertEqual(self.storage.read_file(src), "text")
+        return
+
+    def test_lock(self):
+        d1 = self._path("d1")
+        d2 = self._path("d2")
+        os.mkdir(d1)
+        os.mkdir(d2)
+        with self.storage.lock(d1):
+            with self.storage.lock(d1):
+                with self.storage.lock(d2):
+                    self.assertIn(d1, entitystorage._path_locks)
+                    self.assertIn(d2, entitystorage._path_locks)
+        # Locks are not retained once released
+        self.assertNotIn(d1, entitystorage._path_locks)
+        self.assertNotIn(d2, entitystorage._path_locks)
+        return
+
+
+class SqliteEntityStorageTest(StorageDriverTestMixin, unittest.TestCase):
+    """
+    Tests for SQLite storage driver
+    """
+
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp(prefix="annalist_storage_")
+        self.storage = SqliteEntityStorage(
+            self.basedir, os.path.join(self.basedir, "entity_store.sqlite3")
+            )
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+        return
+
+    def test_batch_updates(self):
+        actions = []
+        with batch_updates() as b1:
+            with batch_updates() as b2:
+                self.assertIs(b1, b2)
+                self.assertIs(current_batch(), b1)
+                b2.defer("k1", lambda: actions.append("a1"))
+                b2.defer("k2", lambda: actions.append("a2"))
+                b2.defer("k1", lambda: actions.append("a3"))
+                self.storage.write_file(self._path("d", "e1", "entity_data.jsonld"), "e1data")
+            self.assertEqual(actions, [])
+        self.assertEqual(current_batch(), None)
+        self.assertEqual(actions, ["a2", "a3"])
+        self.assertEqual(self.storage.read_file(self._path("d", "e1", "entity_data.jsonld")), "e1data")
+        return
+
+    def test_rename_remove_case(self):
+        # Directories whose names differ only in case are distinct
+        self.storage.write_file(self._path("d", "Type", "e1", "entity_data.jsonld"), "e1data")
+        self.storage.write_file(self._path("d", "type", "e2", "entity_data.jsonld"), "e2data")
+        self.storage.rename(self._path("d", "Type"), self._path("d", "Type2"))
+        self.assertEqual(self.storage.read_file(self._path("d", "Type2", "e1", "entity_data.jsonld")), "e1data")
+        self.assertEqual(self.storage.read_file(self._path("d", "type", "e2", "entity_data.jsonld")), "e2data")
+        self.assertEqual(self.storage.listdir(self._path("d", "type")), ["e2"])
+        self.storage.remove_tree(self._path("d", "Type2"))
+        self.storage.write_file(self._path("d", "TYPE", "e3", "entity_data.jsonld"), "e3data")
+        self.storage.remove_tree(self._path("d", "TYPE"))
+        self.assertFalse(self.storage.exists(self._path("d", "Type2")))
+        self.assertFalse(self.storage.exists(self._path("d", "TYPE")))
+        self.assertTrue(self.storage.isfile(self._path("d", "type", "e2", "entity_data.jsonld")))
+        self.assertEqual(sorted(self.storage.listdir(self._path("d"))), ["type"])
+        return
+
+    def test_no_files_created(self):
+        self.storage.write_file(self._path("d", "e1", "entity_data.jsonld"), "{}")
+        self.assertFalse(os.path.exists(self._path("d")))
+        return
+
+    def test_file_underlay(self):
+        os.makedirs(self._path("d", "e1"))
+        with open(self._path("d", "e1", "entity_data.jsonld"), "wt") as f:
+            f.write("filedata")
+        self.storage.write_file(self._path("d", "e2", "entity_data.jsonld"), "dbdata")
+        self.assertEqual(sorted(self.storage.listdir(self._path("d"))), ["e1", "e2"])
+        self.assertTrue(self.storage.isdir(self._path("d", "e1")))
+        self.assertEqual(self.storage.read_file(self._path("d", "e1", "entity_data.jsonld")), "filedata")
+        # Database content overrides underlay
+        self.storage.write_file(self._path("d", "e1", "entity_data.jsonld"), "newdata")
+        self.assertEqual(self.storage.read_file(self._path("d", "e1", "entity_data.jsonld")), "newdata")
+        return
+
+    def test_make_entity_storage(self):
+        self.assertIsInstance(make_entity_storage("file"), FileEntityStorage)
+        with self.assertRaises(ValueError):
+            make_entity_storage("nosuchdriver")
+        return
+
+#   -----------------------------------------------------------------------------
+#
+#   Entity access using SQLite storage
+#
+#   -----------------------------------------------------------------------------
+
+class SqliteEntityDataTest(AnnalistTestCase):
+    """
+    Tests for entity access using SQLite storage driver
+    """
+
+    def setUp(self):
+        init_annalist_test_site()
+        init_annalist_test_coll()
+        self.dbdir        = tempfile.mkdtemp(prefix="annalist_storage_")
+        self.prev_storage = set_entity_storage(
+            SqliteEntityStorage(TestBaseDir, os.path.join(self.dbdir, "entity_store.sqlite3"))
+            )
+        self.testsite = Site(TestBaseUri, TestBaseDir)
+        self.testcoll = Collection(self.testsite, "testcoll")
+        self.testdata = RecordTypeData(self.testcoll, "testtype")
+        return
+
+    def tearDown(self):
+        set_entity_storage(self.prev_storage)
+        shutil.rmtree(self.dbdir)
+        return
+
+    @classmethod
+    def tearDownClass(cls):
+        resetSitedata()
+        return
+
+    def test_entitydata_create_load(self):
+        e  = EntityData.create(self.testdata, "entitydata1", entitydata_create_values("entitydata1"))
+        self.assertTrue(EntityData.exists(self.testdata, "entitydata1"))
+        self.assertFalse(os.path.exists(entitydata_dir("testcoll", "testtype", "entitydata1")))
+        ed = EntityData.load(self.testdata, "entitydata1")
+        self.assertEqual(ed[RDFS.CURIE.label], "Entity testcoll/testtype/entitydata1")
+        # Existing file-based entity is still visible alongside the new one
+        self.assertEqual(
+            sorted(self.testdata.child_entity_ids(EntityData)),
+            ["entity1", "entitydata1"]
+            )
+        return
+
+    def test_entitydata_remove(self):
+        EntityData.create(self.testdata, "entitydata1", entitydata_create_values("entitydata1"))
+        EntityData.remove(self.testdata, "entitydata1")
+        self.assertFalse(EntityData.exists(self.testdata, "entitydata1"))
+        self.assertEqual(list(self.testdata.child_entity_ids(EntityData)), ["entity1"])
+        return
+
+# End.
@@ -32,6 +32,8 @@ from annalist                               import message
 from annalist.models.site                   import Site
 from annalist.models.collection             import Collection
 from annalist.models.recordfield            import RecordField
+from annalist.models.entityroot             import ENTITY_MIGRATION_VERSION
+from annalist.models.entitystorage          import get_entity_storage
 
 from annalist.views.entityedit              import GenericEntityEditView
 from annalist.views.form_utils.fieldchoice  import FieldChoice
@@ -239,6 +241,25 @@ class RecordFieldTest(AnnalistTestCase):
         self.assertDictionaryMatch(td, vr)
         return
 
+    def test_recordfield_load_migrate_stamp(self):
+        # Test field migration is skipped for data stamped with current migration version
+        t  = RecordField.create(self.testcoll, "field1", recordfield_create_values(field_id="field1"))
+        (d, p) = t._dir_path()
+        vs = json.loads(get_entity_storage().read_file(p))
+        self.assertEqual(vs[ANNAL.CURIE.migration_version], ENTITY_MIGRATION_VERSION)
+        vs['annal:options_typeref'] = "test_target_type"
+        get_entity_storage().write_file(p, json.dumps(vs))
+        td = RecordField.load(self.testcoll, "field1").get_values()
+        self.assertNotIn(ANNAL.CURIE.migration_version, td)
+        self.assertIn('annal:options_typeref',      td)
+        self.assertNotIn('annal:field_ref_type',    td)
+        vs[ANNAL.CURIE.migration_version] = "0"
+        get_entity_storage().write_file(p, json.dumps(vs))
+        td = RecordField.load(self.testcoll, "field1").get_values()
+        self.assertNotIn('annal:options_typeref',   td)
+        self.assertEqual(td['annal:field_ref_type'], "test_target_type")
+        return
+
 #   -----------------------------------------------------------------------------
 #
 #   RecordField edit view tests
@@ -11,6 +11,7 @@ __copyright__   = "Copyright 2014, G. Klyne"
 __license__     = "MIT (http://opensource.org/licenses/MIT)"
 
 import os
+import json
 import unittest
 
 import logging
@@ -36,6 +37,10 @@ from annalist.models.recordtype         import RecordType
 from annalist.models.recordtypedata     import RecordTypeData
 from annalist.models.recordview         import RecordView
 from annalist.models.recordlist         import RecordList
+from annalist.models.typedatarename     import resume_type_data_renames
+from annalist.models.searchindex        import get_search_index
+from annalist.models.entityfinder       import EntityFinder
+from annalist.models.entityroot         import ENTITY_MIGRATION_VERSION
 
 from annalist.views.recordtypedelete        import RecordTypeDeleteConfirmedView
 from annalist.views.form_utils.fieldchoice  import FieldChoice
@@ -858,6 +863,55 @@ class RecordTypeEditViewTest(AnnalistTestCase):
         self.assertFalse(EntityData.exists(d1, "typeentity"))
         d2 = RecordTypeData.load(self.testcoll, "edittype2")
         self.assertTrue(EntityData.exists(d2, "typeentity"))
+        e2 = EntityData.load(d2, "typeentity")
+        self.assertEqual(e2[ANNAL.CURIE.type_id], "edittype2")
+        self.assertIn(e2[ANNAL.CURIE.type],       e2["@type"])
+        self.assertEqual(e2["@id"],               "edittype2/typeentity")
+        return
+
+    def test_resume_type_data_rename(self):
+        # Check that an interrupted type data rename is completed
+        self._create_record_type("edittype1", entity_id="typeentity1")
+        d1 = RecordTypeData.load(self.testcoll, "edittype1")
+        EntityData.create(d1, "typeentity2", {})
+        self.assertTrue(EntityFinder(self.testcoll).build_search_index())
+        index = get_search_index(self.testcoll)
+        def index_ids(type_id):
+            return sorted( r[0] for r in index._conn().execute(
+                "SELECT entity_id FROM search_entities WHERE type_id = ?", (type_id,)
+                ))
+        rename = (
+            { "old_type_id":    "edittype1"
+            , "new_type_id":    "edittype2"
+            , "type_uri":       "annal:edittype2"
+            , "type_uris":      ["annal:edittype2"]
+            , "renamed":        False
+            , "rewritten":      ""
+            })
+        marker_path = os.path.join(
+            os.path.dirname(d1._entitydir.rstrip("/")),
+            layout.TYPEDATA_RENAME_FILE%{'id': "edittype2"}
+            )
+        with open(marker_path, "w") as f:
+            f.write(json.dumps(rename))
+        self.assertEqual(resume_type_data_renames(self.testcoll), ["edittype2"])
+        self.assertFalse(os.path.exists(marker_path))
+        self.assertFalse(RecordTypeData.exists(self.testcoll, "edittype1"))
+        d2 = RecordTypeData.load(self.testcoll, "edittype2")
+        self.assertEqual(d2.get_id(), "edittype2")
+        for entity_id in ("typeentity1", "typeentity2"):
+            e2 = EntityData.load(d2, entity_id)
+            self.assertEqual(e2[ANNAL.CURIE.type_id], "edittype2")
+            self.assertEqual(e2[ANNAL.CURIE.type],    "annal:edittype2")
+            # Entities are saved in the usual way, so data is stamped as migrated
+            with open(os.path.join(e2._entitydir, e2._entityfile)) as f:
+                body = json.load(f)
+            self.assertEqual(body[ANNAL.CURIE.migration_version], ENTITY_MIGRATION_VERSION)
+        # Search index entries are moved to the new type id, and the index is kept
+        self.assertTrue(index.complete())
+        self.assertEqual(index_ids("edittype1"), [])
+        self.assertEqual(index_ids("edittype2"), ["typeentity1", "typeentity2"])
+        self.assertEqual(resume_type_data_renames(self.testcoll), [])
         return
 
     def test_post_edit_type_cancel(self):
@@ -59,7 +59,7 @@ class RepeatGroupRenderingTest(AnnalistTestCase):
         return
 
     def tearDown(self):
-        # resetSitedata(scope="collections")
+        resetSitedata(scope="collections")
         return
 
     @classmethod
@@ -27,6 +27,8 @@ from annalist.identifiers           import RDF, RDFS, ANNAL
 from annalist.models.site           import Site
 from annalist.models.site           import Collection
 from annalist.models.annalistuser   import AnnalistUser
+from annalist.models                import sitecollections
+from annalist.models.entitytombstone import wait_for_reaper
 
 from annalist.views.site            import SiteView, SiteActionView
 
@@ -186,6 +188,41 @@ class SiteTest(AnnalistTestCase):
         self.assertDictionaryMatch(colls["coll1"], self.coll1)
         return
 
+    def test_site_data_collections_cached(self):
+        def site_colls():
+            return self.testsite.site_data()["collections"]
+        self.assertEquals(site_colls().keys(), init_collection_keys)
+        # Cached directory is used while the site collections are unchanged
+        self.assertIs(
+            sitecollections.get_collections_directory(self.testsite),
+            sitecollections.get_collections_directory(self.testsite)
+            )
+        # Add, update and remove collections
+        self.testsite.add_collection("new", self.collnewmeta)
+        self.assertEquals(site_colls().keys(), init_collection_keys+["new"])
+        self.assertEquals(site_colls()["new"]["title"], self.collnew[RDFS.CURIE.label])
+        c = Collection.load(self.testsite, "coll1")
+        c[RDFS.CURIE.label] = "Updated coll1"
+        c._save()
+        self.assertEquals(site_colls()["coll1"]["title"], "Updated coll1")
+        self.testsite.remove_collection("coll2")
+        self.assertEquals(site_colls().keys(), ["_annalist_site", "coll1", "coll3", "new"])
+        # (Removal of the collection tombstone would also update the collections directory)
+        wait_for_reaper()
+        site_colls()
+        # Update by another process is seen when the stamp file is rewritten
+        meta_path = os.path.join(
+            TestBaseDir, layout.SITE_COLL_PATH%{'id': "coll3"}, layout.COLL_META_REF
+            )
+        with open(meta_path, "rt") as f:
+            body = f.read()
+        with open(meta_path, "wt") as f:
+            f.write(body.replace(init_collections["coll3"][RDFS.CURIE.label], "External coll3"))
+        self.assertNotEquals(site_colls()["coll3"]["title"], "External coll3")
+        sitecollections._update_stamp(self.testsite)
+        self.assertEquals(site_colls()["coll3"]["title"], "External coll3")
+        return
+
 #   -----------------------------------------------------------------------------
 #
 #   SiteView tests
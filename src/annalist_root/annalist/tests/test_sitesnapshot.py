@@ -0,0 +1,107 @@
+"""
+Tests for read-only snapshot of site data
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2016, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os
+import unittest
+
+import logging
+log = logging.getLogger(__name__)
+
+from django.conf                    import settings
+from django.test                    import TestCase # cf. https://docs.djangoproject.com/en/dev/topics/testing/tools/#assertions
+
+from annalist                       import layout
+from annalist.identifiers           import RDF, RDFS, ANNAL
+from annalist.models.sitesnapshot   import (
+    get_site_snapshot, update_site_data_stamp, discard_snapshots
+    )
+from annalist.models.site           import Site
+from annalist.models.collection     import Collection
+from annalist.models.recordfield    import RecordField
+
+from AnnalistTestCase       import AnnalistTestCase
+from tests                  import TestHost, TestHostUri, TestBasePath, TestBaseUri, TestBaseDir
+from init_tests             import init_annalist_test_site, init_annalist_test_coll, resetSitedata
+from entity_testfielddata   import recordfield_create_values
+
+#   -----------------------------------------------------------------------------
+#
+#   Site data snapshot tests
+#
+#   -----------------------------------------------------------------------------
+
+class SiteSnapshotTest(AnnalistTestCase):
+    """
+    Tests for site data snapshot
+    """
+
+    def setUp(self):
+        init_annalist_test_site()
+        init_annalist_test_coll()
+        self.testsite   = Site(TestBaseUri, TestBaseDir)
+        self.testcoll   = Collection(self.testsite, "testcoll")
+        self.metadir    = os.path.join(TestBaseDir, layout.SITEDATA_META_DIR)
+        self.stamp_file = os.path.join(self.metadir, layout.SITEDATA_STAMP_FILE)
+        self.field_file = os.path.join(
+            self.metadir, layout.FIELD_DIR, "Entity_id", layout.FIELD_META_FILE
+            )
+        discard_snapshots()
+        return
+
+    def tearDown(self):
+        if os.path.exists(self.stamp_file):
+            os.remove(self.stamp_file)
+        discard_snapshots()
+        resetSitedata()
+        return
+
+    @classmethod
+    def tearDownClass(cls):
+        resetSitedata()
+        return
+
+    def _field_label(self, field_id="Entity_id"):
+        return RecordField.load(self.testcoll, field_id, altscope="all")[RDFS.CURIE.label]
+
+    def test_no_snapshot_without_stamp(self):
+        self.assertEqual(get_site_snapshot(self.field_file), None)
+        return
+
+    def test_snapshot_used(self):
+        label     = self._field_label()
+        field_ids = sorted(self.testcoll.child_entity_ids(RecordField, altscope="all"))
+        update_site_data_stamp(self.metadir)
+        self.assertNotEqual(get_site_snapshot(self.field_file), None)
+        self.assertEqual(get_site_snapshot(self.stamp_file), None)
+        self.assertEqual(self._field_label(), label)
+        self.assertEqual(sorted(self.testcoll.child_entity_ids(RecordField, altscope="all")), field_ids)
+        # Direct update of stored data is not seen until the stamp is updated
+        with open(self.field_file, "rt") as f:
+            body = f.read()
+        with open(self.field_file, "wt") as f:
+            f.write(body.replace(label, "Updated label"))
+        self.assertEqual(self._field_label(), label)
+        update_site_data_stamp(self.metadir)
+        self.assertEqual(self._field_label(), "Updated label")
+        return
+
+    def test_snapshot_entity_update(self):
+        update_site_data_stamp(self.metadir)
+        with open(self.stamp_file, "rt") as f:
+            stamp = f.read()
+        sitedata = self.testsite.site_data_collection()
+        self.assertFalse(RecordField.exists(self.testcoll, "snapfield", altscope="all"))
+        RecordField.create(sitedata, "snapfield", recordfield_create_values(field_id="snapfield"))
+        self.assertTrue(RecordField.exists(self.testcoll, "snapfield", altscope="all"))
+        with open(self.stamp_file, "rt") as f:
+            self.assertNotEqual(f.read(), stamp)
+        RecordField.remove(sitedata, "snapfield")
+        self.assertFalse(RecordField.exists(self.testcoll, "snapfield", altscope="all"))
+        return
+
+# End.
@@ -48,6 +48,13 @@ def load_tests(loader, tests, ignore):
         tests.addTests(doctest.DocTestSuite(annalist.views.fields.bound_field))
         tests.addTests(doctest.DocTestSuite(annalist.views.fields.render_placement))
         tests.addTests(doctest.DocTestSuite(annalist.models.entityfinder))
+        tests.addTests(doctest.DocTestSuite(annalist.models.entitycache))
+        tests.addTests(doctest.DocTestSuite(annalist.models.entitystorage))
+        tests.addTests(doctest.DocTestSuite(annalist.models.entitymanifest))
+        tests.addTests(doctest.DocTestSuite(annalist.models.entityidcounter))
+        tests.addTests(doctest.DocTestSuite(annalist.models.entitytombstone))
+        tests.addTests(doctest.DocTestSuite(annalist.models.searchindex))
+        tests.addTests(doctest.DocTestSuite(annalist.models.typegraph))
         # For some reason, this won't load in the full test suite
         # tests.addTests(doctest.DocTestSuite(annalist.tests.entity_testutils))
     else:
@@ -22,6 +22,11 @@ import json
 import shutil
 import StringIO
 
+try:
+    import simplejson as fast_json
+except ImportError:
+    fast_json = None    # Use standard library json module
+
 from django.conf import settings
 
 from annalist.identifiers import ANNAL
@@ -353,6 +358,31 @@ def strip_comments(f):
     fnc.seek(sof)
     return fnc
 
+COMMENT_LINE_RE = re.compile(r"^[ \t\r\f\v]*//.*$", re.MULTILINE)
+
+def json_loads_body(data):
+    """
+    Parses JSON data that may contain comment lines (lines whose first non-blank
+    characters are "//"), and returns the resulting value.
+
+    Comment lines are looked for only if the data contains "//", and are replaced
+    with blank lines only if any are found; the data is then parsed directly.  If
+    the `simplejson` package is installed, it is used in preference to the standard
+    `json` module.
+
+    >>> json_loads_body('{"a": "http://example.org/"}') == {"a": "http://example.org/"}
+    True
+    >>> json_loads_body('// comment\\n{"a":\\n  // another comment\\n "b"}\\n') == {"a": "b"}
+    True
+    """
+    if "//" in data and COMMENT_LINE_RE.search(data):
+        data = COMMENT_LINE_RE.sub("", data)
+    if fast_json:
+        if isinstance(data, str):
+            data = data.decode("utf-8")     # Ensure all strings are returned as unicode
+        return fast_json.loads(data)
+    return json.loads(data)
+
 def renametree_temp(src):
     """
     Rename tree to temporary name, and return that name, or 
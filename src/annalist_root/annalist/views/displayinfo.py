@@ -336,7 +336,7 @@ class DisplayInfo(object):
                     )
             else:
                 self.list_id    = list_id
-                self.recordlist = RecordList.load(self.collection, list_id, altscope="all")
+                self.recordlist = self.collection.get_list(list_id)
                 if "@error" in self.recordlist:
                     self.http_response = self.view.error(
                         dict(self.view.error500values(),
@@ -373,7 +373,7 @@ class DisplayInfo(object):
                     )
             else:
                 self.view_id    = view_id
-                self.recordview = RecordView.load(self.collection, view_id, altscope="all")
+                self.recordview = self.collection.get_view(view_id)
                 if "@error" in self.recordview:
                     self.http_response = self.view.error(
                         dict(self.view.error500values(),
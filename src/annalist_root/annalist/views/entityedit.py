@@ -33,6 +33,7 @@ from annalist.models.recordview         import RecordView
 from annalist.models.recordfield        import RecordField
 from annalist.models.recordtypedata     import RecordTypeData
 from annalist.models.entitydata         import EntityData
+from annalist.models.typedatarename    import rename_type_data, resume_type_data_renames
 
 from annalist.views.uri_builder         import uri_base, uri_with_params
 from annalist.views.displayinfo         import DisplayInfo
@@ -1368,26 +1369,41 @@ class GenericEntityEditView(AnnalistGenericView):
             viewinfo.collection, old_type_id
             )
         dst_typeinfo = EntityTypeInfo(
-            viewinfo.collection, new_type_id, 
-            create_typedata=True
+            viewinfo.collection, new_type_id
             )
         if new_typeinfo.entity_exists(new_type_id):
-            # Enumerate type instance records and move to new type
             remove_OK = True
-            for d in src_typeinfo.enum_entities():
-                data_id   = d.get_id()
-                data_vals = d.get_values()
-                data_vals[ANNAL.CURIE.type_id] = new_type_id
-                data_vals[ANNAL.CURIE.type]    = dst_typeinfo.get_type_uri()
-                if self.rename_entity(
-                    src_typeinfo, data_id, 
-                    dst_typeinfo, data_id, data_vals
+            with viewinfo.collection.batch_updates():
+                # Complete any earlier type data renames that were interrupted
+                resume_type_data_renames(viewinfo.collection)
+                # Rename type data directory and update instances in place if possible
+                if rename_type_data(
+                    viewinfo.collection, old_type_id, new_type_id,
+                    dst_typeinfo.get_type_uri(), dst_typeinfo.get_all_type_uris()
                     ):
-                    remove_OK = False
+                    src_entities = []
+                else:
+                    dst_typeinfo = EntityTypeInfo(
+                        viewinfo.collection, new_type_id, 
+                        create_typedata=True
+                        )
+                    src_entities = src_typeinfo.enum_entities()
+                # Enumerate any remaining type instance records and move to new type
+                for d in src_entities:
+                    data_id   = d.get_id()
+                    data_vals = d.get_values()
+                    data_vals[ANNAL.CURIE.type_id] = new_type_id
+                    data_vals[ANNAL.CURIE.type]    = dst_typeinfo.get_type_uri()
+                    if self.rename_entity(
+                        src_typeinfo, data_id, 
+                        dst_typeinfo, data_id, data_vals
+                        ):
+                        remove_OK = False
             # Finally, remove old type record:
             if remove_OK:       # Precautionary
                 new_typeinfo.remove_entity(old_type_id)
-                RecordTypeData.remove(new_typeinfo.entitycoll, old_type_id)
+                if RecordTypeData.exists(new_typeinfo.entitycoll, old_type_id):
+                    RecordTypeData.remove(new_typeinfo.entitycoll, old_type_id)
         else:
             log.warning(
                 "Failed to rename type %s to type %s"%
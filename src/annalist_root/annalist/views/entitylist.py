@@ -20,7 +20,9 @@ from annalist                           import layout
 from annalist                           import message
 from annalist.exceptions                import Annalist_Error
 from annalist.identifiers               import RDFS, ANNAL
-from annalist.util                      import split_type_entity_id, extract_entity_id, make_resource_url
+from annalist.util                      import (
+    split_type_entity_id, extract_entity_id, make_type_entity_id, make_resource_url
+    )
 
 import annalist.models.entitytypeinfo as entitytypeinfo
 from annalist.models.collection         import Collection
@@ -64,6 +66,7 @@ listentityvaluemap  = (
         , SimpleValueMap(c='scope',                 e=None, f='scope'            )
         , SimpleValueMap(c='continuation_url',      e=None, f='continuation_url' )
         , SimpleValueMap(c='continuation_param',    e=None, f=None               )
+        , SimpleValueMap(c='next_page_url',         e=None, f=None               )
         # Field data is handled separately during processing of the form description
         # Form and interaction control (hidden fields)
         ])
@@ -151,6 +154,53 @@ class EntityGenericListView(AnnalistGenericView):
 
         return entitymap
 
+    def get_list_paging(self, request_dict):
+        """
+        Returns paging parameters (offset, limit, after) from a list request (see 
+        `EntityFinder.get_entities_sorted`).  If no limit is supplied, the 
+        ANNALIST_LIST_PAGE_SIZE setting is used, with 0 meaning no limit.
+        """
+        def int_param(name, default):
+            try:
+                val = int(request_dict.get(name, default) or 0)
+            except ValueError:
+                log.warning("EntityGenericListView: invalid %s parameter %r"%(name, request_dict[name]))
+                val = default
+            return max(val, 0)
+        offset = int_param('offset', 0)
+        limit  = int_param('limit', getattr(settings, "ANNALIST_LIST_PAGE_SIZE", 0)) or None
+        after  = request_dict.get('after', None) or None
+        return (offset, limit, after)
+
+    def get_list_entities(self, finder, request_dict, **kwargs):
+        """
+        Returns a pair (entity_list, next_page_url) for a list request, where 
+        `entity_list` is a sorted list of entities selected for the page requested,
+        and `next_page_url` is a URL for the following page, or None if there are
+        no more entities to list.
+
+        finder      is an EntityFinder object used to select entities.
+        request_dict is a dictionary of request parameters, including any paging
+                    parameters (see `get_list_paging`).
+        kwargs      are additional parameters for `EntityFinder.get_entities_sorted`.
+        """
+        (offset, limit, after) = self.get_list_paging(request_dict)
+        # One more entity than the page size is requested, to see if there are more
+        entity_list = finder.get_entities_sorted(
+            offset=offset, limit=limit and limit+1, after=after, **kwargs
+            )
+        next_page_url = None
+        if limit and len(entity_list) > limit:
+            entity_list   = entity_list[:limit]
+            last          = entity_list[-1]
+            next_page_url = uri_with_params(
+                self.get_request_path(), request_dict,
+                { 'offset':   None
+                , 'limit':    str(limit)
+                , 'after':    make_type_entity_id(last.get_type_id(), last.get_id())
+                })
+        return (entity_list, next_page_url)
+
     # GET
 
     def get(self, request, coll_id=None, type_id=None, list_id=None):
@@ -173,13 +223,12 @@ class EntityGenericListView(AnnalistGenericView):
             selector    = listinfo.recordlist.get_values().get(ANNAL.CURIE.list_entity_selector, "")
             user_perms  = self.get_permissions(listinfo.collection)
             # @@TODO: is this context value even usable??
-            entity_list = (
-                EntityFinder(listinfo.collection, selector=selector)
-                    .get_entities_sorted(
-                        user_perms, type_id=type_id, altscope=scope,
-                        context={'list': listinfo.recordlist}, 
-                        search=search_for
-                        )
+            (entity_list, next_page_url) = self.get_list_entities(
+                EntityFinder(listinfo.collection, selector=selector), 
+                request.GET.dict(),
+                user_permissions=user_perms, type_id=type_id, altscope=scope,
+                context={'list': listinfo.recordlist}, 
+                search=search_for
                 )
             typeinfo      = listinfo.entitytypeinfo
             entityvallist = { '_list_entities_': [ get_entity_values(typeinfo, e) for e in entity_list ] }
@@ -195,6 +244,7 @@ class EntityGenericListView(AnnalistGenericView):
                 , 'list_id':                listinfo.list_id
                 , 'url_list_id':            list_id
                 , 'search_for':             search_for
+                , 'next_page_url':          next_page_url or ""
                 , 'list_choices':           self.get_list_choices_field(listinfo)
                 , 'collection_view':        self.collection_view_url
                 , 'default_view_id':        listinfo.recordlist[ANNAL.CURIE.default_view]
@@ -77,12 +77,11 @@ class EntityGenericListJsonView(EntityGenericListView):
         try:
             selector    = listinfo.recordlist.get_values().get(ANNAL.CURIE.list_entity_selector, "")
             user_perms  = self.get_permissions(listinfo.collection)
-            entity_list = (
-                EntityFinder(listinfo.collection, selector=selector)
-                    .get_entities_sorted(
-                        user_perms, type_id=type_id, altscope=scope,
-                        context=listinfo.recordlist, search=search_for
-                        )
+            (entity_list, next_page_url) = self.get_list_entities(
+                EntityFinder(listinfo.collection, selector=selector), 
+                request.GET.dict(),
+                user_permissions=user_perms, type_id=type_id, altscope=scope,
+                context=listinfo.recordlist, search=search_for
                 )
             typeinfo      = listinfo.entitytypeinfo
             entityvallist = [ self.strip_context_values(e, base_url) for e in entity_list ]
@@ -119,7 +118,10 @@ class EntityGenericListJsonView(EntityGenericListView):
             json.dumps(jsondata, indent=2, separators=(',', ': ')),
             content_type=return_type
             )
-        response = self.add_link_header(response, [{"rel": "canonical", "ref": list_url}] )
+        links    = [{"rel": "canonical", "ref": list_url}]
+        if next_page_url:
+            links.append({"rel": "next", "ref": next_page_url})
+        response = self.add_link_header(response, links)
         return response
 
 # End.
@@ -447,14 +447,14 @@ def field_description_from_view_field(collection, field, view_context=None, grou
     # field_id    = field.get(ANNAL.CURIE.field_id, "Field_id_missing")  # Field ID slug in URI
     #@@
     field_id    = extract_entity_id(field[ANNAL.CURIE.field_id])
-    recordfield = RecordField.load(collection, field_id, altscope="all")
+    recordfield = collection.get_field_config(field_id)
     if recordfield is None:
         log.warning("Can't retrieve definition for field %s"%(field_id))
-        recordfield = RecordField.load(collection, "Field_missing", altscope="all")
+        recordfield = collection.get_field_config("Field_missing")
     # If field references group, pull in group details
     group_ref = extract_entity_id(recordfield.get(ANNAL.CURIE.group_ref, None))
     if group_ref:
-        group_view = RecordGroup.load(collection, group_ref, altscope="all")
+        group_view = collection.get_group(group_ref)
         if not group_view:
             log.error("Group %s used in field %s"%(group_ref, field_id))
             # log.error("".join(traceback.format_stack()))
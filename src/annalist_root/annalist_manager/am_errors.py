@@ -47,5 +47,6 @@ AM_INSTALLCOLLFAIL  = 15        # Failed to install collection
 AM_COPYCOLLFAIL     = 16        # Failed to copy collection
 AM_MIGRATECOLLFAIL  = 17        # Failed to migrate collection
 AM_COPYENTITYFAIL   = 18        # Failed to copy entity
+AM_INDEXCOLLFAIL    = 19        # Failed to build collection search index
 
 # End.
\ No newline at end of file
@@ -36,6 +36,8 @@ command_summary_help = ("\n"+
     "  %(prog)s copycollection old_coll_id new_coll_id [ CONFIG ]\n"+
     "  %(prog)s migrationreport old_coll_id new_coll_id [ CONFIG ]\n"+
     "  %(prog)s migratecollection coll_id [ CONFIG ]\n"+
+    "  %(prog)s indexcollection coll_id [ CONFIG ]\n"+
+    "  %(prog)s removetombstones [ CONFIG ]\n"+
     "  %(prog)s runserver [ CONFIG ]\n"+
     "  %(prog)s sitedirectory [ CONFIG ]\n"+
     "  %(prog)s settingsmodule [ CONFIG ]\n"+
@@ -247,7 +249,10 @@ def am_help(options, progname):
             "\n"+
             "Copy collection 'old_coll_id' to a new collection called 'new_coll_id'\n"+
             "\n"+
-            "Existing collection data in 'old_coll_id' is left untouched.\n"+
+            "Existing collection data in 'old_coll_id' is left untouched.  Attached files\n"+
+            "are linked into the new collection where the file system allows, and are\n"+
+            "otherwise copied.  The numbers of entities and files copied, and the copy\n"+
+            "throughput, are displayed when the copy is complete.\n"+
             "\n"+
             config_options_help+
             "\n"+
@@ -299,6 +304,36 @@ def am_help(options, progname):
             "defined for types used by the collection, along with any software version\mn"+
             "migrations that may be applicable.\n"+
             "\n"+
+            "Each entity saved is stamped with the current entity migration version, so that\n"+
+            "migrations are not applied again when the entity is subsequently read.\n"+
+            "\n"+
+            "Entities are migrated by several worker processes.  If the migration is\n"+
+            "interrupted, running the command again skips entities already migrated.\n"+
+            "\n"+
+            config_options_help+
+            "\n"+
+            "")
+    elif options.args[0].startswith("indexc"):
+        help_text = ("\n"+
+            "  %(prog)s indexcollection coll_id [ CONFIG ]\n"+
+            "\n"+
+            "This command builds (or rebuilds) the index of entity values for collection\n"+
+            "'coll_id' that is used to select entities for list searches and list entity\n"+
+            "selectors.  The index is used only after it has been built by this command,\n"+
+            "and is then updated as entities are saved.\n"+
+            "\n"+
+            config_options_help+
+            "\n"+
+            "")
+    elif options.args[0].startswith("removet"):
+        help_text = ("\n"+
+            "  %(prog)s removetombstones [ CONFIG ]\n"+
+            "\n"+
+            "This command removes any data left behind by removal of collections and\n"+
+            "other entities.  Removed entities are renamed and then deleted by the\n"+
+            "Annalist server in the background:  if the server is stopped before this\n"+
+            "is complete, the renamed data remains until this command is used.\n"+
+            "\n"+
             config_options_help+
             "\n"+
             "")
@@ -45,6 +45,7 @@ from am_createuser          import (
 from am_managecollections   import (
     am_installcollection, am_copycollection,
     am_migrationreport, am_migratecollection, 
+    am_indexcollection, am_removetombstones
     )
 from am_help                import am_help, command_summary_help
 
@@ -148,6 +149,10 @@ def run(userhome, userconfig, options, progname):
         return am_migrationreport(annroot, userhome, options)
     if options.command.startswith("migratec"):              # migratecollection
         return am_migratecollection(annroot, userhome, options)
+    if options.command.startswith("indexc"):                # indexcollection
+        return am_indexcollection(annroot, userhome, options)
+    if options.command.startswith("removet"):               # removetombstones
+        return am_removetombstones(annroot, userhome, options)
     if options.command.startswith("runs"):                  # runserver
         return am_runserver(annroot, userhome, options)
     if options.command.startswith("serv"):                  # serverlog
@@ -33,6 +33,9 @@ from annalist.models.recordlist     import RecordList
 from annalist.models.recordfield    import RecordField
 from annalist.models.recordgroup    import RecordGroup
 from annalist.models.collectiondata import initialize_coll_data, copy_coll_data, migrate_coll_data
+from annalist.models.collectioncopy import CopyStats
+from annalist.models.entitytombstone import reap_tombstones
+from annalist.models.entityfinder   import EntityFinder
 
 import am_errors
 from am_settings                    import am_get_settings, am_get_site_settings, am_get_site
@@ -463,7 +466,11 @@ def am_migrationreport(annroot, userhome, options):
     if status != am_errors.AM_SUCCESS:
         return status
     if len(options.args) > 2:
-        print("Unexpected arguments for %s: (%s)"%(options.command, " ".join(options.args)), file=sys.stderr)
+        print(
+            "Unexpected arguments for %s: (%s)"%
+            (options.command, " ".join(options.args)), 
+            file=sys.stderr
+            )
         return am_errors.AM_UNEXPECTEDARGS
     old_coll_id = getargvalue(getarg(options.args, 0), "Old collection Id: ")
     old_coll    = Collection.load(site, old_coll_id)
@@ -640,7 +647,9 @@ def am_copycollection(annroot, userhome, options):
     # Copy collection now
     print("Copying collection '%s' to '%s'"%(old_coll_id, new_coll_id))
     new_coll = site.add_collection(new_coll_id, old_coll.get_values())
-    msgs     = copy_coll_data(old_coll, new_coll)
+    stats    = CopyStats()
+    msgs     = copy_coll_data(old_coll, new_coll, stats=stats)
+    print(stats.summary())
     if msgs:
         for msg in msgs:
             print(msg)
@@ -675,11 +684,83 @@ def am_migratecollection(annroot, userhome, options):
         return am_errors.AM_NOCOLLECTION
     status = am_errors.AM_SUCCESS
     print("Apply data migrations in collection '%s'"%(coll_id,))
-    msgs   = migrate_coll_data(coll)
+    msgs   = migrate_coll_data(coll, processes=None)
     if msgs:
         for msg in msgs:
             print(msg)
         status = am_errors.AM_MIGRATECOLLFAIL
     return status
 
+def am_indexcollection(annroot, userhome, options):
+    """
+    Build the search index for a specified collection
+
+        annalist_manager indexcollection coll
+
+    Builds (or rebuilds) the index of entity values that is used to select
+    entities for list searches and list entity selectors.
+
+    annroot     is the root directory for the Annalist software installation.
+    userhome    is the home directory for the host system user issuing the command.
+    options     contains options parsed from the command line.
+
+    returns     0 if all is well, or a non-zero status code.
+                This value is intended to be used as an exit status code
+                for the calling program.
+    """
+    status, settings, site = get_settings_site(annroot, userhome, options)
+    if status != am_errors.AM_SUCCESS:
+        return status
+    if len(options.args) > 1:
+        print(
+            "Unexpected arguments for %s: (%s)"%
+            (options.command, " ".join(options.args)), 
+            file=sys.stderr
+            )
+        return am_errors.AM_UNEXPECTEDARGS
+    coll_id = getargvalue(getarg(options.args, 0), "Collection Id: ")
+    coll    = Collection.load(site, coll_id)
+    if not (coll and coll.get_values()):
+        print("Collection not found: %s"%(coll_id), file=sys.stderr)
+        return am_errors.AM_NOCOLLECTION
+    print("Build search index for collection '%s'"%(coll_id,))
+    if not EntityFinder(coll).build_search_index():
+        print("Search index is not used (see ANNALIST_SEARCH_INDEX)", file=sys.stderr)
+        return am_errors.AM_INDEXCOLLFAIL
+    return am_errors.AM_SUCCESS
+
+def am_removetombstones(annroot, userhome, options):
+    """
+    Remove directory trees left behind by entity removals
+
+        annalist_manager removetombstones
+
+    Entities (including collections) that are removed are first renamed to 
+    tombstones, which are then removed by a background thread in the server
+    process.  This command removes any tombstones that remain in the site data
+    (e.g. because the server was stopped before they were removed).
+
+    annroot     is the root directory for the Annalist software installation.
+    userhome    is the home directory for the host system user issuing the command.
+    options     contains options parsed from the command line.
+
+    returns     0 if all is well, or a non-zero status code.
+                This value is intended to be used as an exit status code
+                for the calling program.
+    """
+    status, settings, site = get_settings_site(annroot, userhome, options)
+    if status != am_errors.AM_SUCCESS:
+        return status
+    if len(options.args) > 0:
+        print(
+            "Unexpected arguments for %s: (%s)"%
+            (options.command, " ".join(options.args)), 
+            file=sys.stderr
+            )
+        return am_errors.AM_UNEXPECTEDARGS
+    tombs = reap_tombstones(site._entitydir.rstrip("/"))
+    for tomb in tombs:
+        print("Removed %s"%(tomb,))
+    return am_errors.AM_SUCCESS
+
 # End.
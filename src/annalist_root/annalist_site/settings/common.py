@@ -111,6 +111,46 @@ STATICFILES_DIRS = (
     SITE_SRC_ROOT+"/annalist/data/static/",
 )
 
+# Entity storage driver: "file" (directory tree) or "sqlite" (single database file)
+ANNALIST_ENTITY_STORAGE = "file"
+
+# Maximum size (bytes of stored data) of entity values kept in the entity cache (0 disables)
+ANNALIST_ENTITY_CACHE_SIZE = 32*1024*1024
+
+# Use per-type manifest files to enumerate entity data records
+ANNALIST_ENTITY_MANIFEST = True
+
+# Number of threads used to read entity data concurrently (0 or 1 for no threads)
+ANNALIST_LOAD_THREADS = 8
+
+# Synchronize saved entity data to storage (fsync) before an update is complete.
+# Entity bodies are always replaced atomically (by renaming a temporary file), so
+# this is needed only for durability against a system crash, at the cost of an
+# fsync for every entity saved outside a batch of updates.
+ANNALIST_SYNC_WRITES = False
+
+# Remove directory trees of deleted entities (e.g. collections) in a background thread
+ANNALIST_REMOVE_IN_BACKGROUND = True
+
+# Number of worker processes used to copy collection data (0 or 1 for no worker processes)
+ANNALIST_COPY_PROCESSES = 4
+
+# Number of worker processes used by 'annalist-manager migratecollection' (0 or 1 for no worker processes)
+ANNALIST_MIGRATE_PROCESSES = 4
+
+# Use a per-collection index of string values (built by 'annalist-manager indexcollection')
+# to select candidate entities for list searches and list entity selectors
+ANNALIST_SEARCH_INDEX = True
+
+# Check that each candidate entity selected by the search index contains the search term
+ANNALIST_SEARCH_VERIFY = True
+
+# Properties whose values are recorded in the collection index, used by list entity selectors
+ANNALIST_PROPERTY_INDEXES = ["@type"]
+
+# Default number of entities on each page of a list display (0 for no limit; cf. 'limit' list URL parameter)
+ANNALIST_LIST_PAGE_SIZE = 0
+
 ANNALIST_VERSION = __version__
 ANNALIST_VERSION_MSG = "Annalist version %s (common configuration)"%(ANNALIST_VERSION)
 